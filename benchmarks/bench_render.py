@@ -0,0 +1,226 @@
+# -*- encoding: utf-8 -*-
+"""time each stage of the compilation and of the rendering of a template,
+for templates growing in loop rows, nesting depth, fields and images
+
+The classes follow the conventions of asv (airspeed velocity): run them with
+``asv run`` or without asv with ``python -m benchmarks.run``.
+"""
+from io import BytesIO
+
+import lxml.etree
+
+from genshi.core import Stream
+from genshi.template import MarkupTemplate
+
+from py3o.template import Template
+from py3o.template.main import get_markup_stream, scan_instructions, \
+    scan_markers
+from py3o.template.tests.generator import SyntheticTemplate, VALUE_TYPES
+
+
+class _Phases(object):
+    """the stages of a rendering, each timed on its own. Subclasses give the
+    size of the template and of its data
+    """
+    # most stages modify the template they are given, which is rebuilt by
+    # setup before every call
+    number = 1
+    repeat = 5
+
+    paragraph_loops = 1
+    table_loops = 0
+    value_types = ('string',)
+
+    rows = 100
+    depth = 1
+    fields = 5
+    images = 0
+
+    def get_size(self, *params):
+        return self.rows, self.depth, self.fields, self.images
+
+    def setup(self, *params):
+        rows, depth, fields, images = self.get_size(*params)
+        synthetic = SyntheticTemplate(
+            paragraph_loops=self.paragraph_loops,
+            table_loops=self.table_loops,
+            depth=depth,
+            fields=fields,
+            value_types=self.value_types,
+            images=images,
+        )
+        self.template_data = synthetic.get_bytes()
+        self.data = synthetic.get_data(rows)
+        self.images_data = synthetic.get_images()
+
+        # a template ready for each stage
+        self.source = Template(self.template_data)
+
+        self.linked = Template(self.template_data)
+        self.link_instructions(self.linked)
+        self.markers = self.get_markers(self.linked)
+        self.linked._Template__prepare_userfield_decl(self.markers)
+
+        self.content_trees = self.get_content_trees()
+
+        self.compiled = Template(self.template_data).compile()
+        self.events = [
+            (fname, list(stream))
+            for fname, stream in self.compiled.generate(
+                self.data, self.images_data
+            )
+        ]
+
+    def get_content_trees(self):
+        template = Template(self.template_data)
+        self.link_instructions(template)
+        markers = self.get_markers(template)
+        template._Template__prepare_userfield_decl(markers)
+        template._Template__prepare_usertexts(markers)
+        template._Template__prepare_image_links(markers)
+        return template.content_trees
+
+    @staticmethod
+    def get_markers(template):
+        return [
+            scan_markers(content_tree, template.namespaces)
+            for content_tree in template.content_trees
+        ]
+
+    @staticmethod
+    def link_instructions(template):
+        starting_tags, closing_tags = template.handle_instructions(
+            template.content_trees, template.namespaces
+        )
+        for link, py3o_base in starting_tags:
+            template.handle_link(link, py3o_base, closing_tags[id(link)])
+
+    def time_init(self, *params):
+        """open the archive, its entries are only parsed when needed"""
+        Template(self.template_data)
+
+    def time_parse(self, *params):
+        """open the archive and parse the templated entries"""
+        Template(self.template_data).content_trees
+
+    def time_handle_links(self, *params):
+        """turn the py3o:// links into Genshi directives"""
+        self.link_instructions(self.source)
+
+    def time_prepare_usertexts(self, *params):
+        """turn the py3o user fields into Genshi expressions"""
+        self.linked._Template__prepare_usertexts(self.markers)
+
+    def time_genshi_compile(self, *params):
+        """build Genshi templates from the transformed entries"""
+        for content_tree in self.content_trees:
+            MarkupTemplate(get_markup_stream(content_tree)).stream
+
+    def time_genshi_reparse(self, *params):
+        """serialize the transformed entries and parse them as Genshi
+        templates, as the compilation used to"""
+        for content_tree in self.content_trees:
+            MarkupTemplate(lxml.etree.tostring(content_tree.getroot())).stream
+
+    def time_generate(self, *params):
+        """evaluate the Genshi templates against the data"""
+        for fname, stream in self.compiled.generate(
+            self.data, self.images_data
+        ):
+            for event in stream:
+                pass
+
+    def time_serialize(self, *params):
+        """serialize generated events to XML"""
+        for fname, events in self.events:
+            for chunk in Stream(events).serialize(cache=False):
+                pass
+
+    def time_save_output(self, *params):
+        """generate, serialize and write the output archive"""
+        for status in self.compiled._save_output(
+            BytesIO(),
+            self.compiled.generate(self.data, self.images_data),
+            self.images_data,
+        ):
+            pass
+
+
+class LoopRows(_Phases):
+    params = [10, 100, 1000, 10000]
+    param_names = ['rows']
+
+    def get_size(self, rows):
+        return rows, self.depth, self.fields, self.images
+
+
+class TableRows(LoopRows):
+    """loops repeating table rows, with fields of every value type"""
+    paragraph_loops = 0
+    table_loops = 1
+    fields = 1
+    value_types = [value_type for value_type, attribute, func in VALUE_TYPES]
+
+
+class NestingDepth(_Phases):
+    rows = 10
+    params = [1, 2, 4, 6]
+    param_names = ['depth']
+
+    def get_size(self, depth):
+        return self.rows, depth, self.fields, self.images
+
+
+class FieldCount(_Phases):
+    params = [1, 10, 100, 500]
+    param_names = ['fields']
+
+    def get_size(self, fields):
+        return self.rows, self.depth, fields, self.images
+
+
+class ImageCount(_Phases):
+    rows = 10
+    params = [0, 10, 100, 500]
+    param_names = ['images']
+
+    def get_size(self, images):
+        return self.rows, self.depth, self.fields, images
+
+
+class MarkerScan(object):
+    """finding the py3o markers of a template mostly made of static
+    paragraphs: the walks of the compilation against the XPath queries they
+    replace
+    """
+    params = [1000, 10000, 100000]
+    param_names = ['paragraphs']
+
+    # string queries as they were run before the single walks, recompiled
+    # by lxml at each call
+    queries = [
+        "//text:soft-page-break",
+        "//text:a[starts-with(@xlink:href, 'py3o://')]",
+        "//text:user-field-decl[starts-with(@text:name, 'py3o.')]",
+        "//text:user-field-get[starts-with(@text:name, 'py3o.')]",
+        "//draw:frame[starts-with(@draw:name, 'py3o.')]",
+    ]
+
+    def setup(self, paragraphs):
+        synthetic = SyntheticTemplate(
+            paragraph_loops=2, table_loops=1, depth=2, fields=5, images=2,
+            document_fields=5, static_paragraphs=paragraphs,
+        )
+        self.template = Template(synthetic.get_bytes())
+        # the entries are parsed when first asked for, not while timed
+        self.content_trees = self.template.content_trees
+
+    def time_xpath_queries(self, paragraphs):
+        for content_tree in self.content_trees:
+            for query in self.queries:
+                content_tree.xpath(query, namespaces=self.template.namespaces)
+
+    def time_single_walks(self, paragraphs):
+        for content_tree in self.content_trees:
+            scan_instructions(content_tree, self.template.namespaces)
+            scan_markers(content_tree, self.template.namespaces)
@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+"""run the benchmarks without asv and print the best time of each of them
+
+    python -m benchmarks.run [-r REPEAT] [FILTER ...]
+
+Only the benchmarks whose name contains one of the filters are run, for
+example ``python -m benchmarks.run LoopRows.time_generate``.
+"""
+from __future__ import print_function
+
+import argparse
+import inspect
+import itertools
+import sys
+import timeit
+
+from benchmarks import bench_render
+
+MODULES = [bench_render]
+
+
+def get_benchmarks(modules):
+    """yield the name, class and method name of each benchmark"""
+    for module in modules:
+        for name, cls in sorted(vars(module).items()):
+            if name.startswith('_') or not inspect.isclass(cls):
+                continue
+
+            if cls.__module__ != module.__name__:
+                continue
+
+            for method in sorted(dir(cls)):
+                if method.startswith('time_'):
+                    yield '%s.%s' % (name, method), cls, method
+
+
+def get_params(cls):
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+
+    if getattr(cls, 'param_names', None) and len(cls.param_names) > 1:
+        return list(itertools.product(*params))
+
+    return [(param,) for param in params]
+
+
+def run_benchmark(cls, method, params, repeat):
+    """return the best time of repeat calls, setup running before each"""
+    times = []
+    for i in range(repeat):
+        benchmark = cls()
+        if hasattr(benchmark, 'setup'):
+            benchmark.setup(*params)
+
+        func = getattr(benchmark, method)
+        start = timeit.default_timer()
+        func(*params)
+        times.append(timeit.default_timer() - start)
+
+    return min(times)
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return '%.3f%s' % (seconds * scale, unit)
+
+    return '%.3fus' % (seconds * 1e6)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-r', '--repeat', type=int, default=None,
+                        help='the number of calls of each benchmark')
+    parser.add_argument('filters', nargs='*')
+    args = parser.parse_args(argv)
+
+    for name, cls, method in get_benchmarks(MODULES):
+        if args.filters and not any(f in name for f in args.filters):
+            continue
+
+        repeat = args.repeat or getattr(cls, 'repeat', 3)
+        for params in get_params(cls):
+            best = run_benchmark(cls, method, params, repeat)
+            print('%-45s %-12s %10s' % (
+                name,
+                ','.join(str(param) for param in params),
+                format_time(best),
+            ))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
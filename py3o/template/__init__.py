@@ -4,5 +4,11 @@ documents into real OpenOffice documents with all your data merged-in.
 """
 
 from py3o.template.main import Template
+from py3o.template.main import CompiledTemplate
+from py3o.template.main import CompressionPolicy
 from py3o.template.main import TemplateException
+from py3o.template.stats import RenderStats
+from py3o.template.columnar import ColumnarRows
+from py3o.template.formatting import NumberFormatter
 from py3o.template.decoder import Decoder
+from py3o.template.decoder import ExtractionPlan
@@ -0,0 +1,610 @@
+# -*- encoding: utf-8 -*-
+"""render one template against many data sets, for mail-merge workloads
+"""
+import multiprocessing
+import os
+import traceback
+
+from copy import copy
+
+import six
+
+from genshi.core import Attrs, QName, Stream, START, END, TEXT, START_NS, \
+    END_NS
+from genshi.input import XML
+from genshi.template.base import EXPR, SUB
+from genshi.template.eval import Expression
+from six.moves import cPickle as pickle
+from six.moves import queue
+
+from py3o.template.main import Template, CompiledTemplate, \
+    TemplateException, XML_NS
+from py3o.template.static import StaticTemplate
+
+# the name of the paragraph style of the default merge separator
+PAGE_BREAK_STYLE = 'py3o_page_break'
+DEFAULT_SEPARATOR = '<text:p text:style-name="%s"/>' % PAGE_BREAK_STYLE
+
+# the children of office:text declaring things for the whole document, they
+# are not repeated when merging records
+TEXT_DECLS = (
+    'office:forms',
+    'text:tracked-changes',
+    'text:variable-decls',
+    'text:sequence-decls',
+    'text:user-field-decls',
+    'text:dde-connection-decls',
+    'text:alphabetical-index-auto-mark-file',
+)
+
+# how often, in seconds, render_many checks that the workers rendering its
+# records are still alive while it waits for their results
+WORKER_POLL_INTERVAL = 0.5
+
+# the compiled template of a worker process and the queue where it tells
+# which record it renders, set by init_worker
+_worker_template = None
+_worker_options = None
+_worker_started = None
+
+try:
+    SimpleQueue = multiprocessing.SimpleQueue
+except AttributeError:
+    # Python 2
+    from multiprocessing.queues import SimpleQueue
+
+
+class RenderResult(object):
+    """The outcome of the rendering of one data set by render_many"""
+
+    def __init__(self, index, output=None, error=None):
+        """
+        @param index: the position of the data set in the input iterable
+        @type index: int
+
+        @param output: what the output factory returned for this data set
+        @type output: a filename or a file-like object
+
+        @param error: the formatted traceback of the error that prevented the
+        rendering, None if it succeeded
+        @type error: string
+        """
+        self.index = index
+        self.output = output
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<RenderResult %s %s>' % (
+            self.index, 'ok' if self.ok else 'error'
+        )
+
+
+def get_compiled_template(template, ignore_undefined_variables=False):
+    if isinstance(template, CompiledTemplate):
+        return template
+
+    if isinstance(template, Template):
+        return template.compile()
+
+    return Template(
+        template, ignore_undefined_variables=ignore_undefined_variables
+    ).compile()
+
+
+def write_output(output, content):
+    """write a rendered document to a filename or a file-like object"""
+    if isinstance(output, six.string_types):
+        with open(output, 'wb') as f:
+            f.write(content)
+    else:
+        output.write(content)
+
+
+def discard_output(output):
+    """remove the file of a document that failed, so that a failed result
+    never points at a partial document"""
+    if isinstance(output, six.string_types) and os.path.exists(output):
+        os.unlink(output)
+
+
+def init_worker(compiled, options, started):
+    global _worker_template, _worker_options, _worker_started
+    _worker_template = compiled
+    _worker_options = options
+    _worker_started = started
+
+
+def render_record(task):
+    """render a pickled data set in a worker process and return its index,
+    the rendered document and the error that occurred if any
+    """
+    index, payload = task
+    # written to the pipe before the rendering starts, so that the record
+    # is known even if the process dies while rendering it
+    _worker_started.put((os.getpid(), index))
+    try:
+        data = pickle.loads(payload)
+        return index, _worker_template.render_to_bytes(
+            data, **_worker_options
+        ), None
+
+    except Exception:
+        return index, None, traceback.format_exc()
+
+
+def render_many(
+        template, records, output_factory, workers=None, max_in_flight=None,
+        ordered=True, images=None, compression=None,
+        ignore_undefined_variables=False
+):
+    """a generator rendering a template once per data set, yielding a
+    RenderResult for each of them
+
+    The template is compiled once and the data sets are rendered by a pool
+    of worker processes. At most max_in_flight data sets are read from the
+    records iterable ahead of the ones already yielded, so that memory use
+    does not depend on the number of records. An error while rendering a data
+    set is reported in its result and does not stop the batch, as is the
+    death of the worker process rendering it. The file of a failed data set
+    is removed.
+
+    @param template: the template to render
+    @type template: CompiledTemplate, Template or anything Template accepts
+    as its template
+
+    @param records: the data sets to render. They must be picklable when
+    workers are used
+    @type records: an iterable of dictionaries
+
+    @param output_factory: a callable receiving the index and the data of a
+    record and returning where its document must be written
+    @type output_factory: a callable returning a filename or a writable
+    binary file-like object
+
+    @param workers: the number of worker processes, the number of CPUs if
+    None. 0 renders the records one after the other in the current process
+    @type workers: int
+
+    @param max_in_flight: the maximum number of records being rendered or
+    waiting to be yielded, twice the number of workers if None
+    @type max_in_flight: int
+
+    @param ordered: yield the results in the order of the records if True,
+    as soon as they are rendered otherwise
+    @type ordered: boolean
+
+    @param images: the image contents keyed by their identifier, shared by
+    all the records
+    @type images: dictionary
+
+    @param compression: how the entries of the outputs are compressed
+    @type compression: CompressionPolicy
+
+    @param ignore_undefined_variables: used when the template has to be
+    compiled
+    @type ignore_undefined_variables: boolean
+    """
+    compiled = get_compiled_template(
+        template, ignore_undefined_variables=ignore_undefined_variables
+    )
+    options = dict(images=images, compression=compression)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if not workers:
+        for index, record in enumerate(records):
+            output = None
+            try:
+                output = output_factory(index, record)
+                if isinstance(output, six.string_types):
+                    compiled.render(record, output, **options)
+                else:
+                    write_output(
+                        output, compiled.render_to_bytes(record, **options)
+                    )
+
+            except Exception:
+                error = traceback.format_exc()
+                discard_output(output)
+                yield RenderResult(index, output, error)
+
+            else:
+                yield RenderResult(index, output)
+
+        return
+
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+
+    started = SimpleQueue()
+    pool = multiprocessing.Pool(
+        workers, initializer=init_worker,
+        initargs=(compiled, options, started),
+    )
+    try:
+        for result in _render_in_pool(
+            pool, started, records, output_factory, max_in_flight, ordered
+        ):
+            yield result
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def get_error_callback(completed, index):
+    """return the function reporting the exception that prevented a worker
+    from returning the result of a record"""
+    def error_callback(exception):
+        completed.put((index, None, ''.join(
+            traceback.format_exception_only(type(exception), exception)
+        )))
+
+    return error_callback
+
+
+def get_lost_records(pool, started, running):
+    """return the indexes of the records whose worker process died while
+    rendering them
+
+    @param started: the queue where the workers write their pid and the
+    index of the record they start rendering
+    @type started: SimpleQueue
+
+    @param running: the index of the last record started by each worker,
+    keyed by pid, updated from started
+    @type running: dictionary
+    """
+    while not started.empty():
+        pid, index = started.get()
+        running[pid] = index
+
+    # the pool replaces its dead workers, there is no public API to list
+    # them
+    alive = set(
+        process.pid for process in pool._pool if process.exitcode is None
+    )
+    return set(
+        index for pid, index in running.items() if pid not in alive
+    )
+
+
+def _render_in_pool(
+        pool, started, records, output_factory, max_in_flight, ordered
+):
+    completed = queue.Queue()
+    records = enumerate(records)
+    exhausted = False
+    # the records being rendered
+    pending = {}
+    # the results waiting for a previous record to be yielded
+    done = {}
+    next_index = 0
+    # the last record started by each worker and those whose worker was
+    # found dead at the previous check
+    running = {}
+    lost = set()
+
+    while True:
+        while not exhausted and len(pending) + len(done) < max_in_flight:
+            try:
+                index, record = next(records)
+            except StopIteration:
+                exhausted = True
+                break
+
+            pending[index] = record
+            try:
+                payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                completed.put((index, None, traceback.format_exc()))
+            else:
+                options = {}
+                if not six.PY2:
+                    options['error_callback'] = get_error_callback(
+                        completed, index
+                    )
+
+                pool.apply_async(
+                    render_record, ((index, payload),),
+                    callback=completed.put, **options
+                )
+
+        if not pending:
+            break
+
+        try:
+            index, content, error = completed.get(
+                timeout=WORKER_POLL_INTERVAL
+            )
+        except queue.Empty:
+            # the result of a record rendered by a worker that just died may
+            # still be on its way: it is only lost if it has not come by the
+            # next check
+            dead = get_lost_records(pool, started, running) & set(pending)
+            for index in dead & lost:
+                completed.put((
+                    index, None,
+                    "The worker process rendering this record died",
+                ))
+
+            lost = dead - lost
+            continue
+
+        if index not in pending:
+            # already reported as lost
+            continue
+
+        record = pending.pop(index)
+
+        output = None
+        if error is None:
+            try:
+                output = output_factory(index, record)
+                write_output(output, content)
+            except Exception:
+                error = traceback.format_exc()
+                discard_output(output)
+
+        result = RenderResult(index, output, error)
+        if not ordered:
+            yield result
+            continue
+
+        done[index] = result
+        while next_index in done:
+            yield done.pop(next_index)
+            next_index += 1
+
+
+def get_qname(namespaces, name):
+    """return the QName of a prefixed name such as text:p"""
+    prefix, localname = name.split(':', 1)
+    return QName('%s}%s' % (namespaces[prefix], localname))
+
+
+def slice_template(template, events):
+    """return a copy of a Genshi template that only renders some of its
+    top level events"""
+    sliced = copy(template)
+    sliced._stream = events
+    return sliced
+
+
+def renumber_lists(events, namespaces, lookup):
+    """yield the events of a template, the lists that have an xml:id being
+    given a new one by __py3o_list_id__ at each rendering
+
+    The lists outside of loops keep the id they have in the template, which
+    would be repeated for each merged record.
+    """
+    list_tag = get_qname(namespaces, 'text:list')
+    id_attr = QName('%sid' % XML_NS[1:])
+    for kind, data, pos in events:
+        if kind is START and data[0] == list_tag and id_attr in data[1]:
+            tag, attrs = data
+            list_id = [
+                (EXPR, Expression('__py3o_list_id__()', lookup=lookup), pos)
+            ]
+            data = tag, attrs | [(id_attr, list_id)]
+
+        elif kind is SUB:
+            directives, substream = data
+            data = directives, list(
+                renumber_lists(substream, namespaces, lookup)
+            )
+
+        yield kind, data, pos
+
+
+def get_page_break_style(namespaces):
+    """return the events of the paragraph style of the default separator"""
+    pos = (None, -1, -1)
+    style = get_qname(namespaces, 'style:style')
+    properties = get_qname(namespaces, 'style:paragraph-properties')
+    return [
+        (START, (style, Attrs([
+            (get_qname(namespaces, 'style:name'), PAGE_BREAK_STYLE),
+            (get_qname(namespaces, 'style:family'), 'paragraph'),
+        ])), pos),
+        (START, (properties, Attrs([
+            (get_qname(namespaces, 'fo:break-before'), 'page'),
+        ])), pos),
+        (END, properties, pos),
+        (END, style, pos),
+    ]
+
+
+def split_content(compiled, with_page_break_style=False):
+    """split the content.xml template of a text document into the templates
+    of what comes before the body of the document, of the body and of what
+    comes after it
+
+    @returns: a tuple of three Genshi templates
+    """
+    namespaces = compiled.namespaces
+    template = dict(compiled.templates)['content.xml']
+    if isinstance(template, StaticTemplate):
+        # the static chunks render the whole entry, the slices are rendered
+        # by Genshi
+        template = template.template
+
+    office_text = get_qname(namespaces, 'office:text')
+    automatic_styles = get_qname(namespaces, 'office:automatic-styles')
+    office_body = get_qname(namespaces, 'office:body')
+    text_decls = set(get_qname(namespaces, name) for name in TEXT_DECLS)
+
+    prefix, body, suffix = [], [], []
+    current = prefix
+    depth = 0
+    body_depth = None
+    for event in template.stream:
+        kind, data, pos = event
+
+        if current is prefix and body_depth is not None and (
+            depth == body_depth
+        ):
+            # a direct child of office:text
+            if kind == START and data[0] in text_decls:
+                pass
+
+            elif kind == TEXT and not data.strip():
+                pass
+
+            else:
+                current = body
+
+        if current is body and kind == END and depth == body_depth:
+            # closing office:text
+            current = suffix
+
+        if with_page_break_style and current is prefix and (
+            kind == END and data == automatic_styles
+        ):
+            prefix.extend(get_page_break_style(namespaces))
+            with_page_break_style = False
+
+        if with_page_break_style and kind == START and (
+            data[0] == office_body
+        ):
+            prefix.append((START, (automatic_styles, Attrs()), pos))
+            prefix.extend(get_page_break_style(namespaces))
+            prefix.append((END, automatic_styles, pos))
+            with_page_break_style = False
+
+        current.append(event)
+
+        if kind == START:
+            depth += 1
+            if data[0] == office_text:
+                body_depth = depth
+
+        elif kind == END:
+            depth -= 1
+
+    if body_depth is None:
+        raise TemplateException("Only text documents can be merged")
+
+    body = list(renumber_lists(body, namespaces, template.lookup))
+    return (
+        slice_template(template, prefix),
+        slice_template(template, body),
+        slice_template(template, suffix),
+    )
+
+
+def parse_separator(separator, namespaces):
+    """return the events of an XML fragment whose prefixes are the ones of
+    the template"""
+    wrapper = '<py3o %s>%s</py3o>' % (
+        ' '.join(
+            'xmlns:%s="%s"' % (prefix, uri)
+            for prefix, uri in namespaces.items()
+        ),
+        separator,
+    )
+    events = [
+        event for event in XML(wrapper)
+        if event[0] not in (START_NS, END_NS)
+    ]
+    # strip the wrapper
+    return events[1:-1]
+
+
+def render_merged(
+        template, records, outfile, separator=DEFAULT_SEPARATOR, images=None,
+        compression=None, spool_size=None, ignore_undefined_variables=False
+):
+    """render the body of a text template once per record, one after the
+    other in a single document
+
+    The records are read one at a time while the document is written, so
+    memory use does not depend on their number. Everything outside of the
+    body of the document, like the styles and headers, is rendered with the
+    first record.
+
+    @param template: the template to render
+    @type template: CompiledTemplate, Template or anything Template accepts
+    as its template
+
+    @param records: the data sets to render
+    @type records: a non empty iterable of dictionaries
+
+    @param outfile: the desired output for the resulting ODT document
+    @type outfile: a string representing the full filename for output or
+    a writable binary file-like object
+
+    @param separator: the XML inserted between two records, using the
+    prefixes of the template. The default is a paragraph breaking the page
+    @type separator: string
+
+    @param images: the image contents keyed by their identifier
+    @type images: dictionary
+
+    @param compression: how the entries of the output are compressed
+    @type compression: CompressionPolicy
+
+    @param spool_size: if given, each templated entry is spooled in a
+    temporary file spilling to disk above that many bytes instead of being
+    compressed straight into the output
+    @type spool_size: int
+
+    @param ignore_undefined_variables: used when the template has to be
+    compiled
+    @type ignore_undefined_variables: boolean
+    """
+    compiled = get_compiled_template(
+        template, ignore_undefined_variables=ignore_undefined_variables
+    )
+    records = iter(records)
+    try:
+        first = next(records)
+    except StopIteration:
+        raise TemplateException("There is no record to merge")
+
+    prefix, body, suffix = split_content(
+        compiled,
+        with_page_break_style=separator == DEFAULT_SEPARATOR,
+    )
+    separator_events = parse_separator(
+        separator or '', compiled.namespaces
+    )
+    # the ids of the lists are numbered across all the records
+    list_id = compiled.get_list_id_func()
+    first_dict = compiled.get_template_dict(first, images, list_id=list_id)
+
+    def merged_events():
+        for event in prefix.generate(**first_dict):
+            yield event
+
+        for event in body.generate(**first_dict):
+            yield event
+
+        for record in records:
+            for event in separator_events:
+                yield event
+
+            for event in body.generate(**compiled.get_template_dict(
+                record, images, list_id=list_id
+            )):
+                yield event
+
+        for event in suffix.generate(**first_dict):
+            yield event
+
+    output_streams = [
+        (fname, Stream(merged_events()) if fname == 'content.xml' else stream)
+        for fname, stream in compiled.generate(first, images)
+    ]
+
+    for status in compiled._save_output(
+        outfile, output_streams, images, spool_size=spool_size,
+        compression=compression,
+    ):
+        if not status:
+            raise TemplateException("unknown template error")
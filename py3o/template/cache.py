@@ -0,0 +1,283 @@
+# -*- encoding: utf-8 -*-
+"""a persistent on-disk cache of compiled templates, so that a new process
+does not have to transform and parse its templates again
+"""
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+
+import genshi
+import pkg_resources
+import six
+
+from six.moves import cPickle as pickle
+
+from py3o.template.formatting import DEFAULT_FORMATTER, get_formatter
+from py3o.template.main import Template, CompiledTemplate
+
+log = logging.getLogger(__name__)
+
+# bump this whenever the content of the CompiledTemplate changes
+CACHE_FORMAT = 9
+
+CACHE_SUFFIX = '.py3oc'
+
+
+def get_py3o_version():
+    try:
+        return pkg_resources.get_distribution('py3o.template').version
+    except pkg_resources.DistributionNotFound:
+        return 'unknown'
+
+
+def get_options_key(
+        ignore_undefined_variables=False, deterministic_ids=False,
+        huge_tree=False, formatter=None, data_styles=False
+):
+    """return a text identifying the options a template is compiled with,
+    see L{Template} for their meaning. A formatter given by its locale name
+    is identified by its symbols"""
+    if isinstance(formatter, six.string_types):
+        formatter = get_formatter(formatter)
+
+    return '%s:%s:%s:%r:%s' % (
+        bool(ignore_undefined_variables),
+        bool(deterministic_ids),
+        bool(huge_tree),
+        formatter or DEFAULT_FORMATTER,
+        bool(data_styles),
+    )
+
+
+class TemplateCache(object):
+    """Store compiled templates in a directory, keyed by a hash of the
+    template content and of the py3o, Genshi and Python versions.
+
+    The cache entries are pickles: the cache directory must only be writable
+    by trusted users.
+    """
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        """
+        @param directory: the directory holding the cache entries. It is
+        created if needed
+        @type directory: string
+
+        @param max_size: the total size in bytes of the cache entries above
+        which the least recently used ones are evicted. None means unbounded
+        @type max_size: int
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.versions = '%s:%s:%s:%s' % (
+            CACHE_FORMAT,
+            get_py3o_version(),
+            genshi.__version__,
+            sys.hexversion,
+        )
+
+    def get_key(self, template_data, **options):
+        """return the cache key of a template
+
+        @param template_data: the content of the template file
+        @type template_data: bytes
+
+        @param options: the options the template is compiled with, the
+        keyword arguments of L{get_options_key}
+        """
+        digest = hashlib.sha256(template_data)
+        digest.update(
+            (
+                '%s:%s' % (self.versions, get_options_key(**options))
+            ).encode('utf-8')
+        )
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """return the compiled template stored under the given key or None
+        if there is no such entry. Corrupt entries are removed.
+        """
+        path = self.get_path(key)
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+
+        try:
+            stored_key, compiled = pickle.load(f)
+            if stored_key != key or not isinstance(
+                compiled, CompiledTemplate
+            ):
+                raise ValueError("unexpected cache entry content")
+
+        except Exception:
+            log.warning("removing corrupt template cache entry %s", path,
+                        exc_info=True)
+            f.close()
+            self.discard(key)
+            return None
+
+        f.close()
+
+        # the modification time is used to find the least recently used
+        # entries
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return compiled
+
+    def set(self, key, compiled):
+        """store a compiled template under the given key and evict the least
+        recently used entries if the cache grew too large
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            suffix='.tmp', dir=self.directory
+        )
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, compiled), f, pickle.HIGHEST_PROTOCOL)
+
+            # the rename is atomic so a concurrent reader never sees a
+            # partially written entry
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, self.get_path(key))
+            else:
+                os.rename(tmp_path, self.get_path(key))
+
+        except Exception:
+            log.warning("could not store template cache entry %s", key,
+                        exc_info=True)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+
+        self.evict()
+
+    def discard(self, key):
+        try:
+            os.unlink(self.get_path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """remove the least recently used entries until the cache fits in
+        max_size
+        """
+        if self.max_size is None:
+            return
+
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+
+            total_size -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                os.unlink(os.path.join(self.directory, name))
+
+    def compile(
+            self, template, ignore_undefined_variables=False,
+            deterministic_ids=False, huge_tree=False, formatter=None,
+            data_styles=False
+    ):
+        """return the compiled form of a template, from the cache when
+        possible. Templates compiled with different options are stored in
+        different entries
+
+        @param template: a py3o template file
+        @type template: a string representing the full path name to a py3o
+        template file
+
+        @param ignore_undefined_variables: Not defined variables are replaced
+        with an empty string during template rendering if True
+        @type ignore_undefined_variables: boolean. Default is False
+
+        @param deterministic_ids: see L{Template}
+        @type deterministic_ids: boolean. Default is False
+
+        @param huge_tree: see L{Template}
+        @type huge_tree: boolean. Default is False
+
+        @param formatter: see L{Template}
+        @type formatter: NumberFormatter or string
+
+        @param data_styles: see L{Template}
+        @type data_styles: boolean. Default is False
+
+        @returns: CompiledTemplate
+        """
+        with open(template, 'rb') as f:
+            template_data = f.read()
+
+        return self.compile_data(
+            template_data,
+            ignore_undefined_variables=ignore_undefined_variables,
+            deterministic_ids=deterministic_ids,
+            huge_tree=huge_tree,
+            formatter=formatter,
+            data_styles=data_styles,
+        )
+
+    def compile_data(
+            self, template_data, ignore_undefined_variables=False,
+            deterministic_ids=False, huge_tree=False, formatter=None,
+            data_styles=False
+    ):
+        """return the compiled form of a template given as bytes, from the
+        cache when possible
+
+        @param template_data: the content of a py3o template file
+        @type template_data: bytes
+
+        The other parameters are those of L{compile}
+
+        @returns: CompiledTemplate
+        """
+        options = dict(
+            ignore_undefined_variables=ignore_undefined_variables,
+            deterministic_ids=deterministic_ids,
+            huge_tree=huge_tree,
+            formatter=formatter,
+            data_styles=data_styles,
+        )
+        key = self.get_key(template_data, **options)
+        compiled = self.get(key)
+        if compiled is None:
+            compiled = Template(template_data, **options).compile()
+            self.set(key, compiled)
+
+        return compiled
@@ -0,0 +1,146 @@
+# -*- encoding: utf-8 -*-
+"""iterate over columnar data, pandas DataFrames, pyarrow tables and record
+batches or NumPy structured arrays, in the loops of a template without
+building a Python object per row
+"""
+from six.moves import range, zip
+
+BATCH_SIZE = 1024
+
+
+class Row(object):
+    """The row of a columnar source being rendered: its values are its
+    attributes, set in place as the loop goes from one row to the next.
+
+    The same instance is given for every row of a loop, a row kept after its
+    iteration holds the values of the rows that came after it.
+    """
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __repr__(self):
+        return '<Row %r>' % self.__dict__
+
+
+def read_pandas(source):
+    columns = [source.iloc[:, i] for i in range(len(source.columns))]
+
+    def read_batch(start, stop):
+        return [column.iloc[start:stop].tolist() for column in columns]
+
+    return list(source.columns), len(source), read_batch
+
+
+def read_arrow(source):
+
+    def read_batch(start, stop):
+        batch = source.slice(start, stop - start)
+        return [column.to_pylist() for column in batch.columns]
+
+    return list(source.schema.names), source.num_rows, read_batch
+
+
+def read_numpy(source):
+    names = list(source.dtype.names)
+
+    def read_batch(start, stop):
+        return [source[name][start:stop].tolist() for name in names]
+
+    return names, len(source), read_batch
+
+
+def read_mapping(columns):
+    names = list(columns.keys())
+    arrays = [columns[name] for name in names]
+    lengths = set(len(array) for array in arrays)
+    if len(lengths) > 1:
+        raise ValueError('The columns do not have the same length')
+
+    def read_batch(start, stop):
+        return [
+            array[start:stop].tolist() if hasattr(array, 'tolist')
+            else list(array[start:stop])
+            for array in arrays
+        ]
+
+    return names, lengths.pop() if lengths else 0, read_batch
+
+
+def get_reader(source):
+    """return the function reading a columnar source if it is recognised,
+    None for any other object. The function returns the column names, the
+    number of rows and a function reading the values of a range of rows
+    column by column
+
+    The sources are recognised by the module of their type, so that none of
+    these libraries is imported by py3o and no attribute of an ORM object or
+    of an undefined variable is looked up.
+    """
+    module = type(source).__module__.split('.')[0]
+    if module == 'pandas':
+        if hasattr(source, 'iloc') and hasattr(source, 'columns'):
+            return read_pandas
+    elif module == 'pyarrow':
+        if hasattr(source, 'slice') and hasattr(source, 'schema'):
+            return read_arrow
+    elif module == 'numpy':
+        dtype = getattr(source, 'dtype', None)
+        if dtype is not None and dtype.names and source.ndim == 1:
+            return read_numpy
+
+    return None
+
+
+class ColumnarRows(object):
+    """The rows of columnar data, as iterated by the loops of a template.
+
+    The values are read by batches of rows, one column at a time, with the
+    conversion method of the library holding them (tolist or to_pylist), and
+    are set on a single L{Row} that the loop renders before going to the
+    next one. Columns the template does not display are converted along with
+    the others, select the columns of large tables before rendering them.
+
+    The loops iterating over a pandas DataFrame, a pyarrow Table or
+    RecordBatch or a one dimension NumPy structured array wrap them in this
+    class, wrap a dictionary of equal length columns explicitly:
+
+        data = {'rows': ColumnarRows({'name': names, 'amount': amounts})}
+    """
+
+    def __init__(self, source, batch_size=BATCH_SIZE):
+        """
+        @param source: a columnar source, or a dictionary of sequences or
+        arrays keyed by column name
+        @type source: DataFrame, Table, RecordBatch, ndarray or dict
+
+        @param batch_size: the number of rows converted at once
+        @type batch_size: int
+        """
+        reader = get_reader(source) or read_mapping
+        self.names, self.length, self.read_batch = reader(source)
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        row = Row()
+        values = row.__dict__
+        names = self.names
+        for start in range(0, self.length, self.batch_size):
+            columns = self.read_batch(
+                start, min(start + self.batch_size, self.length)
+            )
+            for row_values in zip(*columns):
+                values.update(zip(names, row_values))
+                yield row
+
+
+def get_rows(iterable):
+    """return the iterable of a loop, columnar sources being wrapped in
+    L{ColumnarRows}"""
+    if isinstance(iterable, (list, tuple)) or get_reader(iterable) is None:
+        return iterable
+
+    return ColumnarRows(iterable)
@@ -0,0 +1,373 @@
+# -*- encoding: utf-8 -*-
+"""compile the ODF data styles of a template, the number:*-style elements
+giving the number of decimals, the grouping, the currency symbol or the
+date format of a field, into functions formatting the values of the fields
+that use them
+"""
+import calendar
+import datetime
+import decimal
+import operator
+import re
+
+import six
+
+from py3o.template.formatting import get_formatter
+
+NUMBER_URI = 'urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0'
+STYLE_URI = 'urn:oasis:names:tc:opendocument:xmlns:style:1.0'
+
+NUMBER_STYLES = ('number-style', 'currency-style', 'percentage-style')
+DATE_STYLES = ('date-style', 'time-style')
+DATA_STYLE_TAGS = tuple(
+    '{%s}%s' % (NUMBER_URI, tag) for tag in NUMBER_STYLES + DATE_STYLES
+)
+
+NUMBER_TYPES = six.integer_types + (float, decimal.Decimal)
+DATE_TYPES = (datetime.date, datetime.time)
+
+CONDITION_RE = re.compile(
+    r'^value\(\)\s*(>=|<=|!=|<>|>|<|=)\s*(-?[0-9.]+)$'
+)
+CONDITION_OPERATORS = {
+    '>=': operator.ge,
+    '<=': operator.le,
+    '!=': operator.ne,
+    '<>': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '=': operator.eq,
+}
+
+
+def number_attr(element, name, default=None):
+    return element.get('{%s}%s' % (NUMBER_URI, name), default)
+
+
+def get_data_styles(trees):
+    """return the data style elements of the trees of a document keyed by
+    their name
+
+    @param trees: the trees of content.xml and of styles.xml
+    @type trees: list of lxml.etree.ElementTree
+    """
+    styles = {}
+    for tree in trees:
+        for element in tree.iter(*DATA_STYLE_TAGS):
+            styles[element.get('{%s}name' % STYLE_URI)] = element
+
+    return styles
+
+
+class NumberStyle(object):
+    """Format numbers as a number:number-style, a number:currency-style or a
+    number:percentage-style does, values of other types being left
+    untouched."""
+
+    def __init__(
+            self, prefix=u'', suffix=u'', decimal_places=None,
+            min_integer_digits=1, grouping=False, scale=1, signed=True,
+            decimal_point='.', thousands_sep=''
+    ):
+        """
+        @param prefix: the text written before the number
+        @param suffix: the text written after the number
+
+        @param decimal_places: the number of decimals, all those of the
+        shortest representation of the value if None
+
+        @param scale: the factor applied to the values, 100 for
+        percentages, 0.001 for a display factor of 1000
+
+        @param signed: write the sign of negative numbers, styles with
+        conditions get theirs from their text
+        """
+        self.prefix = prefix
+        self.suffix = suffix
+        self.min_integer_digits = min_integer_digits
+        self.scale = scale
+        self.signed = signed
+        # the number is written by Python's format with its own separators,
+        # replaced afterwards
+        self.template = u'{0:%s%s}' % (
+            ',' if grouping else '',
+            '' if decimal_places is None else '.%df' % decimal_places,
+        )
+        self.grouping = grouping
+        self.decimal_point = six.text_type(decimal_point)
+        self.thousands_sep = six.text_type(thousands_sep)
+
+    def __call__(self, val):
+        if not isinstance(val, NUMBER_TYPES) or isinstance(val, bool):
+            return val
+
+        if self.scale != 1:
+            if isinstance(val, decimal.Decimal):
+                val *= decimal.Decimal(repr(self.scale))
+            else:
+                val *= self.scale
+
+        if not self.signed:
+            val = abs(val)
+
+        text = self.template.format(val)
+        if self.min_integer_digits != 1:
+            text = self.pad(text)
+
+        if self.grouping and self.thousands_sep != u',':
+            text = text.replace(u',', u'\0').replace(u'.', self.decimal_point)
+            text = text.replace(u'\0', self.thousands_sep)
+        elif self.decimal_point != u'.':
+            text = text.replace(u'.', self.decimal_point)
+
+        return self.prefix + text + self.suffix
+
+    def pad(self, text):
+        sign = u'-' if text.startswith(u'-') else u''
+        integer, dot, fraction = text[len(sign):].partition(u'.')
+        if self.min_integer_digits == 0 and integer == u'0' and dot:
+            integer = u''
+        else:
+            integer = integer.rjust(self.min_integer_digits, u'0')
+
+        return sign + integer + dot + fraction
+
+
+def get_year(val, long_form):
+    return u'%04d' % val.year if long_form else u'%02d' % (val.year % 100)
+
+
+def get_month(val, long_form, textual=False):
+    if textual:
+        names = calendar.month_name if long_form else calendar.month_abbr
+        return names[val.month]
+
+    return u'%02d' % val.month if long_form else u'%d' % val.month
+
+
+def get_textual_month(val, long_form):
+    return get_month(val, long_form, textual=True)
+
+
+def get_day_of_week(val, long_form):
+    names = calendar.day_name if long_form else calendar.day_abbr
+    return names[val.weekday()]
+
+
+def get_two_digits(attribute, twelve_hours=False):
+    def get_value(val, long_form):
+        value = getattr(val, attribute, 0)
+        if twelve_hours:
+            value = value % 12 or 12
+
+        return u'%02d' % value if long_form else u'%d' % value
+
+    return get_value
+
+
+def get_am_pm(val, long_form):
+    return u'AM' if getattr(val, 'hour', 0) < 12 else u'PM'
+
+
+DATE_PARTS = {
+    'year': get_year,
+    'month': get_month,
+    'textual-month': get_textual_month,
+    'day': get_two_digits('day'),
+    'day-of-week': get_day_of_week,
+    'hours': get_two_digits('hour'),
+    '12-hours': get_two_digits('hour', twelve_hours=True),
+    'minutes': get_two_digits('minute'),
+    'seconds': get_two_digits('second'),
+    'am-pm': get_am_pm,
+}
+
+
+class DateStyle(object):
+    """Format dates and times as a number:date-style or a
+    number:time-style does, values of other types being left untouched.
+    Month and day names are those of the locale of the process."""
+
+    def __init__(self, parts):
+        """
+        @param parts: the parts of the format, a key of DATE_PARTS and
+        whether the long form is used, or a text and None
+        @type parts: list of (string, boolean) tuples
+        """
+        self.parts = parts
+
+    def __call__(self, val):
+        if not isinstance(val, DATE_TYPES):
+            return val
+
+        return u''.join(
+            text if long_form is None else DATE_PARTS[text](val, long_form)
+            for text, long_form in self.parts
+        )
+
+
+class ConditionalStyle(object):
+    """Format values with the first style whose condition they meet, as the
+    style:map elements of a data style select them, or with a default
+    style."""
+
+    def __init__(self, conditions, default):
+        """
+        @param conditions: a comparison function, the number the values are
+        compared with and the style applied to the values meeting it
+        @type conditions: list of (function, number, style) tuples
+        """
+        self.conditions = conditions
+        self.default = default
+
+    def __call__(self, val):
+        if isinstance(val, NUMBER_TYPES) and not isinstance(val, bool):
+            for compare, number, style in self.conditions:
+                if compare(val, number):
+                    return style(val)
+
+        return self.default(val)
+
+
+def get_text(element):
+    return u''.join(element.itertext())
+
+
+def compile_number_style(element, locale_formatter, signed):
+    prefix = []
+    suffix = []
+    number = None
+    for child in element:
+        tag = child.tag
+        if not isinstance(tag, six.string_types):
+            # comments
+            continue
+
+        if tag == '{%s}number' % NUMBER_URI:
+            number = child
+        elif tag in (
+            '{%s}text' % NUMBER_URI, '{%s}currency-symbol' % NUMBER_URI
+        ):
+            (suffix if number is not None else prefix).append(
+                get_text(child)
+            )
+        elif tag.startswith('{%s}' % NUMBER_URI):
+            # fractions and scientific numbers
+            return None
+
+    if number is None:
+        return None
+
+    decimal_places = number_attr(number, 'decimal-places')
+    scale = 1
+    if element.tag == '{%s}percentage-style' % NUMBER_URI:
+        scale = 100
+
+    display_factor = number_attr(number, 'display-factor')
+    if display_factor:
+        scale = 1.0 / float(display_factor)
+
+    return NumberStyle(
+        prefix=u''.join(prefix),
+        suffix=u''.join(suffix),
+        decimal_places=(
+            None if decimal_places is None else int(decimal_places)
+        ),
+        min_integer_digits=int(number_attr(number, 'min-integer-digits', 1)),
+        grouping=number_attr(number, 'grouping') == 'true',
+        scale=scale,
+        signed=signed,
+        decimal_point=locale_formatter.decimal_point,
+        thousands_sep=locale_formatter.thousands_sep,
+    )
+
+
+def compile_date_style(element):
+    parts = []
+    twelve_hours = any(
+        child.tag == '{%s}am-pm' % NUMBER_URI for child in element
+    )
+    for child in element:
+        tag = child.tag
+        if not isinstance(tag, six.string_types):
+            continue
+
+        name = tag.split('}', 1)[1]
+        if tag == '{%s}text' % NUMBER_URI:
+            parts.append((get_text(child), None))
+            continue
+
+        if not tag.startswith('{%s}' % NUMBER_URI):
+            continue
+
+        if name == 'month' and number_attr(child, 'textual') == 'true':
+            name = 'textual-month'
+        elif name == 'hours' and twelve_hours:
+            name = '12-hours'
+
+        if name not in DATE_PARTS:
+            # eras, quarters and weeks
+            return None
+
+        parts.append((name, number_attr(child, 'style') == 'long'))
+
+    return DateStyle(parts)
+
+
+def compile_data_style(name, styles, formatter, signed=True, seen=()):
+    """return the function formatting values as a data style does, or None
+    if the style or one of its parts is not supported
+
+    @param name: the name of the data style
+    @type name: string
+
+    @param styles: the data style elements of the document keyed by name
+    @type styles: dict
+
+    @param formatter: the formatter giving the decimal point and thousands
+    separator of the styles that do not name a known locale
+    @type formatter: NumberFormatter
+    """
+    element = styles.get(name)
+    if element is None or name in seen:
+        return None
+
+    if element.tag.split('}', 1)[1] in DATE_STYLES:
+        return compile_date_style(element)
+
+    language = number_attr(element, 'language')
+    if language:
+        country = number_attr(element, 'country')
+        try:
+            formatter = get_formatter(
+                '%s_%s' % (language, country) if country else language
+            )
+        except ValueError:
+            pass
+
+    conditions = []
+    for style_map in element.iterchildren('{%s}map' % STYLE_URI):
+        match = CONDITION_RE.match(
+            style_map.get('{%s}condition' % STYLE_URI, '').replace(' ', '')
+        )
+        if match is None:
+            return None
+
+        # the styles chosen by a condition write the sign in their text
+        style = compile_data_style(
+            style_map.get('{%s}apply-style-name' % STYLE_URI), styles,
+            formatter, signed=False, seen=seen + (name,)
+        )
+        if style is None:
+            return None
+
+        compare = CONDITION_OPERATORS[match.group(1)]
+        conditions.append((compare, float(match.group(2)), style))
+
+    style = compile_number_style(
+        element, formatter, signed=signed and not conditions
+    )
+    if style is None or not conditions:
+        return style
+
+    return ConditionalStyle(conditions, style)
@@ -1,7 +1,7 @@
 # -*- encoding: utf-8 -*-
 import ast
-# noinspection PyUnresolvedReferences
-from six.moves import reduce
+
+from operator import attrgetter
 
 
 class Attribute(object):
@@ -48,49 +48,6 @@ class ForList(object):
     def parent(self, parent):
         self._parent = parent
 
-    @staticmethod
-    def __recur_to_dict(forlist, data_dict, res):
-        """Recursive function that fills up the dictionary
-        """
-        # First we go through all attrs from the ForList and add respective
-        #  keys on the dict.
-        for a in forlist.attrs:
-            a_list = a.split('.')
-            if len(a_list) == 1:
-                res = data_dict[a_list[0]]
-                return res
-            if a_list[0] in data_dict:
-                tmp = res
-                for i in a_list[1:-1]:
-                    if not i in tmp:
-                        tmp[i] = {}
-                    tmp = tmp[i]
-                if len(a_list) == 1:
-                    tmp[a_list[0]] = data_dict[a_list[0]]
-                else:
-                    tmp[a_list[-1]] = reduce(
-                        getattr,
-                        a_list[1:],
-                        data_dict[a_list[0]]
-                    )
-        # Then create a list for all children,
-        # modify the datadict to fit the new child
-        # and call myself
-        for c in forlist.childs:
-            it = c.name.split('.')
-            res[it[-1]] = []
-            for i, val in enumerate(
-                    reduce(getattr, it[1:], data_dict[it[0]])
-            ):
-                new_data_dict = {c.var_from: val}
-                if len(res[it[-1]]) <= i:
-                    res[it[-1]].append({})
-                res[it[-1]] = ForList.__recur_to_dict(
-                    c, new_data_dict, res[it[-1]][i]
-                )
-
-        return res
-
     @staticmethod
     def to_dict(for_lists, global_vars, data_dict):
         """ Construct a dict object from a list of ForList object
@@ -100,44 +57,246 @@ class ForList(object):
         :param data_dict: data from an orm-like object (with dot notation)
         :return: a dict representation of the ForList objects
         """
-        res = {}
+        return ExtractionPlan(for_lists, global_vars).extract(data_dict)
+
+
+def get_container(res, keys):
+    """return the dictionary of a nested dictionary found under a path of
+    keys, creating the missing levels"""
+    for key in keys:
+        res = res.setdefault(key, {})
+
+    return res
+
+
+def get_getter(path):
+    """return a function reading an attribute path of an object, or None if
+    the path is empty"""
+    if not path:
+        return None
+
+    return attrgetter('.'.join(path))
+
+
+class LoopPlan(object):
+    """The extraction of the rows of a py3o loop, compiled from a ForList.
+
+    @ivar name: the iterable of the loop, as written in the template
+    @ivar variable: the variable of the loop
+    @ivar paths: the attribute paths of the rows used by the template,
+    including those of the rows of the nested loops
+    """
 
-        # The first level is a little bit special
-        # Manage global variables
-        for a in global_vars:
-            a_list = a.split('.')
-            tmp = res
-            for i in a_list[:-1]:
-                if not i in tmp:
-                    tmp[i] = {}
-                tmp = tmp[i]
-            tmp[a_list[-1]] = reduce(getattr, a_list[1:], data_dict[a_list[0]])
-        # Then manage for lists recursively
-        for for_list in for_lists:
-            it = for_list.name.split('.')
-            tmp = res
-            for i in it[:-1]:
-                if not i in tmp:
-                    tmp[i] = {}
-                tmp = tmp[i]
-            if not it[-1] in tmp:
-                tmp[it[-1]] = []
-            tmp = tmp[it[-1]]
-            if not it[0] in data_dict:
+    def __init__(self, for_list, enclosing=()):
+        """
+        @param for_list: the loop
+        @type for_list: ForList
+
+        @param enclosing: the variables of the loops this one is nested in
+        @type enclosing: tuple of strings
+        """
+        parts = for_list.name.split('.')
+        self.name = for_list.name
+        self.variable = for_list.var_from
+        self.root = parts[0]
+        self.getter = get_getter(parts[1:])
+
+        # the rows are stored under the path of the iterable in the result,
+        # relative to the row of the enclosing loop it is read from
+        if self.root in enclosing:
+            self.keys = tuple(parts[1:])
+        else:
+            self.keys = tuple(parts)
+
+        # the fields of the rows, those at the first level read by a single
+        # attrgetter call
+        self.whole_row = False
+        flat_names = []
+        self.nested_fields = []
+        for attr in for_list.attrs:
+            path = attr.split('.')[1:]
+            if not path:
+                # the row itself is displayed
+                self.whole_row = True
+            elif len(path) == 1:
+                flat_names.append(path[0])
+            else:
+                self.nested_fields.append((path, get_getter(path)))
+
+        self.flat_keys = flat_names
+        self.flat_getter = attrgetter(*flat_names) if flat_names else None
+
+        enclosing = enclosing + (self.variable,)
+        self.children = [
+            LoopPlan(child, enclosing) for child in for_list.childs
+        ]
+
+        self.paths = []
+        for path in flat_names:
+            self.__add_path(path)
+        for path, getter in self.nested_fields:
+            self.__add_path('.'.join(path))
+
+        for child in self.children:
+            if child.root != self.variable:
                 continue
-            if len(it) == 1:
-                loop = enumerate(data_dict[it[0]])
+
+            prefix = '.'.join(child.name.split('.')[1:])
+            if prefix:
+                self.__add_path(prefix)
+
+            for path in child.paths:
+                self.__add_path('%s.%s' % (prefix, path) if prefix else path)
+
+    def __add_path(self, path):
+        if path not in self.paths:
+            self.paths.append(path)
+
+    def iter_loops(self):
+        """yield this loop and the loops nested in it"""
+        yield self
+        for child in self.children:
+            for loop in child.iter_loops():
+                yield loop
+
+    def extract(self, context, res, prefetch=None):
+        """add the rows of the loop to a result
+
+        @param context: the data and the rows of the enclosing loops, keyed
+        by their names
+        @type context: dict
+
+        @param res: the dictionary the rows are stored in
+        @type res: dict
+
+        @returns: the list of the rows
+        """
+        if self.keys:
+            rows = get_container(res, self.keys[:-1]).setdefault(
+                self.keys[-1], []
+            )
+        else:
+            rows = []
+
+        if self.root not in context:
+            return rows
+
+        iterable = context[self.root]
+        if self.getter is not None:
+            iterable = self.getter(iterable)
+
+        if prefetch is not None:
+            iterable = prefetch(self, iterable)
+
+        flat_keys = self.flat_keys
+        flat_getter = self.flat_getter
+        single = len(flat_keys) == 1
+        has_previous = self.variable in context
+        previous = context.get(self.variable)
+
+        for i, row in enumerate(iterable):
+            if len(rows) <= i:
+                rows.append({})
+
+            if self.whole_row:
+                rows[i] = row
+                continue
+
+            row_dict = rows[i]
+            if flat_getter is not None:
+                values = flat_getter(row)
+                if single:
+                    row_dict[flat_keys[0]] = values
+                else:
+                    row_dict.update(zip(flat_keys, values))
+
+            for path, getter in self.nested_fields:
+                get_container(row_dict, path[:-1])[path[-1]] = getter(row)
+
+            if self.children:
+                context[self.variable] = row
+                for child in self.children:
+                    child_rows = child.extract(context, row_dict, prefetch)
+                    if not child.keys:
+                        # the loop iterates over the row itself
+                        rows[i] = child_rows
+
+        if self.children:
+            if has_previous:
+                context[self.variable] = previous
             else:
-                loop = enumerate(reduce(getattr, it[-1:], data_dict[it[0]]))
-            for i, val in loop:
-                new_data_dict = {for_list.var_from: val}
-                # We append a new dict only if we need
-                if len(tmp) <= i:
-                    tmp.append({})
-                # Call myself with new context, and get result
-                tmp[i] = ForList.__recur_to_dict(
-                    for_list, new_data_dict, tmp[i]
-                )
+                context.pop(self.variable, None)
+
+        return rows
+
+
+class ExtractionPlan(object):
+    """The data a template displays, compiled once from the result of
+    L{py3o.template.main.Template.get_user_instructions_mapping} so that it
+    can be extracted from any number of data sets.
+
+    The attribute paths are split and turned into attrgetter functions once
+    and for all, the fields of a row are read by a single call. The rows of
+    a loop are handed to a prefetch function before they are iterated,
+    along with the attribute paths the template reads from them, so that
+    the objects of an ORM can be loaded in bulk instead of one query per
+    row and attribute.
+    """
+
+    def __init__(self, for_lists, global_vars):
+        """
+        @param for_lists: the loops of the template
+        @type for_lists: list of ForList
+
+        @param global_vars: the variables displayed outside of the loops
+        @type global_vars: list of strings
+        """
+        self.global_fields = []
+        for var in global_vars:
+            parts = var.split('.')
+            self.global_fields.append(
+                (parts, parts[0], get_getter(parts[1:]))
+            )
+
+        self.loops = [LoopPlan(for_list) for for_list in for_lists]
+
+    def get_paths(self):
+        """return the attribute paths the template reads from the rows of
+        each of its loops, nested loops included
+
+        @returns: a list of (LoopPlan, list of strings) tuples
+        """
+        return [
+            (loop, loop.paths)
+            for root_loop in self.loops
+            for loop in root_loop.iter_loops()
+        ]
+
+    def extract(self, data, prefetch=None):
+        """return the data the template displays as nested dictionaries and
+        lists
+
+        @param data: the objects the template is rendered with, usually
+        ORM records, keyed by name
+        @type data: dict
+
+        @param prefetch: a function called with each loop plan and the
+        iterable of its rows before they are read, returning the iterable
+        to read them from. The paths attribute of the loop plan lists the
+        attributes the template reads from the rows
+        @type prefetch: callable
+        """
+        res = {}
+        for parts, root, getter in self.global_fields:
+            value = data[root]
+            if getter is not None:
+                value = getter(value)
+
+            get_container(res, parts[:-1])[parts[-1]] = value
+
+        context = dict(data)
+        for loop in self.loops:
+            loop.extract(context, res, prefetch)
 
         return res
 
@@ -0,0 +1,189 @@
+# -*- encoding: utf-8 -*-
+"""format the numbers of the float and percentage fields of a template
+"""
+import decimal
+import functools
+import locale
+import re
+
+import six
+
+# the digits of an integer part preceding a group of three digits
+GROUP_RE = re.compile(r'(\d)(?=(?:\d{3})+$)')
+
+FLOAT_TYPES = (float, decimal.Decimal)
+
+# decimal point, thousands separator and percentage pattern of some locales,
+# keyed by locale name or language
+LOCALES = {
+    'en': ('.', ',', u'%s%%'),
+    'fr': (',', u'\u202f', u'%s\u00a0%%'),
+    'fr_CH': (',', u'\u202f', u'%s%%'),
+    'de': (',', '.', u'%s\u00a0%%'),
+    'de_CH': ('.', u'\u2019', u'%s%%'),
+    'es': (',', '.', u'%s\u00a0%%'),
+    'it': (',', '.', u'%s%%'),
+    'nl': (',', '.', u'%s%%'),
+    'pt': (',', u'\u00a0', u'%s%%'),
+    'pt_BR': (',', '.', u'%s%%'),
+    'ru': (',', u'\u00a0', u'%s\u00a0%%'),
+}
+
+# the formatters of the locales already asked for, see get_formatter
+FORMATTERS = {}
+
+
+class NumberFormatter(object):
+    """Format the values of the float and percentage fields of a template.
+
+    Floats and decimals are written with their shortest representation, the
+    decimal point and the thousands separator being those of the formatter,
+    other values being left untouched. Percentages are written with two
+    decimals.
+
+    The default formatter writes numbers the way py3o always did, with a
+    decimal comma and no thousands separator: "12345,35" and "0,25 %".
+    """
+
+    def __init__(
+            self, decimal_point=',', thousands_sep='', percent_pattern=u'%s %%'
+    ):
+        """
+        @param decimal_point: the decimal separator
+        @type decimal_point: string
+
+        @param thousands_sep: the separator of the groups of three digits of
+        the integer part, no grouping if empty
+        @type thousands_sep: string
+
+        @param percent_pattern: the pattern of a percentage, %s being
+        replaced by the number
+        @type percent_pattern: string
+        """
+        self.decimal_point = decimal_point
+        self.thousands_sep = thousands_sep
+        self.percent_pattern = percent_pattern
+        self.__compile()
+
+    @classmethod
+    def from_localeconv(cls, conv=None):
+        """return the formatter of the locale of the process, the one set
+        with locale.setlocale
+
+        Only groups of three digits are supported: the thousands separator
+        is used if the locale groups the digits of the integer part at all.
+        The percentages keep the default pattern, the locale gives none.
+
+        @param conv: the symbols of the locale, those returned by
+        locale.localeconv() if None
+        @type conv: dictionary
+        """
+        if conv is None:
+            conv = locale.localeconv()
+
+        decimal_point = conv['decimal_point'] or '.'
+        thousands_sep = conv['thousands_sep']
+        grouping = conv['grouping']
+        if not grouping or grouping[0] in (0, locale.CHAR_MAX):
+            thousands_sep = ''
+
+        if isinstance(decimal_point, six.binary_type):
+            # the symbols of Python 2 are in the encoding of the locale
+            encoding = locale.getpreferredencoding(False)
+            decimal_point = decimal_point.decode(encoding)
+            thousands_sep = thousands_sep.decode(encoding)
+
+        return cls(decimal_point, thousands_sep)
+
+    def __compile(self):
+        """build the format functions of the symbols once and for all, the
+        common case of a number without grouping being a single replace"""
+        decimal_point = self.decimal_point
+        percent_pattern = self.percent_pattern
+        text_type = six.text_type
+
+        if self.thousands_sep:
+            group = functools.partial(
+                GROUP_RE.sub, r'\1' + self.thousands_sep.replace('\\', r'\\')
+            )
+
+            def format_number(text):
+                integer, dot, fraction = text.partition('.')
+                if 'e' in fraction or 'e' in integer:
+                    return text.replace('.', decimal_point)
+
+                if dot:
+                    return group(integer) + decimal_point + fraction
+
+                return group(integer)
+
+        elif decimal_point != '.':
+            # the exponent of large floats has no dot to replace
+            def format_number(text):
+                return text.replace('.', decimal_point)
+
+        else:
+            def format_number(text):
+                return text
+
+        def format_float(val):
+            if not isinstance(val, FLOAT_TYPES):
+                return val
+
+            return format_number(text_type(val))
+
+        if self.thousands_sep or '.' in percent_pattern:
+            def format_percentage(val):
+                return percent_pattern % format_number('%0.2f' % val)
+
+        else:
+            # the number and the pattern in a single format string
+            percent_format = percent_pattern.replace('%%', '%%%%') % '%0.2f'
+
+            if decimal_point != '.':
+                def format_percentage(val):
+                    return (percent_format % val).replace('.', decimal_point)
+
+            else:
+                def format_percentage(val):
+                    return percent_format % val
+
+        self.format_number = format_number
+        self.format_float = format_float
+        self.format_percentage = format_percentage
+
+    def __getstate__(self):
+        # the format functions are rebuilt rather than pickled
+        return self.decimal_point, self.thousands_sep, self.percent_pattern
+
+    def __setstate__(self, state):
+        self.decimal_point, self.thousands_sep, self.percent_pattern = state
+        self.__compile()
+
+    def __repr__(self):
+        return '<NumberFormatter %r %r %r>' % (
+            self.decimal_point, self.thousands_sep, self.percent_pattern
+        )
+
+
+def get_formatter(locale_name):
+    """return the formatter of a locale, such as 'fr_FR' or 'de_CH'. The
+    formatter of a language is used for the locales that have none of their
+    own. The formatters are built once and shared by all the templates.
+
+    @raise ValueError: the locale is not known
+    """
+    formatter = FORMATTERS.get(locale_name)
+    if formatter is None:
+        name = locale_name.replace('-', '_').split('.')[0]
+        symbols = LOCALES.get(name) or LOCALES.get(name.split('_')[0])
+        if symbols is None:
+            raise ValueError('No number format for the locale %r, give a '
+                             'NumberFormatter instead' % locale_name)
+
+        formatter = FORMATTERS[locale_name] = NumberFormatter(*symbols)
+
+    return formatter
+
+
+DEFAULT_FORMATTER = NumberFormatter()
@@ -1,23 +1,40 @@
 # -*- encoding: utf-8 -*-
 import decimal
 import logging
-import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
 
 import lxml.etree
 import zipfile
 
 from copy import copy
 from io import BytesIO
+from itertools import count
+from timeit import default_timer
 from uuid import uuid4
+from xml.sax.saxutils import quoteattr
 
+import six
+
+from six.moves import queue
 from six.moves import urllib
 
+from genshi.core import Attrs, QName, Stream, COMMENT, END, END_NS, PI, \
+    START, START_NS, TEXT
 from genshi.template import MarkupTemplate
-from genshi.filters.transform import Transformer
-
-from pyjon.utils import get_secure_filename
 
-from py3o.template.decoder import Decoder, ForList
+from py3o.template.decoder import Decoder, ExtractionPlan, ForList
+from py3o.template.datastyles import compile_data_style, get_data_styles
+from py3o.template.formatting import DEFAULT_FORMATTER, get_formatter
+from py3o.template.static import StaticStream, get_static_template, \
+    has_only_fields
+from py3o.template.stats import TimedIterator, evaluate_expression, \
+    iterate_loop, null_timer
 
 log = logging.getLogger(__name__)
 
@@ -32,6 +49,86 @@ PY3O_URI = 'http://py3o.org/'
 # supported...
 PY3O_IMAGE_PREFIX = 'Pictures/py3o-'
 
+# the templated entries of the archive: the content of the document always,
+# its styles and the content of its embedded objects, such as charts, only
+# when they hold py3o markers. The others are copied as they are stored
+CONTENT_FILE = 'content.xml'
+STYLES_FILE = 'styles.xml'
+EMBEDDED_CONTENT_RE = re.compile(r'^Object \d+/content\.xml$')
+PY3O_MARKER_RE = re.compile(br'''["']py3o(?:://|\.)''')
+
+# the manifest is not templated, the entries of the images are spliced in
+MANIFEST_FILE = 'META-INF/manifest.xml'
+MANIFEST_URI = 'urn:oasis:names:tc:opendocument:xmlns:manifest:1.0'
+
+# the queries of the public introspection helpers, compiled once in
+# XPATH_CACHE. The compilation uses scan_instructions and scan_markers
+# instead, which find everything they look for in a single walk of a tree
+INSTRUCTIONS_XPATH = "//text:a[starts-with(@xlink:href, 'py3o://')]"
+USER_FIELDS_XPATH = "//text:user-field-decl[starts-with(@text:name, 'py3o.')]"
+SOFT_BREAKS_XPATH = "//text:soft-page-break"
+XPATH_CACHE = {}
+
+# the serialized output is handed to the zip compressor by blocks of this size
+WRITE_BUFFER_SIZE = 64 * 1024
+
+# zip archive entries can only be written as a stream since python 3.6
+ZIP_STREAM_WRITE = sys.version_info >= (3, 6)
+# and their compression level chosen since python 3.7
+ZIP_COMPRESSLEVEL = sys.version_info >= (3, 7)
+
+
+class CompressionPolicy(object):
+    """Decide how each entry written to an output archive is compressed.
+
+    XML entries are deflated at the chosen level, py3o images and files
+    whose extension denotes an already compressed format are stored.
+    Entries copied from the template keep their original compression.
+    """
+
+    compressed_extensions = (
+        '.png', '.jpg', '.jpeg', '.gif', '.tif', '.tiff', '.webp',
+        '.zip', '.gz', '.odt', '.ods', '.odg', '.odp',
+    )
+
+    def __init__(self, compresslevel=None, threaded=False):
+        """
+        @param compresslevel: the zlib level used to deflate entries, from 0
+        to 9. None means the zlib default. Ignored before python 3.7
+        @type compresslevel: int
+
+        @param threaded: deflate the templated entries in a worker thread
+        while the main thread keeps serializing them
+        @type threaded: boolean
+        """
+        self.compresslevel = compresslevel
+        self.threaded = threaded
+
+    def get_compression(self, filename):
+        """return the (compress_type, compresslevel) pair of an entry"""
+        if filename.startswith(PY3O_IMAGE_PREFIX) or (
+            filename.lower().endswith(self.compressed_extensions)
+        ):
+            return zipfile.ZIP_STORED, None
+
+        return zipfile.ZIP_DEFLATED, self.compresslevel
+
+    def get_zinfo(self, filename, date_time=None, external_attr=None):
+        """return a ZipInfo describing an entry compressed according to this
+        policy"""
+        zinfo = zipfile.ZipInfo(
+            filename, date_time=date_time or time.localtime()[:6]
+        )
+        zinfo.external_attr = external_attr or 0o600 << 16
+        zinfo.compress_type, compresslevel = self.get_compression(filename)
+        if compresslevel is not None and ZIP_COMPRESSLEVEL:
+            zinfo._compresslevel = compresslevel
+
+        return zinfo
+
+
+DEFAULT_COMPRESSION = CompressionPolicy()
+
 
 class TemplateException(ValueError):
     """some client code is used to catching ValueErrors, let's keep the old
@@ -125,118 +222,1044 @@ def move_siblings(
     old_.remove(end)
 
 
-def get_list_transformer(namespaces):
-    """this function returns a transformer to
-     find all list elements and recompute their xml:id.
-    Because if we duplicate lists we create invalid XML.
-    Each list must have its own xml:id
+class ThreadedWriter(object):
+    """A file-like object handing the blocks written to it over to a worker
+    thread that writes them to the real destination. zlib releases the GIL
+    while compressing, so the compression of an archive entry runs in
+    parallel with the production of its content.
+    """
 
-    This is important if you want to be able to reopen the produced
-     document wih an XML parser. LibreOffice will fix those ids itself
-     silently, but lxml.etree.parse will bork on such duplicated lists
+    def __init__(self, dest, queue_size=4):
+        self.dest = dest
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        self.aborted = False
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __run(self):
+        while True:
+            block = self.queue.get()
+            if block is None:
+                break
+
+            if self.error is None and not self.aborted:
+                try:
+                    self.dest.write(block)
+                except Exception:
+                    # reported to the producer, but keep consuming the
+                    # queue so it never blocks
+                    self.error = sys.exc_info()
+
+    def write(self, block):
+        if self.error is not None:
+            six.reraise(*self.error)
+
+        self.queue.put(block)
+
+    def __stop(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+
+    def close(self):
+        """wait for all the blocks to be written"""
+        self.__stop()
+        if self.error is not None:
+            six.reraise(*self.error)
+
+    def abort(self):
+        """stop the worker thread without writing the blocks still queued
+        nor raising its error, when the production of the blocks failed.
+        Nothing is done once the writer is closed"""
+        self.aborted = True
+        self.__stop()
+
+
+def write_entry(out, zinfo, chunks, spool_size=None, threaded=False):
+    """a generator writing the chunks of an archive entry to an output zip
+    file, yielding True after each chunk
+
+    The chunks are compressed straight into the archive. If spool_size is
+    given they are first gathered in a temporary file that is kept in memory
+    up to spool_size bytes and spilled to disk above that.
+
+    @param out: the output archive
+    @type out: zipfile.ZipFile
+
+    @param zinfo: the description of the entry to write
+    @type zinfo: zipfile.ZipInfo
+
+    @param chunks: the content of the entry
+    @type chunks: an iterable of bytes
+
+    @param spool_size: the size above which the entry is spooled to disk
+    @type spool_size: int
+
+    @param threaded: write the blocks of chunks from a worker thread
+    @type threaded: boolean
     """
-    return Transformer(
-        '//list[namespace-uri()="%s"]' % namespaces.get(
-            'text'
-        )
-    ).attr(
-        '{0}id'.format(XML_NS),
-        lambda *args: "list{0}".format(uuid4().hex)
+    if spool_size is None and ZIP_STREAM_WRITE:
+        dest = out.open(zinfo, 'w')
+    else:
+        # a max_size of 0 never rolls over to disk
+        dest = tempfile.SpooledTemporaryFile(max_size=spool_size or 0)
+
+    writer = ThreadedWriter(dest) if threaded else dest
+    try:
+        buf = []
+        buf_size = 0
+        for chunk in chunks:
+            buf.append(chunk)
+            buf_size += len(chunk)
+            if buf_size >= WRITE_BUFFER_SIZE:
+                writer.write(b''.join(buf))
+                buf = []
+                buf_size = 0
+
+            yield True
+
+        writer.write(b''.join(buf))
+        if writer is not dest:
+            writer.close()
+
+        if isinstance(dest, tempfile.SpooledTemporaryFile):
+            dest.seek(0)
+            if ZIP_STREAM_WRITE:
+                with out.open(zinfo, 'w') as zdest:
+                    shutil.copyfileobj(dest, zdest, WRITE_BUFFER_SIZE)
+            else:
+                out.writestr(zinfo, dest.read())
+
+    finally:
+        # when the chunks failed, their error is the one reported and the
+        # archive must stay usable: the entry is closed in any case
+        if writer is not dest:
+            writer.abort()
+
+        dest.close()
+
+
+def open_template(template):
+    """return a zip archive reading a template given either as a file name,
+    as its content or as a file-like object
+
+    Bytes are read in place, without being copied.
+
+    @param template: the template to open
+    @type template: a string representing the full path name to a template
+    file, bytes, memoryview or a readable binary file-like object
+
+    @returns: zipfile.ZipFile
+    """
+    if isinstance(template, memoryview):
+        # the bytes a whole memoryview is made of are read in place, Python
+        # 2 memoryviews do not tell what they are made of
+        source = getattr(template, 'obj', None)
+        if isinstance(source, bytes) and template.nbytes == len(source):
+            template = source
+        else:
+            template = template.tobytes()
+
+    if isinstance(template, bytearray) or (
+        # python 2 paths are bytes too, a zip archive starts with a local
+        # file header signature that no path contains
+        isinstance(template, bytes) and template[:4] == b'PK\x03\x04'
+    ):
+        template = BytesIO(template)
+
+    elif hasattr(template, 'read') and (
+        hasattr(template, 'seekable') and not template.seekable()
+    ):
+        # zip archives can only be read from seekable files
+        template = BytesIO(template.read())
+
+    return zipfile.ZipFile(template, 'r')
+
+
+def read_raw_entry(infile, info_zip):
+    """return the content of an archive entry as it is stored, without
+    decompressing it
+
+    @param infile: the source archive
+    @type infile: zipfile.ZipFile
+
+    @param info_zip: the entry to read
+    @type info_zip: zipfile.ZipInfo
+    """
+    infile.fp.seek(info_zip.header_offset)
+    fheader = struct.unpack(
+        zipfile.structFileHeader,
+        infile.fp.read(zipfile.sizeFileHeader)
     )
+    if fheader[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipfile(
+            "Bad magic number for file header of %s" % info_zip.filename
+        )
+
+    # skip the file name and the extra field that end the local header
+    infile.fp.seek(fheader[-2] + fheader[-1], 1)
+    return infile.fp.read(info_zip.compress_size)
+
+
+def has_py3o_markers(content):
+    """tell whether the content of an archive entry holds py3o links, user
+    fields or image frames, without parsing it
+
+    @param content: the content of an XML entry
+    @type content: bytes
+    """
+    return PY3O_MARKER_RE.search(content) is not None
+
+
+def add_manifest_entries(manifest, paths):
+    """return the content of a manifest with a file entry added for each
+    path, just before the closing tag of its root element
+
+    @param manifest: the content of a META-INF/manifest.xml entry
+    @type manifest: bytes
+
+    @param paths: the full paths of the entries to declare
+    @type paths: list of strings
+    """
+    if not paths:
+        return manifest
+
+    end = manifest.rindex(b'</')
+    root_tag = manifest[end + 2:manifest.index(b'>', end)].strip()
+    if b':' in root_tag:
+        prefix = root_tag[:root_tag.index(b':') + 1]
+        declaration = b''
+    else:
+        # attributes without prefix are in no namespace
+        prefix = b'manifest:'
+        declaration = (
+            ' xmlns:manifest="%s"' % MANIFEST_URI
+        ).encode('ascii')
+
+    entries = [
+        b''.join([
+            b'<', prefix, b'file-entry', declaration, b' ', prefix,
+            b'full-path=', quoteattr(path).encode('utf-8'), b' ', prefix,
+            b'media-type=""/>',
+        ])
+        for path in paths
+    ]
+    return b''.join([manifest[:end]] + entries + [manifest[end:]])
+
+
+class ArchiveSkeleton(object):
+    """The static entries of an output archive, laid out once with their
+    local headers so that every rendering copies them in a single write,
+    still compressed and with their original CRCs.
+    """
+
+    def __init__(self, entries):
+        """
+        @param entries: the static entries with their stored content, the
+        "mimetype" entry being first if any
+        @type entries: a list of (zipfile.ZipInfo, bytes) tuples
+        """
+        chunks = []
+        self.entries = []
+        offset = 0
+        for info_zip, raw_data in entries:
+            zinfo = copy(info_zip)
+            # sizes and CRC are known, they go in the local header instead of
+            # a trailing data descriptor
+            zinfo.flag_bits &= ~0x08
+            header = zinfo.FileHeader()
+
+            self.entries.append((zinfo, offset))
+            chunks.append(header)
+            chunks.append(raw_data)
+            offset += len(header) + len(raw_data)
+
+        self.data = b''.join(chunks)
+
+    def write(self, out):
+        """write the static entries at the current position of an output
+        archive
+
+        @param out: an archive opened for writing with nothing written in it
+        yet
+        @type out: zipfile.ZipFile
+        """
+        base = out.fp.tell()
+        out.fp.write(self.data)
+
+        for zinfo, offset in self.entries:
+            zinfo = copy(zinfo)
+            zinfo.header_offset = base + offset
+            out.filelist.append(zinfo)
+            out.NameToInfo[zinfo.filename] = zinfo
+
+        out._didModify = True
+        # python 3 writes the next entry and the central directory there
+        out.start_dir = out.fp.tell()
+
+
+def get_xpath(xpath_expr, namespaces):
+    """return a compiled XPath expression, compiling it only once for each
+    set of namespaces"""
+    key = (xpath_expr, tuple(sorted(namespaces.items())))
+    xpath = XPATH_CACHE.get(key)
+    if xpath is None:
+        xpath = XPATH_CACHE[key] = lxml.etree.XPath(
+            xpath_expr, namespaces=namespaces
+        )
+
+    return xpath
 
 
 def get_instructions(content_tree, namespaces):
     # find all links that have a py3o
-    xpath_expr = "//text:a[starts-with(@xlink:href, 'py3o://')]"
-    return content_tree.xpath(
-        xpath_expr,
-        namespaces=namespaces
-    )
+    return get_xpath(INSTRUCTIONS_XPATH, namespaces)(content_tree)
 
 
 def get_user_fields(content_tree, namespaces):
-    field_expr = "//text:user-field-decl[starts-with(@text:name, 'py3o.')]"
-    return content_tree.xpath(
-        field_expr,
-        namespaces=namespaces
-    )
+    return get_xpath(USER_FIELDS_XPATH, namespaces)(content_tree)
 
 
 def get_soft_breaks(content_tree, namespaces):
-    xpath_expr = "//text:soft-page-break"
-    return content_tree.xpath(
-        xpath_expr,
-        namespaces=namespaces
-    )
+    return get_xpath(SOFT_BREAKS_XPATH, namespaces)(content_tree)
+
+
+def scan_instructions(content_tree, namespaces):
+    """return the soft page breaks and the py3o links of a content tree,
+    found in a single walk of the tree
+
+    @returns: a tuple of two lists of elements, in document order
+    """
+    soft_break_tag = '{%s}soft-page-break' % namespaces['text']
+    link_tag = '{%s}a' % namespaces['text']
+    href_attr = '{%s}href' % namespaces['xlink']
+
+    soft_breaks = []
+    links = []
+    for element in content_tree.iter(soft_break_tag, link_tag):
+        if element.tag == soft_break_tag:
+            soft_breaks.append(element)
+
+        elif element.get(href_attr, '').startswith('py3o://'):
+            links.append(element)
+
+    return soft_breaks, links
+
+
+class TemplateMarkers(object):
+    """The py3o user fields, image frames and lists of a content tree, found
+    in a single walk of the tree by L{scan_markers}.
+    """
+
+    def __init__(self):
+        self.user_field_decls = []
+        self.user_fields = []
+        self.image_frames = []
+        self.lists = []
+
+
+def scan_markers(content_tree, namespaces):
+    """return the py3o markers and the lists of a content tree, which are
+    transformed once the py3o links are handled
+
+    @returns: TemplateMarkers
+    """
+    decl_tag = '{%s}user-field-decl' % namespaces['text']
+    field_tag = '{%s}user-field-get' % namespaces['text']
+    frame_tag = '{%s}frame' % namespaces['draw']
+    list_tag = '{%s}list' % namespaces['text']
+    text_name_attr = '{%s}name' % namespaces['text']
+    draw_name_attr = '{%s}name' % namespaces['draw']
+
+    markers = TemplateMarkers()
+    for element in content_tree.iter(
+        decl_tag, field_tag, frame_tag, list_tag
+    ):
+        tag = element.tag
+        if tag == field_tag:
+            if element.get(text_name_attr, '').startswith('py3o.'):
+                markers.user_fields.append(element)
+
+        elif tag == decl_tag:
+            if element.get(text_name_attr, '').startswith('py3o.'):
+                markers.user_field_decls.append(element)
+
+        elif tag == frame_tag:
+            if element.get(draw_name_attr, '').startswith('py3o.'):
+                markers.image_frames.append(element)
+
+        else:
+            markers.lists.append(element)
+
+    return markers
+
+
+def get_markup_stream(content_tree):
+    """return the Genshi markup stream of a content tree: the events
+    Genshi's XMLParser gives for the serialized tree, without serializing
+    and parsing it again
+
+    @returns: genshi.core.Stream
+    """
+    events = []
+    append = events.append
+    qnames = {}
+    prefixes = []
+    tail = None
+    pos = (None, -1, -1)
+
+    for event, element in lxml.etree.iterwalk(
+        content_tree.getroot(),
+        events=('start', 'end', 'start-ns', 'end-ns', 'comment', 'pi'),
+    ):
+        if event == 'end-ns':
+            # the parser reports the end of the namespaces before the text
+            # following their element
+            append((END_NS, prefixes.pop(), pos))
+            continue
+
+        if tail:
+            append((TEXT, tail, pos))
+            tail = None
+
+        if event == 'start':
+            pos = (None, element.sourceline or -1, -1)
+            attrs = []
+            for name, value in element.items():
+                qname = qnames.get(name)
+                if qname is None:
+                    qname = qnames[name] = QName(name)
+
+                attrs.append((qname, value))
+
+            tag = element.tag
+            qname = qnames.get(tag)
+            if qname is None:
+                qname = qnames[tag] = QName(tag)
+
+            append((START, (qname, Attrs(attrs)), pos))
+            if element.text:
+                append((TEXT, element.text, pos))
+
+        elif event == 'end':
+            append((END, qnames[element.tag], pos))
+            tail = element.tail
+
+        elif event == 'start-ns':
+            prefix, uri = element
+            prefixes.append(prefix or '')
+            append((START_NS, (prefix or '', uri), pos))
+
+        elif event == 'comment':
+            append((COMMENT, element.text or '', pos))
+            tail = element.tail
+
+        else:
+            append((PI, (element.target, element.text or ''), pos))
+            tail = element.tail
+
+    if tail:
+        append((TEXT, tail, pos))
+
+    return Stream(events)
+
+
+class CompiledTemplate(object):
+    """A py3o template that went through the py3o to Genshi transformation
+    once and for all. It holds no reference to the lxml trees it was built
+    from and can render any number of data sets, each to its own output,
+    without sharing any mutable state between renders.
+
+    Instances are obtained through L{Template.compile}.
+    """
+
+    def __init__(
+            self, templates, template_infos, skeleton, namespaces,
+            ignore_undefined_variables=False, loops=None, expressions=None,
+            deterministic_ids=False, manifest=None, formatter=None,
+            field_formats=None
+    ):
+        """
+        @param templates: the Genshi templates of the templated archive
+        entries, or their static versions for the entries that only
+        substitute fields
+        @type templates: a list of (filename, MarkupTemplate or
+        StaticTemplate) tuples
+
+        @param template_infos: the source archive entries of the templates
+        @type template_infos: a dictionary of zipfile.ZipInfo keyed by
+        filename
+
+        @param skeleton: the entries of the source archive that are copied
+        as is in the output
+        @type skeleton: ArchiveSkeleton
+
+        @param namespaces: the namespaces of the source document
+        @type namespaces: dict
+
+        @param ignore_undefined_variables: Not defined images are left
+        untouched during rendering if True
+        @type ignore_undefined_variables: boolean. Default is False
+
+        @param loops: the for instructions of the templates, their iterables
+        go through the __py3o_loop__ function with their index in this list
+        @type loops: list of strings
+
+        @param expressions: the origin and source of the expressions wrapped
+        in the __py3o_expr__ and __py3o_iter__ functions when the template
+        was compiled with profiling, indexed as in the calls of these
+        functions
+        @type expressions: list of (string, string) tuples
+
+        @param deterministic_ids: number the copies of the lists repeated by
+        loops from list-1 in each rendering instead of prefixing their ids
+        with a random part, so that the same data gives the same document
+        @type deterministic_ids: boolean. Default is False
+
+        @param manifest: the manifest of the source archive, the entries of
+        the images are added to it at rendering time. Its entry is then found
+        in template_infos
+        @type manifest: bytes
+
+        @param formatter: formats the values of the float and percentage
+        fields. It can be replaced between renderings
+        @type formatter: NumberFormatter. Default is the formatter writing
+        numbers with a decimal comma
+
+        @param field_formats: the functions compiled from the data styles of
+        the fields, called through the __py3o_format__ list with their index
+        @type field_formats: list of callables
+        """
+        self.templates = templates
+        self.template_infos = template_infos
+        self.skeleton = skeleton
+        self.namespaces = namespaces
+        self.ignore_undefined_variables = ignore_undefined_variables
+        self.loops = loops or []
+        self.expressions = expressions or []
+        self.deterministic_ids = deterministic_ids
+        self.manifest = manifest
+        self.formatter = formatter or DEFAULT_FORMATTER
+        self.field_formats = field_formats or []
+
+    def get_template_dict(self, data, images=None, stats=None, list_id=None):
+        """return the namespace the Genshi templates are rendered with: the
+        user data along with the helpers py3o templates rely on
+
+        @param data: the input stream of user data. This should be a
+        dictionary mapping, keys being the values accessible to your report.
+        @type data: dictionary
+
+        @param images: the image contents keyed by their identifier
+        @type images: dictionary
+
+        @param stats: where the iterations of the loops are counted and the
+        expressions profiled
+        @type stats: RenderStats
+
+        @param list_id: the function giving their xml:id to the lists, to
+        share between the namespaces rendering parts of the same document.
+        Default is a new function returned by L{get_list_id_func}
+        @type list_id: callable
+        """
+        images = images or {}
+
+        new_data = dict(
+            decimal=decimal,
+            format_float=self.formatter.format_float,
+            format_percentage=self.formatter.format_percentage,
+            __py3o_format__=self.field_formats,
+            __py3o_image_href__=self.__get_image_href_func(images),
+            __py3o_loop__=(
+                iterate_loop if stats is None
+                else stats.get_loop_function(self.loops)
+            ),
+            __py3o_list_id__=list_id or self.get_list_id_func(),
+            __py3o_clock__=default_timer,
+        )
+        if stats is not None and self.expressions:
+            (
+                new_data['__py3o_expr__'], new_data['__py3o_iter__']
+            ) = stats.get_expression_functions(self.expressions)
+        else:
+            new_data['__py3o_expr__'] = evaluate_expression
+            new_data['__py3o_iter__'] = evaluate_expression
+
+        template_dict = {}
+        template_dict.update(data.items())
+        template_dict.update(new_data.items())
+        return template_dict
+
+    def get_list_id_func(self):
+        """return the __py3o_list_id__ function giving its xml:id to each
+        copy of a list repeated by a loop.
+
+        Each list must have its own xml:id: LibreOffice silently fixes
+        duplicated ids but lxml.etree.parse refuses such documents. The ids
+        are numbered per rendering, after a random prefix unless the ids are
+        deterministic.
+        """
+        if self.deterministic_ids:
+            prefix = 'list-'
+        else:
+            prefix = 'list%s-' % uuid4().hex
+
+        ids = count(1)
+        return lambda: '%s%d' % (prefix, next(ids))
+
+    def generate(self, data, images=None, stats=None):
+        """return the Genshi streams of the templated entries for the given
+        data without serializing them
+
+        @param data: the input stream of user data. This should be a
+        dictionary mapping, keys being the values accessible to your report.
+        @type data: dictionary
+
+        @param images: the image contents keyed by their identifier
+        @type images: dictionary
+
+        @param stats: where the iterations of the loops are counted and the
+        expressions profiled
+        @type stats: RenderStats
+
+        @returns: a list of (filename, genshi.core.Stream) tuples
+        """
+        template_dict = self.get_template_dict(data, images, stats=stats)
+
+        return [
+            (fname, template.generate(**template_dict))
+            for fname, template in self.templates
+        ]
+
+    def __get_image_href_func(self, images):
+        """return the function the image frames of the template use to find
+        out the link of their picture
+        """
+        def image_href(identifier, default):
+            if identifier in images:
+                return PY3O_IMAGE_PREFIX + identifier
+
+            if not self.ignore_undefined_variables:
+                raise TemplateException(
+                    "Can't find data for the image named 'py3o.%s'; "
+                    "make sure it has been added with the "
+                    "set_image_path or set_image_data methods."
+                    % identifier
+                )
+
+            return default
+
+        return image_href
+
+    def render_flow(
+            self, data, outfile, images=None, spool_size=None,
+            compression=None, stats=None
+    ):
+        """render the OpenDocument with the user data
+
+        @param data: the input stream of user data. This should be a dictionary
+        mapping, keys being the values accessible to your report.
+        @type data: dictionary
+
+        @param outfile: the desired output for the resulting ODT document
+        @type outfile: a string representing the full filename for output or
+        a writable binary file-like object
+
+        @param images: the image contents keyed by their identifier
+        @type images: dictionary
+
+        @param spool_size: if given, each templated entry is spooled in a
+        temporary file spilling to disk above that many bytes instead of being
+        compressed straight into the output
+        @type spool_size: int
+
+        @param compression: how the entries written to the output are
+        compressed, DEFAULT_COMPRESSION if None
+        @type compression: CompressionPolicy
+
+        @param stats: statistics filled during the rendering
+        @type stats: RenderStats
+        """
+        output_streams = self.generate(data, images, stats=stats)
+        for status in self._save_output(
+            outfile, output_streams, images, spool_size=spool_size,
+            compression=compression, stats=stats,
+        ):
+            yield status
+
+    def render(
+            self, data, outfile, images=None, spool_size=None,
+            compression=None, stats=None
+    ):
+        """render the OpenDocument with the user data
+
+        @param data: the input stream of userdata. This should be a dictionary
+        mapping, keys being the values accessible to your report.
+        @type data: dictionary
+
+        @param outfile: the desired output for the resulting ODT document
+        @type outfile: a string representing the full filename for output or
+        a writable binary file-like object
+
+        @param images: the image contents keyed by their identifier
+        @type images: dictionary
+
+        @param spool_size: if given, each templated entry is spooled in a
+        temporary file spilling to disk above that many bytes instead of being
+        compressed straight into the output
+        @type spool_size: int
+
+        @param compression: how the entries written to the output are
+        compressed, DEFAULT_COMPRESSION if None
+        @type compression: CompressionPolicy
+
+        @param stats: statistics filled during the rendering
+        @type stats: RenderStats
+        """
+        for status in self.render_flow(
+            data, outfile, images, spool_size=spool_size,
+            compression=compression, stats=stats,
+        ):
+            if not status:
+                raise TemplateException("unknown template error")
+
+    def render_to_bytes(
+            self, data, images=None, spool_size=None, compression=None,
+            stats=None
+    ):
+        """render the OpenDocument with the user data and return it
+
+        @param data: the input stream of userdata. This should be a dictionary
+        mapping, keys being the values accessible to your report.
+        @type data: dictionary
+
+        @param images: the image contents keyed by their identifier
+        @type images: dictionary
+
+        @param spool_size: if given, each templated entry is spooled in a
+        temporary file spilling to disk above that many bytes instead of being
+        compressed straight into the output
+        @type spool_size: int
+
+        @param compression: how the entries written to the output are
+        compressed, DEFAULT_COMPRESSION if None
+        @type compression: CompressionPolicy
+
+        @param stats: statistics filled during the rendering
+        @type stats: RenderStats
+
+        @returns: the content of the resulting ODT document as bytes
+        """
+        out = BytesIO()
+        self.render(
+            data, out, images=images, spool_size=spool_size,
+            compression=compression, stats=stats,
+        )
+        return out.getvalue()
+
+    def _save_output(
+            self, outfile, output_streams, images=None, spool_size=None,
+            compression=None, stats=None
+    ):
+        """Saves the output streams into a native OOo document format.
+        """
+        images = images or {}
+        compression = compression or DEFAULT_COMPRESSION
+        if stats is not None:
+            stats.renders += 1
+            start = default_timer()
+
+        out = zipfile.ZipFile(outfile, 'w')
+
+        # Copy other files straight from the source archive.
+        self.skeleton.write(out)
+
+        if stats is not None:
+            stats.add_time('skeleton', default_timer() - start)
+
+        for fname, stream in output_streams:
+            # Template file - we have edited these.
+            info_zip = self.template_infos[fname]
+
+            if stats is not None:
+                # the generation of the events, their serialization and the
+                # writing of the chunks are interleaved: each is timed
+                # around the pulls of its consumer
+                events = TimedIterator(stream)
+                if isinstance(stream, StaticStream):
+                    stream = StaticStream(events)
+                else:
+                    stream = Stream(events)
+
+            zinfo = compression.get_zinfo(
+                fname,
+                date_time=info_zip.date_time,
+                external_attr=info_zip.external_attr,
+            )
+
+            # write the whole stream to the archive. The serializer cache is
+            # disabled: it keeps the output of every distinct event until the
+            # end of the stream, which grows with the number of loop rows
+            chunks = (
+                chunk.encode('utf-8')
+                for chunk in stream.serialize(cache=False)
+            )
+            if stats is not None:
+                chunks = TimedIterator(chunks)
+
+            statuses = write_entry(
+                out,
+                zinfo,
+                chunks,
+                spool_size=spool_size,
+                threaded=compression.threaded,
+            )
+            if stats is not None:
+                statuses = TimedIterator(statuses)
+
+            for status in statuses:
+                yield status
+
+            if stats is not None:
+                stats.add_time('generate', events.elapsed)
+                stats.add_time('serialize', chunks.elapsed - events.elapsed)
+                stats.add_time('write', statuses.elapsed - chunks.elapsed)
+                stats.add_entry(zinfo)
+                start = default_timer()
+
+        # Declare the images in the manifest.
+        if self.manifest is not None:
+            info_zip = self.template_infos[MANIFEST_FILE]
+            zinfo = compression.get_zinfo(
+                MANIFEST_FILE,
+                date_time=info_zip.date_time,
+                external_attr=info_zip.external_attr,
+            )
+            out.writestr(zinfo, add_manifest_entries(self.manifest, [
+                PY3O_IMAGE_PREFIX + identifier for identifier in images
+            ]))
+            if stats is not None:
+                stats.add_entry(zinfo)
+
+        # Save images in the "Pictures" sub-directory of the archive.
+        for identifier, data in images.items():
+            out.writestr(
+                compression.get_zinfo(PY3O_IMAGE_PREFIX + identifier), data
+            )
+            if stats is not None:
+                stats.add_image(data)
+
+        if stats is not None:
+            stats.add_time('images', default_timer() - start)
+            start = default_timer()
+
+        # close the zipfile before leaving
+        out.close()
+
+        if stats is not None:
+            stats.add_time('write', default_timer() - start)
+
+        yield True
 
 
 class Template(object):
-    templated_files = ['content.xml', 'styles.xml', 'META-INF/manifest.xml']
 
-    def __init__(self, template, outfile, ignore_undefined_variables=False):
+    def __init__(
+            self, template, outfile=None, ignore_undefined_variables=False,
+            profile=False, deterministic_ids=False, huge_tree=False,
+            formatter=None, data_styles=False
+    ):
         """A template object exposes the API to render it to an OpenOffice
         document.
 
         @param template: a py3o template file. ie: a OpenDocument with the
         proper py3o markups
         @type template: a string representing the full path name to a py3o
-        template file.
+        template file, the content of such a file as bytes or memoryview, or
+        a readable binary file-like object.
 
-        @param outfile: the desired file name for the resulting ODT document
-        @type outfile: a string representing the full filename for output
+        @param outfile: the desired output for the resulting ODT document.
+        It may be omitted when the template is only compiled or introspected
+        @type outfile: a string representing the full filename for output or
+        a writable binary file-like object
 
         @param ignore_undefined_variables: Not defined variables are replaced
         with an empty string during template rendering if True
         @type ignore_undefined_variables: boolean. Default is False
+
+        @param profile: compile the template so that the renderings given a
+        RenderStats time each expression coming from a py3o link or field.
+        The expressions of such a template are slower to evaluate
+        @type profile: boolean. Default is False
+
+        @param deterministic_ids: give the copies of the lists repeated by
+        loops ids that only depend on the data, see L{CompiledTemplate}
+        @type deterministic_ids: boolean. Default is False
+
+        @param huge_tree: lift the limits of the XML parser on the depth of
+        the trees and the size of the text nodes, for very large documents
+        @type huge_tree: boolean. Default is False
+
+        @param formatter: formats the values of the float and percentage
+        fields, given as a locale name such as 'de_CH'
+        @type formatter: NumberFormatter or string. Default is the formatter
+        writing numbers with a decimal comma
+
+        @param data_styles: format the values of the fields that have a
+        number, currency, percentage, date or time data style as the style
+        does, instead of with the formatter
+        @type data_styles: boolean. Default is False
         """
+        start = default_timer()
         self.template = template
         self.outputfilename = outfile
-        self.infile = zipfile.ZipFile(self.template, 'r')
-
-        self.content_trees = [
-            lxml.etree.parse(BytesIO(self.infile.read(filename)))
-            for filename in self.templated_files
-        ]
-        self.tree_roots = [tree.getroot() for tree in self.content_trees]
-
+        self.infile = open_template(self.template)
+
+        # the entries are only read and parsed when they are first needed:
+        # the introspection methods only look at the content of the document
+        self.parser = lxml.etree.XMLParser(huge_tree=huge_tree)
+        self.__sources = {}
+        self.__trees = {}
+        self.__templated_files = None
+        self.__content_trees = None
         self.__prepare_namespaces()
 
+        # reported by the statistics of the compilation
+        self.read_time = default_timer() - start
+
         self.images = {}
         self.output_streams = []
         self.ignore_undefined_variables = ignore_undefined_variables
+        self.compiled = None
+        self.loops = []
+        self.profile = profile
+        self.expressions = []
+        self.deterministic_ids = deterministic_ids
+        if isinstance(formatter, six.string_types):
+            formatter = get_formatter(formatter)
+        self.formatter = formatter
+        self.data_styles = data_styles
+        self.field_formats = []
+        # the index in field_formats of the compiled data styles, or None for
+        # the styles that are not supported
+        self.__field_format_indexes = {}
+        self.__data_style_elements = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """release the template source. The template can still be rendered
+        if it has been compiled
+        """
+        if self.infile is not None:
+            self.infile.close()
+            self.infile = None
 
     def __prepare_namespaces(self):
-        """create proper namespaces for our document
+        """create proper namespaces for our document, completed with those
+        of each entry when it is parsed
         """
         # create needed namespaces
-        self.namespaces = dict(
+        self.__namespaces = dict(
             text="urn:text",
             draw="urn:draw",
             table="urn:table",
             office="urn:office",
             xlink="urn:xlink",
             svg="urn:svg",
-            manifest="urn:manifest",
+            manifest=MANIFEST_URI,
         )
+        self.__add_namespaces({})
 
+    def __add_namespaces(self, nsmap):
         # copy namespaces from original docs
-        for tree_root in self.tree_roots:
-            self.namespaces.update(tree_root.nsmap)
+        self.__namespaces.update(nsmap)
 
         # remove any "root" namespace as lxml.xpath do not support them
-        self.namespaces.pop(None, None)
+        self.__namespaces.pop(None, None)
 
         # declare the genshi namespace
-        self.namespaces['py'] = GENSHI_URI
+        self.__namespaces['py'] = GENSHI_URI
         # declare our own namespace
-        self.namespaces['py3o'] = PY3O_URI
+        self.__namespaces['py3o'] = PY3O_URI
+
+    def __get_tree(self, filename):
+        """return the tree of a templated entry, parsing it when it is first
+        asked for"""
+        tree = self.__trees.get(filename)
+        if tree is None:
+            content = self.__sources.pop(filename, None)
+            if content is None:
+                content = self.infile.read(filename)
+
+            tree = self.__trees[filename] = lxml.etree.parse(
+                BytesIO(content), self.parser
+            )
+            self.__add_namespaces(tree.getroot().nsmap)
+
+        return tree
+
+    @property
+    def namespaces(self):
+        """the namespaces of the parsed entries, the content of the document
+        always being parsed"""
+        self.__get_tree(CONTENT_FILE)
+        return self.__namespaces
+
+    @property
+    def templated_files(self):
+        """the names of the templated entries: the content of the document
+        first, then the styles and the content of the embedded objects that
+        hold py3o markers"""
+        if self.__templated_files is None:
+            templated_files = [CONTENT_FILE]
+            for filename in self.infile.namelist():
+                if filename != STYLES_FILE and not (
+                    EMBEDDED_CONTENT_RE.match(filename)
+                ):
+                    continue
+
+                content = self.infile.read(filename)
+                if has_py3o_markers(content):
+                    templated_files.append(filename)
+                    # kept until the entry is parsed
+                    self.__sources[filename] = content
+
+            self.__templated_files = templated_files
+
+        return self.__templated_files
+
+    @property
+    def content_trees(self):
+        """the trees of the templated entries, in the order of
+        templated_files"""
+        if self.__content_trees is None:
+            self.__content_trees = [
+                self.__get_tree(filename) for filename in self.templated_files
+            ]
+
+        return self.__content_trees
+
+    @property
+    def tree_roots(self):
+        return [tree.getroot() for tree in self.content_trees]
 
     def get_user_instructions(self):
         """ Public method to help report engine to find all instructions
         """
         res = []
         # TODO: Check if instructions can be stored in other content_trees
-        for e in get_instructions(self.content_trees[0], self.namespaces):
+        for e in get_instructions(
+            self.__get_tree(CONTENT_FILE), self.namespaces
+        ):
             childs = e.getchildren()
             if childs:
                 res.extend([c.text for c in childs])
@@ -246,7 +1269,7 @@ class Template(object):
 
     def remove_soft_breaks(self):
         for soft_break in get_soft_breaks(
-                self.content_trees[0], self.namespaces):
+                self.__get_tree(CONTENT_FILE), self.namespaces):
             soft_break.getparent().remove(soft_break)
 
     def get_user_instructions_mapping(self):
@@ -298,15 +1321,34 @@ class Template(object):
                      if not v.split('.')[0] in for_insts.keys()]
         return res, user_vars
 
+    def get_extraction_plan(self):
+        """ Public method to get the data the template displays compiled
+        into an L{ExtractionPlan}, which extracts it from any number of data
+        sets and tells which attributes each loop reads for prefetching
+        """
+        return ExtractionPlan(*self.get_user_instructions_mapping())
+
     @staticmethod
-    def handle_instructions(content_trees, namespaces):
+    def handle_instructions(content_trees, namespaces, links=None):
+        """pair the opening and closing py3o links of the content trees
+
+        @param links: the py3o links of each content tree if they have been
+        found already
+        @type links: a list of lists of elements
+        """
 
         opened_starts = list()
         starting_tags = list()
         closing_tags = dict()
 
-        for content_tree in content_trees:
-            for link in get_instructions(content_tree, namespaces):
+        if links is None:
+            links = [
+                get_instructions(content_tree, namespaces)
+                for content_tree in content_trees
+            ]
+
+        for tree_links in links:
+            for link in tree_links:
                 py3o_statement = urllib.parse.unquote(
                     link.attrib['{%s}href' % namespaces['xlink']]
                 )
@@ -386,6 +1428,14 @@ class Template(object):
         # max split is one
         instruction, instruction_value = py3o_base.split("=", 1)
         instruction_value = instruction_value.strip('"')
+        origin = 'py3o://%s' % py3o_base
+        if instruction == 'for':
+            instruction_value = self.__prepare_loop(instruction_value, origin)
+
+        elif instruction == 'if':
+            instruction_value = self.__wrap_expression(
+                origin, instruction_value
+            )
 
         attribs = dict()
         attribs['{%s}strip' % GENSHI_URI] = 'True'
@@ -411,6 +1461,51 @@ class Template(object):
             raise TemplateException("Could not move siblings for '%s'" %
                                     py3o_base)
 
+    def __prepare_loop(self, instruction_value, origin):
+        """make the iterable of a for instruction go through the
+        __py3o_loop__ function, which counts its iterations when statistics
+        are collected
+        """
+        if ' in ' not in instruction_value:
+            # left for Genshi to report
+            return instruction_value
+
+        targets, iterable = instruction_value.split(' in ', 1)
+        self.loops.append(instruction_value)
+        return '%s in __py3o_loop__(%s, %s)' % (
+            targets,
+            len(self.loops) - 1,
+            self.__wrap_expression(origin, iterable.strip(), iterable=True),
+        )
+
+    def __wrap_expression(self, origin, source, iterable=False):
+        """return the source of an expression, wrapped in a function timing
+        its evaluations when the template is compiled with profiling
+
+        @param origin: the py3o link or field the expression comes from
+        @type origin: string
+
+        @param source: the Python source of the expression
+        @type source: string
+
+        @param iterable: whether the expression is the iterable of a loop,
+        the time spent getting its items is then added to its evaluation
+        @type iterable: boolean
+        """
+        if not self.profile:
+            return source
+
+        # the clock is read right before the expression is evaluated, as the
+        # arguments are evaluated in order. A lambda would make the template
+        # impossible to pickle: Genshi pickles the code of its expressions
+        # but not the code nested in them
+        self.expressions.append((origin, source))
+        return '%s(%s, __py3o_clock__(), (%s))' % (
+            '__py3o_iter__' if iterable else '__py3o_expr__',
+            len(self.expressions) - 1,
+            source,
+        )
+
     def get_user_variables(self):
         """a public method to help report engines to introspect
         a template and find what data it needs and how it will be
@@ -419,16 +1514,18 @@ class Template(object):
         # TODO: Check if some user fields are stored in other content_trees
         return [
             e.get('{%s}name' % e.nsmap.get('text'))[5:]
-            for e in get_user_fields(self.content_trees[0], self.namespaces)
+            for e in get_user_fields(
+                self.__get_tree(CONTENT_FILE), self.namespaces
+            )
         ]
 
-    def __prepare_userfield_decl(self):
+    def __prepare_userfield_decl(self, markers):
         self.field_info = dict()
 
-        for content_tree in self.content_trees:
+        for tree_markers in markers:
             # here we gather the fields info in one pass to be able to avoid
             # doing the same operation multiple times.
-            for userfield in get_user_fields(content_tree, self.namespaces):
+            for userfield in tree_markers.user_field_decls:
 
                 value = userfield.attrib[
                     '{%s}name' % self.namespaces['text']
@@ -449,24 +1546,79 @@ class Template(object):
                     'value_datastyle_name': value_datastyle_name,
                 }
 
-    def __prepare_usertexts(self):
+    def __get_data_styles(self, root):
+        """return the data styles visible from an entry: its own and the
+        common styles of styles.xml, which some archives do not have
+
+        @param root: the root element of the entry
+        @type root: lxml.etree.Element
+        """
+        styles = self.__data_style_elements.get(root)
+        if styles is None:
+            trees = []
+            if STYLES_FILE in self.infile.namelist():
+                trees.append(self.__get_tree(STYLES_FILE))
+
+            # the styles of the last tree win
+            trees.append(root.getroottree())
+            styles = self.__data_style_elements[root] = get_data_styles(
+                trees
+            )
+
+        return styles
+
+    def __get_field_format(self, userfield, name):
+        """return the expression of the function formatting the values of a
+        user field as its data style does, compiling the style when it is
+        first used, or None when the field is formatted by the formatter
+        """
+        if not self.data_styles:
+            return None
+
+        style_name = userfield.get(
+            '{%s}data-style-name' % self.namespaces['style']
+        ) or self.field_info[name]['value_datastyle_name']
+        if not style_name:
+            return None
+
+        # the same name may be given to automatic styles of different
+        # entries: the styles are looked up in the entry of the field first
+        root = userfield.getroottree().getroot()
+        key = (root, style_name)
+        if key not in self.__field_format_indexes:
+            field_format = compile_data_style(
+                style_name, self.__get_data_styles(root),
+                self.formatter or DEFAULT_FORMATTER,
+            )
+            if field_format is None:
+                index = None
+            else:
+                self.field_formats.append(field_format)
+                index = len(self.field_formats) - 1
+
+            self.__field_format_indexes[key] = index
+
+        index = self.__field_format_indexes[key]
+        if index is None:
+            return None
+
+        return '__py3o_format__[%d]' % index
+
+    def __prepare_usertexts(self, markers):
         """Replace user-type text fields that start with "py3o." with genshi
         instructions.
         """
 
-        field_expr = "//text:user-field-get[starts-with(@text:name, 'py3o.')]"
-
-        for content_tree in self.content_trees:
+        for tree_markers in markers:
 
-            for userfield in content_tree.xpath(
-                field_expr,
-                namespaces=self.namespaces
-            ):
+            for userfield in tree_markers.user_fields:
                 parent = userfield.getparent()
                 value = userfield.attrib[
                     '{%s}name' % self.namespaces['text']
                 ][5:]
+                origin = 'py3o.%s' % value
                 value_type = self.field_info[value]['value_type']
+                field_format = self.__get_field_format(userfield, value)
 
                 # we try to override global var type with local settings
                 value_type_attr = '{%s}value-type' % self.namespaces['office']
@@ -495,7 +1647,9 @@ class Template(object):
                     rec = 0
 
                     if found_node:
-                        parent_node.attrib[value_attr] = "${%s}" % value
+                        parent_node.attrib[value_attr] = "${%s}" % (
+                            self.__wrap_expression(origin, value)
+                        )
                     else:
                         parent_node = userfield
                         while rec <= 7:
@@ -503,22 +1657,31 @@ class Template(object):
                                 break
 
                             if value_attr in parent_node.attrib:
-                                parent_node.attrib[value_attr] = "${%s}" % value
+                                parent_node.attrib[value_attr] = "${%s}" % (
+                                    self.__wrap_expression(origin, value)
+                                )
                                 break
 
                             rec += 1
                             parent_node = parent_node.getparent()
 
-                    value = "format_float(%s)" % value
+                    value = "%s(%s)" % (field_format or 'format_float', value)
 
                 if value_type == 'percentage':
                     del parent_node.attrib[value_attr]
-                    value = "format_percentage(%s)" % value
+                    value = "%s(%s)" % (
+                        field_format or 'format_percentage', value
+                    )
                     parent_node.attrib[value_type_attr] = "string"
 
+                elif value_type != 'float' and field_format is not None:
+                    value = "%s(%s)" % (field_format, value)
+
                 attribs = dict()
                 attribs['{%s}strip' % GENSHI_URI] = 'True'
-                attribs['{%s}content' % GENSHI_URI] = value
+                attribs['{%s}content' % GENSHI_URI] = self.__wrap_expression(
+                    origin, value
+                )
 
                 genshi_node = lxml.etree.Element(
                     'span',
@@ -531,179 +1694,293 @@ class Template(object):
 
                 parent.replace(userfield, genshi_node)
 
-    def __replace_image_links(self):
+    def __prepare_image_links(self, markers):
         """Replace links of placeholder images (the name of which starts with
-        "py3o.") to point to a file saved the "Pictures" directory of the
-        archive.
+        "py3o.") by a Genshi expression pointing to a file saved in the
+        "Pictures" directory of the archive when the image data is provided
+        at rendering time.
         """
 
-        image_expr = "//draw:frame[starts-with(@draw:name, 'py3o.')]"
-
-        for content_tree in self.content_trees:
+        for tree_markers in markers:
 
             # Find draw:frame tags.
-            for draw_frame in content_tree.xpath(
-                image_expr,
-                namespaces=self.namespaces
-            ):
+            for draw_frame in tree_markers.image_frames:
                 # Find the identifier of the image (py3o.[identifier]).
                 image_id = draw_frame.attrib[
                     '{%s}name' % self.namespaces['draw']
                 ][5:]
-                if image_id not in self.images:
-                    if not self.ignore_undefined_variables:
-                        raise TemplateException(
-                            "Can't find data for the image named 'py3o.%s'; "
-                            "make sure it has been added with the "
-                            "set_image_path or set_image_data methods."
-                            % image_id
-                        )
-                    else:
-                        continue
 
                 # Replace the xlink:href attribute of the image to point to
                 # ours.
                 image = draw_frame[0]
-                image.attrib[
-                    '{%s}href' % self.namespaces['xlink']
-                ] = PY3O_IMAGE_PREFIX + image_id
+                href_attr = '{%s}href' % self.namespaces['xlink']
+                image.attrib[href_attr] = "${__py3o_image_href__(%r, %r)}" % (
+                    image_id, image.attrib.get(href_attr, ''),
+                )
 
-    def __add_images_to_manifest(self):
-        """Add entries for py3o images into the manifest file."""
+    def __prepare_list_ids(self, markers):
+        """Give the lists repeated by a loop an xml:id computed at rendering
+        time, so that each of their copies has its own. The other lists keep
+        the id they have in the template.
+        """
+        id_attr = '%sid' % XML_NS
+        for_attr = '{%s}for' % GENSHI_URI
 
-        xpath_expr = "//manifest:manifest[1]"
+        for tree_markers in markers:
+            for list_element in tree_markers.lists:
+                if list_element.get(id_attr) is None:
+                    continue
 
-        for content_tree in self.content_trees:
+                if any(
+                    ancestor.get(for_attr) is not None
+                    for ancestor in list_element.iterancestors()
+                ):
+                    list_element.set(id_attr, '${__py3o_list_id__()}')
 
-            # Find manifest:manifest tags.
-            manifest_e = content_tree.xpath(
-                xpath_expr,
-                namespaces=self.namespaces
-            )
-            if not manifest_e:
-                continue
-
-            for identifier in self.images.keys():
-                # Add a manifest:file-entry tag.
-                lxml.etree.SubElement(
-                    manifest_e[0],
-                    '{%s}file-entry' % self.namespaces['manifest'],
-                    attrib={
-                        '{%s}full-path' % self.namespaces['manifest']: (
-                            PY3O_IMAGE_PREFIX + identifier
-                        ),
-                        '{%s}media-type' % self.namespaces['manifest']: '',
-                    }
-                )
+    def compile(self, stats=None):
+        """transform the py3o template into Genshi templates once and for all
+        and return them as a L{CompiledTemplate} that can be rendered any
+        number of times.
 
-    def render_tree(self, data):
-        """prepare the flows without saving to file
-        this method has been decoupled from render_flow to allow better
-        unit testing
+        The content trees of this template are modified in place, subsequent
+        calls return the same compiled template.
+
+        @param stats: statistics filled with the timings of the compilation
+        @type stats: RenderStats
+
+        @returns: CompiledTemplate
         """
-        # TODO: find a way to make this localization aware...
-        # because ATM it formats texts using French style numbers...
-        # best way would be to let the user inject its own vars...
-        # but this would not work on fusion servers...
-        # so we must find a way to localize this a bit... or remove it and
-        # consider our caller must pre - render its variables to the desired
-        # locale...?
-        new_data = dict(
-            decimal=decimal,
-            format_float=(
-                lambda val: (
-                    isinstance(
-                        val, decimal.Decimal
-                    ) or isinstance(
-                        val, float
-                    )
-                ) and str(val).replace('.', ',') or val
-            ),
-            format_percentage=(
-                lambda val: ("%0.2f %%" % val).replace('.', ',')
-            )
-        )
+        if self.compiled is not None:
+            return self.compiled
 
-        # Soft page breaks are hints for applications for rendering a page
-        # break. Soft page breaks in for loops may compromise the paragraph
-        # formatting especially the margins. Open-/LibreOffice will regenerate
-        # the page breaks when displaying the document. Therefore it is save to
-        # remove them.
-        self.remove_soft_breaks()
-
-        # first we need to transform the py3o template into a valid
-        # Genshi template.
-        starting_tags, closing_tags = self.handle_instructions(
-            self.content_trees,
-            self.namespaces
-        )
-        parents = [tag[0].getparent() for tag in starting_tags]
-        linknum = len(parents)
-        parentnum = len(set(parents))
-        if not linknum == parentnum:
-            raise TemplateException(
-                "Every py3o link instruction should be on its own line"
+        if stats is not None:
+            stats.add_time('read', self.read_time)
+            timer = stats.timer
+        else:
+            timer = null_timer
+
+        with timer('read'):
+            # parse the templated entries that have not been yet
+            self.content_trees
+
+        with timer('instructions'):
+            # a single walk of each tree finds both the soft breaks and the
+            # py3o links
+            soft_breaks, links = zip(*[
+                scan_instructions(content_tree, self.namespaces)
+                for content_tree in self.content_trees
+            ])
+
+            # Soft page breaks are hints for applications for rendering a
+            # page break. Soft page breaks in for loops may compromise the
+            # paragraph formatting especially the margins. Open-/LibreOffice
+            # will regenerate the page breaks when displaying the document.
+            # Therefore it is save to remove them.
+            for soft_break in soft_breaks[0]:
+                soft_break.getparent().remove(soft_break)
+
+            # first we need to transform the py3o template into a valid
+            # Genshi template.
+            starting_tags, closing_tags = self.handle_instructions(
+                self.content_trees,
+                self.namespaces,
+                links=links,
             )
+            parents = [tag[0].getparent() for tag in starting_tags]
+            linknum = len(parents)
+            parentnum = len(set(parents))
+            if not linknum == parentnum:
+                raise TemplateException(
+                    "Every py3o link instruction should be on its own line"
+                )
 
-        for link, py3o_base in starting_tags:
-            self.handle_link(
-                link,
-                py3o_base,
-                closing_tags[id(link)]
-            )
+        with timer('links'):
+            for link, py3o_base in starting_tags:
+                self.handle_link(
+                    link,
+                    py3o_base,
+                    closing_tags[id(link)]
+                )
 
-        self.__prepare_userfield_decl()
-        self.__prepare_usertexts()
+        with timer('user_fields'):
+            # handling the links copies some paragraphs, the other markers
+            # are only looked for afterwards
+            markers = [
+                scan_markers(content_tree, self.namespaces)
+                for content_tree in self.content_trees
+            ]
+            self.__prepare_userfield_decl(markers)
+            self.__prepare_usertexts(markers)
+
+        with timer('image_links'):
+            self.__prepare_image_links(markers)
+
+        with timer('list_ids'):
+            self.__prepare_list_ids(markers)
+
+        with timer('genshi_compile'):
+            templates = []
+            for fnum, content_tree in enumerate(self.content_trees):
+                content = get_markup_stream(content_tree)
+                if self.ignore_undefined_variables:
+                    template = MarkupTemplate(content, lookup='lenient')
+                else:
+                    template = MarkupTemplate(content)
+
+                # the entries without loops nor conditions are rendered by
+                # joining their static parts with the values of their fields
+                if has_only_fields(content_tree):
+                    template = get_static_template(template) or template
+                templates.append((self.templated_files[fnum], template))
+
+        with timer('static_entries'):
+            template_infos = {}
+            static_entries = []
+            manifest = None
+            for info_zip in self.infile.infolist():
+                if info_zip.filename in self.templated_files:
+                    template_infos[info_zip.filename] = info_zip
+
+                elif info_zip.filename == MANIFEST_FILE:
+                    template_infos[info_zip.filename] = info_zip
+                    manifest = self.infile.read(info_zip)
+
+                elif info_zip.filename == 'mimetype':
+                    # the mimetype must be the first entry of the archive
+                    static_entries.insert(
+                        0, (info_zip, read_raw_entry(self.infile, info_zip))
+                    )
 
-        self.__replace_image_links()
-        self.__add_images_to_manifest()
+                else:
+                    static_entries.append(
+                        (info_zip, read_raw_entry(self.infile, info_zip))
+                    )
 
-        for fnum, content_tree in enumerate(self.content_trees):
-            content = lxml.etree.tostring(content_tree.getroot())
-            if self.ignore_undefined_variables:
-                template = MarkupTemplate(content, lookup='lenient')
-            else:
-                template = MarkupTemplate(content)
+        if stats is not None:
+            stats.instructions += len(starting_tags)
+
+        self.compiled = CompiledTemplate(
+            templates,
+            template_infos,
+            ArchiveSkeleton(static_entries),
+            self.namespaces,
+            ignore_undefined_variables=self.ignore_undefined_variables,
+            loops=self.loops,
+            expressions=self.expressions,
+            deterministic_ids=self.deterministic_ids,
+            formatter=self.formatter,
+            field_formats=self.field_formats,
+            manifest=manifest,
+        )
 
-            # then we need to render the genshi template itself by
-            # providing the data to genshi
+        # everything we need from the source archive has been read
+        self.close()
 
-            template_dict = {}
-            template_dict.update(data.items())
-            template_dict.update(new_data.items())
+        return self.compiled
 
-            self.output_streams.append(
-                (
-                    self.templated_files[fnum],
-                    template.generate(**template_dict)
-                )
-            )
+    def render_tree(self, data, stats=None):
+        """prepare the flows without saving to file
+        this method has been decoupled from render_flow to allow better
+        unit testing
+        """
+        # then we need to render the genshi template itself by
+        # providing the data to genshi
+        self.output_streams = self.compile(stats=stats).generate(
+            data, self.images, stats=stats
+        )
 
-    def render_flow(self, data):
+    def render_flow(
+            self, data, spool_size=None, compression=None, stats=None
+    ):
         """render the OpenDocument with the user data
 
         @param data: the input stream of user data. This should be a dictionary
         mapping, keys being the values accessible to your report.
         @type data: dictionary
+
+        @param spool_size: if given, each templated entry is spooled in a
+        temporary file spilling to disk above that many bytes instead of being
+        compressed straight into the output
+        @type spool_size: int
+
+        @param compression: how the entries written to the output are
+        compressed, DEFAULT_COMPRESSION if None
+        @type compression: CompressionPolicy
+
+        @param stats: statistics filled during the rendering
+        @type stats: RenderStats
         """
 
-        self.render_tree(data)
+        self.render_tree(data, stats=stats)
 
         # then reconstruct a new ODT document with the generated content
-        for status in self.__save_output():
+        for status in self.__save_output(
+            self.outputfilename, spool_size=spool_size,
+            compression=compression, stats=stats,
+        ):
             yield status
 
-    def render(self, data):
+    def render(self, data, spool_size=None, compression=None, stats=None):
         """render the OpenDocument with the user data
 
         @param data: the input stream of userdata. This should be a dictionary
         mapping, keys being the values accessible to your report.
         @type data: dictionary
+
+        @param spool_size: if given, each templated entry is spooled in a
+        temporary file spilling to disk above that many bytes instead of being
+        compressed straight into the output
+        @type spool_size: int
+
+        @param compression: how the entries written to the output are
+        compressed, DEFAULT_COMPRESSION if None
+        @type compression: CompressionPolicy
+
+        @param stats: statistics filled during the rendering
+        @type stats: RenderStats
+        """
+        for status in self.render_flow(
+            data, spool_size=spool_size, compression=compression,
+            stats=stats,
+        ):
+            if not status:
+                raise TemplateException("unknown template error")
+
+    def render_to_bytes(
+            self, data, spool_size=None, compression=None, stats=None
+    ):
+        """render the OpenDocument with the user data and return it instead
+        of writing it to the outfile of this template
+
+        @param data: the input stream of userdata. This should be a dictionary
+        mapping, keys being the values accessible to your report.
+        @type data: dictionary
+
+        @param spool_size: if given, each templated entry is spooled in a
+        temporary file spilling to disk above that many bytes instead of being
+        compressed straight into the output
+        @type spool_size: int
+
+        @param compression: how the entries written to the output are
+        compressed, DEFAULT_COMPRESSION if None
+        @type compression: CompressionPolicy
+
+        @param stats: statistics filled during the rendering
+        @type stats: RenderStats
+
+        @returns: the content of the resulting ODT document as bytes
         """
-        for status in self.render_flow(data):
+        self.render_tree(data, stats=stats)
+
+        out = BytesIO()
+        for status in self.__save_output(
+            out, spool_size=spool_size, compression=compression, stats=stats
+        ):
             if not status:
                 raise TemplateException("unknown template error")
 
+        return out.getvalue()
+
     def set_image_path(self, identifier, path):
         """Set data for an image mentioned in the template.
 
@@ -732,48 +2009,13 @@ class Template(object):
 
         self.images[identifier] = data
 
-    def __save_output(self):
+    def __save_output(
+            self, outfile, spool_size=None, compression=None, stats=None
+    ):
         """Saves the output into a native OOo document format.
         """
-        out = zipfile.ZipFile(self.outputfilename, 'w')
-
-        for info_zip in self.infile.infolist():
-
-            if info_zip.filename in self.templated_files:
-                # Template file - we have edited these.
-
-                # get a temp file
-                streamout = open(get_secure_filename(), "w+b")
-                fname, output_stream = self.output_streams[
-                    self.templated_files.index(info_zip.filename)
-                ]
-
-                transformer = get_list_transformer(self.namespaces)
-                remapped_stream = output_stream | transformer
-
-                # write the whole stream to it
-                for chunk in remapped_stream.serialize():
-                    streamout.write(chunk.encode('utf-8'))
-                    yield True
-
-                # close the temp file to flush all data and make sure we get
-                # it back when writing to the zip archive.
-                streamout.close()
-
-                # write the full file to archive
-                out.write(streamout.name, fname)
-
-                # remove temp file
-                os.unlink(streamout.name)
-
-            else:
-                # Copy other files straight from the source archive.
-                out.writestr(info_zip, self.infile.read(info_zip.filename))
-
-        # Save images in the "Pictures" sub-directory of the archive.
-        for identifier, data in self.images.items():
-            out.writestr(PY3O_IMAGE_PREFIX + identifier, data)
-
-        # close the zipfile before leaving
-        out.close()
-        yield True
+        for status in self.compile()._save_output(
+            outfile, self.output_streams, self.images,
+            spool_size=spool_size, compression=compression, stats=stats,
+        ):
+            yield status
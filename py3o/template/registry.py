@@ -0,0 +1,174 @@
+# -*- encoding: utf-8 -*-
+"""an in-process registry of compiled templates, for applications rendering
+from many different template files
+"""
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+
+from py3o.template.cache import get_options_key
+from py3o.template.main import Template
+
+
+def get_compiled_size(compiled):
+    """estimate the memory used by a compiled template: the size of its
+    static entries and the uncompressed size of its templated entries
+    """
+    return len(compiled.skeleton.data) + sum(
+        info_zip.file_size for info_zip in compiled.template_infos.values()
+    )
+
+
+class RegistryEntry(object):
+    def __init__(self, compiled, mtime, size, digest):
+        self.compiled = compiled
+        self.mtime = mtime
+        self.size = size
+        self.digest = digest
+        self.memory_size = get_compiled_size(compiled)
+
+
+class TemplateRegistry(object):
+    """Keep compiled templates in memory, keyed by their path.
+
+    An entry is checked against the modification time and size of its file
+    on every lookup, and against the hash of the file content when those
+    changed, so an edited template is compiled again. The least recently used
+    entries are evicted when the registry holds more than max_entries
+    templates or more than max_bytes bytes of them.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, cache=None):
+        """
+        @param max_entries: the maximum number of compiled templates to keep,
+        None means unbounded
+        @type max_entries: int
+
+        @param max_bytes: the maximum estimated memory used by the compiled
+        templates, None means unbounded
+        @type max_bytes: int
+
+        @param cache: an on-disk cache used to load the templates that are
+        not in memory yet
+        @type cache: py3o.template.cache.TemplateCache
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache = cache
+
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(
+            self, template, ignore_undefined_variables=False,
+            deterministic_ids=False, huge_tree=False, formatter=None,
+            data_styles=False
+    ):
+        """return the compiled form of a template file. A template is
+        compiled once per set of options
+
+        @param template: a py3o template file
+        @type template: a string representing the full path name to a py3o
+        template file
+
+        The other parameters are the compilation options of L{Template}
+
+        @returns: CompiledTemplate
+        """
+        options = dict(
+            ignore_undefined_variables=ignore_undefined_variables,
+            deterministic_ids=deterministic_ids,
+            huge_tree=huge_tree,
+            formatter=formatter,
+            data_styles=data_styles,
+        )
+        key = (os.path.abspath(template), get_options_key(**options))
+        stat = os.stat(template)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (
+                entry.mtime == stat.st_mtime and entry.size == stat.st_size
+            ):
+                self.entries[key] = self.entries.pop(key)
+                self.hits += 1
+                return entry.compiled
+
+        with open(template, 'rb') as f:
+            template_data = f.read()
+        digest = hashlib.sha256(template_data).hexdigest()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry.digest == digest:
+                    # touched but unchanged
+                    entry.mtime = stat.st_mtime
+                    entry.size = stat.st_size
+                    self.entries[key] = self.entries.pop(key)
+                    self.hits += 1
+                    return entry.compiled
+
+                self.invalidations += 1
+                self.__remove(key)
+
+            self.misses += 1
+
+        if self.cache is not None:
+            compiled = self.cache.compile_data(template_data, **options)
+        else:
+            compiled = Template(template_data, **options).compile()
+
+        entry = RegistryEntry(compiled, stat.st_mtime, stat.st_size, digest)
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+
+            self.entries[key] = entry
+            self.total_bytes += entry.memory_size
+            self.__evict()
+
+        return compiled
+
+    def __remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.memory_size
+
+    def __evict(self):
+        # always keep the most recent entry, even if it is too large alone
+        while len(self.entries) > 1 and (
+            (
+                self.max_entries is not None and
+                len(self.entries) > self.max_entries
+            ) or (
+                self.max_bytes is not None and
+                self.total_bytes > self.max_bytes
+            )
+        ):
+            self.__remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self):
+        """return the counters of the registry, to help sizing it"""
+        with self.lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations,
+                entries=len(self.entries),
+                bytes=self.total_bytes,
+            )
@@ -0,0 +1,291 @@
+# -*- encoding: utf-8 -*-
+"""render the templated entries that hold no loop nor condition, only field
+substitutions, without the Genshi machinery: their XML is serialized once
+at compile time into static chunks around the expressions of the fields
+"""
+import re
+
+import lxml.etree
+import six
+
+from genshi.compat import numeric_types
+from genshi.core import Markup, Stream, COMMENT, DOCTYPE, END, END_CDATA, \
+    END_NS, PI, START, START_CDATA, START_NS, TEXT, XML_DECL
+from genshi.template.base import Context, EXPR, SUB
+from genshi.template.directives import StripDirective
+
+# private use characters marking the place of the expressions in the
+# serialized template
+TEXT_MARK = u'\ue000%d\ue001'
+ATTRIBUTE_MARK = u'\ue002%d\ue003'
+MARK_RE = re.compile(
+    u' ([^ \t\n="<>]+)="\ue002(\\d+)\ue003"|\ue000(\\d+)\ue001'
+)
+MARK_CHARS_RE = re.compile(u'[\ue000-\ue003]')
+
+# the events written as they are, any other is rendered by Genshi
+STATIC_KINDS = frozenset([
+    START_NS, END_NS, COMMENT, PI, DOCTYPE, XML_DECL, START_CDATA, END_CDATA,
+])
+
+# any Genshi directive but those of the user fields
+HAS_DIRECTIVES = lxml.etree.XPath(
+    "boolean(//py:* | //@py:*[local-name() != 'strip' and "
+    "local-name() != 'content'])",
+    namespaces={'py': 'http://genshi.edgewall.org/'},
+)
+
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+# the whitespace normalization of the text nodes done by Genshi's
+# serializer, see genshi.output.WhitespaceFilter
+trim_trailing_space = re.compile('[ \t]+(?=\n)').sub
+collapse_lines = re.compile('\n{2,}').sub
+
+
+def escape_text(text):
+    return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(
+        u'>', u'&gt;'
+    )
+
+
+def escape_attribute(text):
+    return escape_text(text).replace(u'"', u'&#34;')
+
+
+class StaticStream(object):
+    """The output of a L{StaticTemplate}, standing for the Genshi stream of
+    a template: it is serialized to the chunks of the document."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def serialize(self, method='xml', **kwargs):
+        return iter(self.chunks)
+
+
+class StaticTemplate(object):
+    """A templated entry rendered by evaluating its expressions and joining
+    their values with the static XML around them.
+
+    The expressions are those compiled by Genshi and are evaluated the same
+    way, with the same lookup of the variables. Their values are written as
+    Genshi writes them: None omits an attribute or writes nothing, Markup is
+    not escaped and numbers are converted by the number conversion of the
+    template.
+    """
+
+    def __init__(self, template, chunks, slots):
+        """
+        @param template: the Genshi template of the entry, rendered as
+        usual when its stream is used on its own
+        @type template: MarkupTemplate
+
+        @param chunks: the serialized XML around the expressions, one more
+        than there are expressions
+        @type chunks: list of strings
+
+        @param slots: the expressions, the name of the attribute they are
+        the value of or None for a text, and for a text whether its
+        whitespace is normalized
+        @type slots: list of (Expression, string, boolean) tuples
+        """
+        self.template = template
+        self.chunks = chunks
+        self.slots = slots
+
+    @property
+    def stream(self):
+        return self.template.stream
+
+    def generate(self, **kwargs):
+        return StaticStream(self.__render(Context(**kwargs)))
+
+    def __render(self, ctxt):
+        chunks = self.chunks
+        number_conv = self.template._number_conv
+        parts = [chunks[0]]
+        append = parts.append
+        for index, (expr, attribute, collapse) in enumerate(self.slots):
+            value = expr.evaluate(ctxt)
+            if value is None:
+                text = u''
+            elif attribute is not None:
+                value = get_attribute_text(value, number_conv)
+                text = u'' if value is None else u' %s="%s"' % (
+                    attribute, escape_attribute(value)
+                )
+            else:
+                text = get_text(value, number_conv)
+                if collapse and u'\n' in text:
+                    text = collapse_lines(
+                        u'\n', trim_trailing_space(u'', text)
+                    )
+
+            append(text)
+            append(chunks[index + 1])
+
+        yield u''.join(parts)
+
+
+def get_text(value, number_conv):
+    """return the XML of the value of an expression in a text"""
+    if isinstance(value, Markup):
+        return six.text_type(value)
+
+    if isinstance(value, six.string_types):
+        return escape_text(value)
+
+    if isinstance(value, numeric_types):
+        return escape_text(number_conv(value))
+
+    if hasattr(value, '__iter__'):
+        # fragments of markup: serialized by Genshi
+        return Stream(ensure_events(value)).render(encoding=None)
+
+    return escape_text(six.text_type(value))
+
+
+def get_attribute_text(value, number_conv):
+    """return the text of the value of an expression in an attribute, None
+    if the attribute is omitted"""
+    if isinstance(value, six.string_types):
+        return value
+
+    if isinstance(value, numeric_types):
+        return number_conv(value)
+
+    if hasattr(value, '__iter__'):
+        values = [
+            data for kind, data, pos in ensure_events(value)
+            if kind is TEXT and data is not None
+        ]
+        return u''.join(values) if values else None
+
+    return six.text_type(value)
+
+
+def ensure_events(value):
+    for item in value:
+        if isinstance(item, tuple) and len(item) == 3:
+            yield item
+        else:
+            yield TEXT, six.text_type(item), (None, -1, -1)
+
+
+def is_stripped(directives):
+    """whether the directives of an element are only the py:strip="True" of
+    the spans of the user fields"""
+    return len(directives) == 1 and isinstance(
+        directives[0], StripDirective
+    ) and directives[0].expr is not None and (
+        directives[0].expr.source.strip() == 'True'
+    )
+
+
+def mark_expressions(stream, slots, preserve=0):
+    """yield the events of a template, the expressions being replaced by
+    marks numbered after their index in slots
+
+    @raise ValueError: the template holds a directive other than the
+    stripping of the user fields, an attribute made of several parts or a
+    mark character
+    """
+    for kind, data, pos in stream:
+        if kind is SUB:
+            directives, substream = data
+            if not is_stripped(directives):
+                raise ValueError('directive')
+
+            for event in mark_expressions(substream[1:-1], slots, preserve):
+                yield event
+
+        elif kind is EXPR:
+            slots.append((data, None, not preserve))
+            yield TEXT, TEXT_MARK % (len(slots) - 1), pos
+
+        elif kind is START:
+            tag, attrs = data
+            new_attrs = []
+            for name, value in attrs:
+                if type(value) is list:
+                    if len(value) != 1 or value[0][0] is not EXPR:
+                        raise ValueError('interpolation')
+
+                    slots.append((value[0][1], name, False))
+                    value = ATTRIBUTE_MARK % (len(slots) - 1)
+
+                elif MARK_CHARS_RE.search(value):
+                    raise ValueError('mark')
+
+                new_attrs.append((name, value))
+
+            if preserve or attrs.get(XML_SPACE) == 'preserve':
+                preserve += 1
+
+            yield kind, (tag, attrs.__class__(new_attrs)), pos
+
+        elif kind is END:
+            if preserve:
+                preserve -= 1
+
+            yield kind, data, pos
+
+        elif kind is TEXT:
+            if MARK_CHARS_RE.search(data):
+                raise ValueError('mark')
+
+            yield kind, data, pos
+
+        elif kind in STATIC_KINDS:
+            yield kind, data, pos
+
+        else:
+            # python code blocks and inclusions
+            raise ValueError('kind')
+
+
+def has_only_fields(tree):
+    """whether a transformed tree holds no Genshi directive but the ones of
+    its user fields, a quick test made before the template is prepared: the
+    prepared templates holding loops cannot be pickled anymore"""
+    return not HAS_DIRECTIVES(tree)
+
+
+def get_static_template(template):
+    """return a L{StaticTemplate} rendering a Genshi template that holds
+    nothing but field substitutions, None for any other template
+
+    @type template: MarkupTemplate
+    """
+    slots = []
+    try:
+        events = list(mark_expressions(template.stream, slots))
+    except ValueError:
+        return None
+
+    # the static parts are serialized by Genshi itself, so that they are
+    # written exactly as they would be at each rendering
+    serialized = u''.join(Stream(events).serialize(cache=False))
+
+    chunks = []
+    ordered_slots = []
+    start = 0
+    for match in MARK_RE.finditer(serialized):
+        chunks.append(serialized[start:match.start()])
+        start = match.end()
+        if match.group(2) is not None:
+            # the name of the attribute as written by the serializer
+            expr, name, collapse = slots[int(match.group(2))]
+            ordered_slots.append((expr, match.group(1), collapse))
+        else:
+            ordered_slots.append(slots[int(match.group(3))])
+
+    chunks.append(serialized[start:])
+    if len(ordered_slots) != len(slots):
+        return None
+
+    return StaticTemplate(template, chunks, ordered_slots)
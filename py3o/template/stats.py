@@ -0,0 +1,241 @@
+# -*- encoding: utf-8 -*-
+"""measure where the time of a compilation and of a rendering goes
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+from timeit import default_timer
+
+from py3o.template.columnar import get_rows
+
+
+def iterate_loop(index, iterable):
+    """the __py3o_loop__ function of a rendering without statistics: the
+    iterables of the loops are left untouched, columnar sources aside"""
+    return get_rows(iterable)
+
+
+def evaluate_expression(index, start, value):
+    """the __py3o_expr__ and __py3o_iter__ functions of a rendering without
+    statistics: the values of the expressions are returned untimed"""
+    return value
+
+
+def iterate_timed(iterator, entry):
+    """yield the items of an iterator, adding the time spent getting them to
+    an entry of the expression profile"""
+    while True:
+        start = default_timer()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            entry[1] += default_timer() - start
+
+        yield item
+
+
+@contextmanager
+def null_timer(phase):
+    """the timer of a compilation without statistics"""
+    yield
+
+
+class TimedIterator(object):
+    """Iterate over an iterable, adding up the time spent getting its items.
+
+    The items are read by batches so that the clock is only read twice per
+    batch, reading it around each item would cost more than getting most of
+    them.
+    """
+
+    def __init__(self, iterable, batch_size=256):
+        self.iterable = iterable
+        self.batch_size = batch_size
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        iterator = iter(self.iterable)
+        while True:
+            start = default_timer()
+            batch = list(islice(iterator, self.batch_size))
+            self.elapsed += default_timer() - start
+            if not batch:
+                return
+
+            for item in batch:
+                yield item
+
+
+class RenderStats(object):
+    """Statistics of the compilation and of the renderings of a template.
+
+    Give an instance to the render methods with their stats argument and it
+    is filled as the document is written: the wall time of each phase in
+    seconds, the uncompressed and compressed sizes of each templated entry,
+    the number of iterations of each loop, the number and size of the
+    images and the number of instructions handled by the compilation, if
+    it happened during the rendering. An instance given to several
+    renderings adds them up.
+
+    Collecting them costs a few percents of the rendering time, mostly
+    spent counting the loop items.
+
+    The renderings of a template compiled with profile=True also record the
+    number of evaluations and the cumulative time of each of its
+    expressions, see L{get_expression_report}.
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self.entries = OrderedDict()
+        self.loop_iterations = OrderedDict()
+        self.instructions = 0
+        self.images = 0
+        self.image_bytes = 0
+        self.renders = 0
+        # [calls, seconds] keyed by (origin, source) of the expressions
+        self.expressions = OrderedDict()
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        """a context manager adding the time spent in it to a phase"""
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add_time(phase, default_timer() - start)
+
+    def add_entry(self, zinfo):
+        """add the sizes of an archive entry once it has been written"""
+        size, compress_size = self.entries.get(zinfo.filename, (0, 0))
+        self.entries[zinfo.filename] = (
+            size + zinfo.file_size, compress_size + zinfo.compress_size
+        )
+
+    def add_image(self, data):
+        self.images += 1
+        self.image_bytes += len(data)
+
+    def get_loop_function(self, loops):
+        """return the __py3o_loop__ function counting the iterations of the
+        loops of a template
+
+        @param loops: the for instructions of the template, in the order of
+        the indexes the function is called with
+        @type loops: list of strings
+        """
+        counts = self.loop_iterations
+        for loop in loops:
+            counts.setdefault(loop, 0)
+
+        def count_loop(index, iterable):
+            loop = loops[index]
+            for item in get_rows(iterable):
+                counts[loop] += 1
+                yield item
+
+        return count_loop
+
+    def get_expression_functions(self, expressions):
+        """return the __py3o_expr__ and __py3o_iter__ functions timing the
+        expressions of a template compiled with profiling
+
+        The functions are called with the index of the expression, the time
+        read by __py3o_clock__ just before the expression is evaluated and
+        its value. __py3o_expr__ times the evaluation of an expression.
+        __py3o_iter__ times the evaluation of the iterable of a loop along
+        with the time spent getting each of its items, where lazy loads
+        usually happen.
+
+        @param expressions: the origin and the source of each expression of
+        the template, in the order of the indexes the functions are called
+        with
+        @type expressions: list of (string, string) tuples
+        """
+        entries = [
+            self.expressions.setdefault(expression, [0, 0.0])
+            for expression in expressions
+        ]
+
+        def evaluate(index, start, value):
+            entry = entries[index]
+            entry[0] += 1
+            entry[1] += default_timer() - start
+            return value
+
+        def iterate(index, start, value):
+            entry = entries[index]
+            try:
+                iterator = iter(value)
+            finally:
+                entry[0] += 1
+                entry[1] += default_timer() - start
+
+            return iterate_timed(iterator, entry)
+
+        return evaluate, iterate
+
+    def get_expression_report(self, top=20):
+        """return a report of the expressions that took the most time, as
+        text: their number of evaluations, their cumulative and mean times,
+        the py3o link or field they come from and their source
+
+        @param top: the number of expressions reported
+        @type top: int
+        """
+        profile = sorted(
+            self.expressions.items(),
+            key=lambda item: item[1][1],
+            reverse=True,
+        )[:top]
+
+        lines = ['%8s %10s %10s  %s' % (
+            'calls', 'total (s)', 'mean (s)', 'expression'
+        )]
+        for (origin, source), (calls, seconds) in profile:
+            lines.append('%8d %10.4f %10.6f  %s: %s' % (
+                calls, seconds, seconds / calls if calls else 0.0,
+                origin, source,
+            ))
+
+        return '\n'.join(lines)
+
+    @property
+    def total_time(self):
+        return sum(self.timings.values())
+
+    def get_metrics(self, prefix='py3o'):
+        """return the statistics as a flat dictionary of numbers keyed by
+        dotted names, ready to be sent to a metrics system
+        """
+        metrics = OrderedDict()
+        for phase, seconds in self.timings.items():
+            metrics['%s.time.%s' % (prefix, phase)] = seconds
+
+        metrics['%s.time.total' % prefix] = self.total_time
+
+        for filename, (size, compress_size) in self.entries.items():
+            metrics['%s.bytes.%s' % (prefix, filename)] = size
+            metrics['%s.compressed_bytes.%s' % (prefix, filename)] = (
+                compress_size
+            )
+
+        for loop, count in self.loop_iterations.items():
+            metrics['%s.loop.%s' % (prefix, loop)] = count
+
+        metrics['%s.instructions' % prefix] = self.instructions
+        metrics['%s.images' % prefix] = self.images
+        metrics['%s.image_bytes' % prefix] = self.image_bytes
+        metrics['%s.renders' % prefix] = self.renders
+        return metrics
+
+    def __repr__(self):
+        return '<RenderStats %s>' % ', '.join(
+            '%s=%.4fs' % (phase, seconds)
+            for phase, seconds in self.timings.items()
+        )
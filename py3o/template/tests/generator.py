@@ -0,0 +1,414 @@
+# -*- encoding: utf-8 -*-
+"""build valid py3o templates of any size programmatically, for the
+benchmarks and the stress tests, instead of storing large template files
+"""
+import struct
+import zipfile
+import zlib
+
+from io import BytesIO
+
+from six.moves import urllib
+
+NAMESPACES = dict(
+    office="urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+    style="urn:oasis:names:tc:opendocument:xmlns:style:1.0",
+    text="urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+    table="urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+    draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0",
+    fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0",
+    xlink="http://www.w3.org/1999/xlink",
+    svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0",
+    manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0",
+)
+
+XMLNS = ' '.join(
+    'xmlns:%s="%s"' % (prefix, uri)
+    for prefix, uri in sorted(NAMESPACES.items())
+    if prefix != 'manifest'
+)
+
+MIMETYPE = 'application/vnd.oasis.opendocument.text'
+
+# the office:value-type of the user fields, with the attribute holding their
+# value and the value of the fields in the data
+VALUE_TYPES = [
+    ('string', 'office:string-value', lambda i: u'value %s' % i),
+    ('float', 'office:value', lambda i: 1234.5 + i),
+    ('percentage', 'office:value', lambda i: 0.25 + i),
+    ('currency', 'office:value', lambda i: 10.5 + i),
+    ('date', 'office:date-value', lambda i: u'2015-01-%02d' % (i % 28 + 1)),
+    ('time', 'office:time-value', lambda i: u'PT%02dH00M00S' % (i % 24)),
+    ('boolean', 'office:boolean-value', lambda i: u'true'),
+]
+
+# the value types py3o can only render in a table cell, where the cell holds
+# the value
+CELL_VALUE_TYPES = ('percentage',)
+
+VALUE_ATTRIBUTES = dict(
+    (value_type, attribute) for value_type, attribute, func in VALUE_TYPES
+)
+VALUE_FUNCS = dict(
+    (value_type, func) for value_type, attribute, func in VALUE_TYPES
+)
+
+MANIFEST = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<manifest:manifest xmlns:manifest="%s" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:media-type="%s"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" '
+    'manifest:media-type="text/xml"/>'
+    '<manifest:file-entry manifest:full-path="styles.xml" '
+    'manifest:media-type="text/xml"/>'
+    '%%s'
+    '</manifest:manifest>' % (NAMESPACES['manifest'], MIMETYPE)
+)
+
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<office:document-styles %s office:version="1.2">'
+    '<office:styles/></office:document-styles>' % XMLNS
+)
+
+PLACEHOLDER_IMAGE = 'Pictures/placeholder.png'
+
+
+def get_png(width=1, height=1):
+    """return a blank grayscale PNG image"""
+    def chunk(kind, data):
+        return (
+            struct.pack('>I', len(data)) + kind + data +
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+        )
+
+    rows = b''.join(b'\x00' + b'\xff' * width for i in range(height))
+    return (
+        b'\x89PNG\r\n\x1a\n' +
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) +
+        chunk(b'IDAT', zlib.compress(rows)) +
+        chunk(b'IEND', b'')
+    )
+
+
+def get_link(instruction):
+    """return the py3o:// link of an instruction"""
+    return (
+        '<text:a xlink:type="simple" xlink:href="py3o://%s">%s</text:a>' % (
+            urllib.parse.quote(instruction),
+            instruction.replace('"', '&quot;'),
+        )
+    )
+
+
+def get_field(name):
+    return (
+        '<text:user-field-get text:name="py3o.%s">%s</text:user-field-get>' % (
+            name, name
+        )
+    )
+
+
+def get_field_decl(name, value_type):
+    return (
+        '<text:user-field-decl office:value-type="%s" %s="" '
+        'text:name="py3o.%s"/>' % (
+            value_type, VALUE_ATTRIBUTES[value_type], name
+        )
+    )
+
+
+def get_cell(content, value_type='string'):
+    if value_type == 'string':
+        value = ''
+    else:
+        value = ' %s="0"' % VALUE_ATTRIBUTES[value_type]
+
+    return (
+        '<table:table-cell office:value-type="%s"%s>'
+        '<text:p>%s</text:p></table:table-cell>' % (
+            value_type, value, content
+        )
+    )
+
+
+class Row(object):
+    """a row of the data of a synthetic template, its attributes are the
+    fields and the nested rows displayed by the template
+    """
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class SyntheticTemplate(object):
+    """A text template built from a few size parameters.
+
+    Each loop displays, in its innermost level, the given number of user
+    fields of each value type. The loops iterate on data named loop0,
+    loop1... and nested loops on the children attribute of their parent
+    row. Fields outside of any loop are read from an object named document.
+    """
+
+    def __init__(
+            self, paragraph_loops=1, table_loops=0, depth=1, fields=1,
+            value_types=('string',), images=0, document_fields=0,
+            static_paragraphs=0
+    ):
+        """
+        @param paragraph_loops: the number of loops repeating paragraphs
+        @type paragraph_loops: int
+
+        @param table_loops: the number of loops repeating table rows
+        @type table_loops: int
+
+        @param depth: the number of nested loops of each loop
+        @type depth: int
+
+        @param fields: the number of user fields of each value type in the
+        innermost level of each loop
+        @type fields: int
+
+        @param value_types: the office:value-type of the user fields, the
+        ones py3o only renders in table cells are left out of paragraph loops
+        @type value_types: list of strings
+
+        @param images: the number of py3o image frames
+        @type images: int
+
+        @param document_fields: the number of user fields of each value type
+        outside of the loops
+        @type document_fields: int
+
+        @param static_paragraphs: the number of plain text paragraphs
+        following the loops, for templates mostly made of static content
+        @type static_paragraphs: int
+        """
+        unknown = set(value_types) - set(VALUE_ATTRIBUTES)
+        if unknown:
+            raise ValueError("Unknown value types %s" % sorted(unknown))
+
+        self.paragraph_loops = paragraph_loops
+        self.table_loops = table_loops
+        self.depth = depth
+        self.fields = fields
+        self.value_types = list(value_types)
+        self.images = images
+        self.document_fields = document_fields
+        self.static_paragraphs = static_paragraphs
+
+    @property
+    def loops(self):
+        return self.paragraph_loops + self.table_loops
+
+    def get_field_names(self, in_table=True):
+        """return the names and value types of the fields of a row"""
+        return [
+            ('%s%s' % (value_type, i), value_type)
+            for value_type in self.value_types
+            if in_table or value_type not in CELL_VALUE_TYPES
+            for i in range(self.fields)
+        ]
+
+    def get_iterables(self, loop):
+        """return the loop variables and iterables of the levels of a loop"""
+        iterable = 'loop%s' % loop
+        levels = []
+        for level in range(self.depth):
+            variable = 'l%s_row%s' % (loop, level)
+            levels.append((variable, iterable))
+            iterable = '%s.children' % variable
+
+        return levels
+
+    def get_paragraph_loop(self, loop, decls):
+        body = []
+        levels = self.get_iterables(loop)
+        for variable, iterable in levels:
+            body.append('<text:p>%s</text:p>' % get_link(
+                'for="%s in %s"' % (variable, iterable)
+            ))
+
+        row = levels[-1][0]
+        for name, value_type in self.get_field_names(in_table=False):
+            name = '%s.%s' % (row, name)
+            decls.append(get_field_decl(name, value_type))
+            body.append('<text:p>%s</text:p>' % get_field(name))
+
+        for level in levels:
+            body.append('<text:p>%s</text:p>' % get_link('/for'))
+
+        return ''.join(body)
+
+    def get_table_loop(self, loop, decls):
+        names = self.get_field_names()
+        columns = max(len(names), 1)
+
+        def get_link_row(instruction):
+            return (
+                '<table:table-row>%s%s</table:table-row>' % (
+                    get_cell(get_link(instruction)),
+                    get_cell('') * (columns - 1),
+                )
+            )
+
+        body = [
+            '<table:table table:name="Table%s">'
+            '<table:table-column table:number-columns-repeated="%s"/>' % (
+                loop, columns
+            )
+        ]
+        levels = self.get_iterables(loop)
+        for variable, iterable in levels:
+            body.append(get_link_row('for="%s in %s"' % (variable, iterable)))
+
+        row = levels[-1][0]
+        cells = []
+        for name, value_type in names:
+            name = '%s.%s' % (row, name)
+            decls.append(get_field_decl(name, value_type))
+            cells.append(get_cell(get_field(name), value_type))
+
+        body.append('<table:table-row>%s</table:table-row>' % (
+            ''.join(cells) or get_cell('')
+        ))
+
+        for level in levels:
+            body.append(get_link_row('/for'))
+
+        body.append('</table:table>')
+        return ''.join(body)
+
+    def get_content(self):
+        """return the content.xml of the template"""
+        decls = []
+        body = []
+
+        for k in range(self.images):
+            body.append(
+                '<text:p><draw:frame draw:name="py3o.image%s" '
+                'svg:width="1cm" svg:height="1cm"><draw:image '
+                'xlink:href="%s" xlink:type="simple"/>'
+                '</draw:frame></text:p>' % (k, PLACEHOLDER_IMAGE)
+            )
+
+        for value_type in self.value_types:
+            if value_type in CELL_VALUE_TYPES:
+                continue
+
+            for i in range(self.document_fields):
+                name = 'document.%s%s' % (value_type, i)
+                decls.append(get_field_decl(name, value_type))
+                body.append('<text:p>%s</text:p>' % get_field(name))
+
+        if self.depth:
+            for loop in range(self.paragraph_loops):
+                body.append(self.get_paragraph_loop(loop, decls))
+
+            for loop in range(self.paragraph_loops, self.loops):
+                body.append(self.get_table_loop(loop, decls))
+
+        for k in range(self.static_paragraphs):
+            body.append(
+                '<text:p text:style-name="Standard">static paragraph %s '
+                '<text:span text:style-name="T1">with a span</text:span>'
+                '</text:p>' % k
+            )
+
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-content %s office:version="1.2">'
+            '<office:body><office:text>'
+            '<text:user-field-decls>%s</text:user-field-decls>'
+            '%s'
+            '</office:text></office:body></office:document-content>' % (
+                XMLNS, ''.join(decls), ''.join(body)
+            )
+        )
+
+    def get_manifest(self):
+        if not self.images:
+            return MANIFEST % ''
+
+        return MANIFEST % (
+            '<manifest:file-entry manifest:full-path="%s" '
+            'manifest:media-type="image/png"/>' % PLACEHOLDER_IMAGE
+        )
+
+    def write(self, outfile):
+        """write the template as an ODT document
+
+        @param outfile: where to write the template
+        @type outfile: a string representing the full filename or a writable
+        binary file-like object
+        """
+        with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED) as archive:
+            # the mimetype must come first and be stored
+            archive.writestr(zipfile.ZipInfo('mimetype'), MIMETYPE)
+            archive.writestr('META-INF/manifest.xml', self.get_manifest())
+            archive.writestr('content.xml', self.get_content())
+            archive.writestr('styles.xml', STYLES)
+            if self.images:
+                archive.writestr(PLACEHOLDER_IMAGE, get_png())
+
+    def get_bytes(self):
+        """return the content of the template as an ODT document"""
+        out = BytesIO()
+        self.write(out)
+        return out.getvalue()
+
+    def get_row(self, index=0, in_table=True):
+        """return the row of the innermost level of a loop at the given
+        index, the value of its fields depends on the index and on their
+        position"""
+        return Row(**dict(
+            ('%s%s' % (value_type, i), VALUE_FUNCS[value_type](index + i))
+            for value_type in self.value_types
+            if in_table or value_type not in CELL_VALUE_TYPES
+            for i in range(self.fields)
+        ))
+
+    def get_rows(self, rows, fanout=2, in_table=True):
+        """return the rows of a loop: rows in its outermost level and fanout
+        per parent row in each nested level
+        """
+        def get_level(count, level):
+            if level == self.depth - 1:
+                return [self.get_row(i, in_table) for i in range(count)]
+
+            return [
+                Row(children=get_level(fanout, level + 1))
+                for i in range(count)
+            ]
+
+        return get_level(rows, 0)
+
+    def get_data(self, rows, fanout=2):
+        """return data rendering the template with rows in the outermost
+        level of each loop and fanout rows per parent row in nested levels
+        """
+        data = dict(
+            document=Row(**dict(
+                ('%s%s' % (value_type, i), VALUE_FUNCS[value_type](i))
+                for value_type in self.value_types
+                for i in range(self.document_fields)
+            ))
+        )
+        for loop in range(self.loops if self.depth else 0):
+            data['loop%s' % loop] = self.get_rows(
+                rows, fanout, in_table=loop >= self.paragraph_loops
+            )
+
+        return data
+
+    def get_images(self, width=16, height=16):
+        """return the content of the images of the template, keyed by their
+        identifier"""
+        return dict(
+            ('image%s' % k, get_png(width, height))
+            for k in range(self.images)
+        )
+
+    def get_row_count(self, rows, fanout=2):
+        """return the number of rows of the innermost level of each loop"""
+        return rows * fanout ** max(self.depth - 1, 0)
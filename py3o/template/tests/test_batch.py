@@ -0,0 +1,257 @@
+# -*- encoding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from io import BytesIO
+
+import lxml.etree
+import pkg_resources
+
+from py3o.template.batch import render_many, render_merged, \
+    PAGE_BREAK_STYLE
+from py3o.template.main import Template
+
+
+NAMESPACES = {
+    'text': 'urn:oasis:names:tc:opendocument:xmlns:text:1.0',
+    'style': 'urn:oasis:names:tc:opendocument:xmlns:style:1.0',
+}
+
+
+def get_content(content):
+    outodt = zipfile.ZipFile(BytesIO(content), 'r')
+    return lxml.etree.parse(BytesIO(outodt.read('content.xml')))
+
+
+def get_invoice_refs(content):
+    return [
+        p.text for p in get_content(content).xpath(
+            "//text:p[contains(text(), 'Invoice')]", namespaces=NAMESPACES
+        )
+    ]
+
+
+def get_invoice_ref(content):
+    return get_invoice_refs(content)[0]
+
+
+class WorkerExit(object):
+    """a record killing the worker process that unpickles it"""
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+class TestRenderMany(unittest.TestCase):
+
+    def setUp(self):
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_style1_template.odt'
+        )
+        self.compiled = Template(template_name).compile()
+        self.images = {'logo': b''}
+
+    def get_records(self, count, bad=()):
+        for i in range(count):
+            item = {
+                'val1': 1, 'val2': 2, 'val3': 3, 'Currency': 'EUR',
+                'Amount': 10.5, 'InvoiceRef': '#%s' % i,
+            }
+            if i in bad:
+                # the template will fail to find the reference
+                del item['InvoiceRef']
+
+            yield {'items': [item], 'document': {'total': i}}
+
+    def check_batch(self, ordered, **kw):
+        outputs = {}
+
+        def output_factory(index, record):
+            outputs[index] = BytesIO()
+            return outputs[index]
+
+        results = list(render_many(
+            self.compiled, self.get_records(8, bad=(3,)), output_factory,
+            ordered=ordered, images=self.images, **kw
+        ))
+
+        assert len(results) == 8
+        if ordered:
+            assert [r.index for r in results] == list(range(8))
+
+        for result in results:
+            if result.index == 3:
+                assert not result.ok
+                assert 'InvoiceRef' in result.error
+                continue
+
+            assert result.ok, result.error
+            assert result.output is outputs[result.index]
+            assert get_invoice_ref(result.output.getvalue()) == (
+                "Invoice #%s for a total of 10,5 EUR" % result.index
+            )
+
+    def test_serial(self):
+        self.check_batch(True, workers=0)
+
+    def test_pool_ordered(self):
+        self.check_batch(True, workers=2, max_in_flight=3)
+
+    def test_pool_as_completed(self):
+        self.check_batch(False, workers=2)
+
+    def test_unpicklable_record(self):
+        records = [
+            {'items': [], 'document': {'total': lambda: 0}},
+        ]
+        results = list(render_many(
+            self.compiled, records, lambda i, r: BytesIO(), workers=1,
+            images=self.images,
+        ))
+        assert len(results) == 1
+        assert not results[0].ok
+
+    def test_serial_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            results = list(render_many(
+                self.compiled, self.get_records(3, bad=(1,)),
+                lambda index, record: os.path.join(
+                    directory, '%s.odt' % index
+                ),
+                workers=0, images=self.images,
+            ))
+            assert [r.ok for r in results] == [True, False, True]
+            # no partial document is left for the failed record
+            assert sorted(os.listdir(directory)) == ['0.odt', '2.odt']
+            with open(results[2].output, 'rb') as f:
+                assert get_invoice_ref(f.read()).startswith('Invoice #2')
+
+        finally:
+            shutil.rmtree(directory)
+
+    def test_worker_exit(self):
+        records = list(self.get_records(4))
+        records[2] = {'document': WorkerExit()}
+        results = list(render_many(
+            self.compiled, records, lambda i, r: BytesIO(), workers=2,
+            images=self.images,
+        ))
+        assert [r.index for r in results] == list(range(4))
+        assert [r.ok for r in results] == [True, True, False, True]
+        assert 'worker process' in results[2].error
+
+
+class TestRenderMerged(unittest.TestCase):
+
+    def setUp(self):
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_style1_template.odt'
+        )
+        self.compiled = Template(template_name).compile()
+
+    def get_records(self, count):
+        for i in range(count):
+            yield {
+                'items': [{
+                    'val1': 1, 'val2': 2, 'val3': 3, 'Currency': 'EUR',
+                    'Amount': 10.5, 'InvoiceRef': '#%s' % i,
+                }],
+                'document': {'total': i},
+            }
+
+    def test_page_breaks(self):
+        out = BytesIO()
+        render_merged(
+            self.compiled, self.get_records(5), out, images={'logo': b''}
+        )
+
+        assert get_invoice_refs(out.getvalue()) == [
+            "Invoice #%s for a total of 10,5 EUR" % i for i in range(5)
+        ]
+
+        content = get_content(out.getvalue())
+        breaks = content.xpath(
+            "//text:p[@text:style-name='%s']" % PAGE_BREAK_STYLE,
+            namespaces=NAMESPACES
+        )
+        assert len(breaks) == 4
+        styles = content.xpath(
+            "//style:style[@style:name='%s']" % PAGE_BREAK_STYLE,
+            namespaces=NAMESPACES
+        )
+        assert len(styles) == 1
+
+        # the declarations of the document are not repeated
+        decls = content.xpath("//text:user-field-decls", namespaces=NAMESPACES)
+        assert len(decls) == 1
+
+    def test_custom_separator(self):
+        out = BytesIO()
+        render_merged(
+            self.compiled, self.get_records(3), out, images={'logo': b''},
+            separator='<text:p>----</text:p>',
+        )
+        content = get_content(out.getvalue())
+        assert len(content.xpath(
+            "//text:p[text()='----']", namespaces=NAMESPACES
+        )) == 2
+        assert not content.xpath(
+            "//style:style[@style:name='%s']" % PAGE_BREAK_STYLE,
+            namespaces=NAMESPACES
+        )
+
+    def test_list_ids(self):
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_list_template.odt'
+        )
+        # a list outside of the loop keeps its id in a single document
+        source = zipfile.ZipFile(template_name)
+        template = BytesIO()
+        with zipfile.ZipFile(template, 'w') as archive:
+            for info in source.infolist():
+                content = source.read(info.filename)
+                if info.filename == 'content.xml':
+                    content = content.replace(
+                        b'</office:text>',
+                        b'<text:list xml:id="list42"><text:list-item>'
+                        b'<text:p>static</text:p></text:list-item>'
+                        b'</text:list></office:text>'
+                    )
+                archive.writestr(info, content)
+
+        records = [
+            {'items': [{'val': 'a'}, {'val': 'b'}]} for i in range(3)
+        ]
+        for deterministic_ids in (False, True):
+            compiled = Template(
+                template.getvalue(), deterministic_ids=deterministic_ids
+            ).compile()
+            out = BytesIO()
+            render_merged(compiled, records, out, images={'logo': b''})
+
+            # the ids are unique across the records or lxml refuses them
+            ids = get_content(out.getvalue()).xpath(
+                '//text:list/@xml:id', namespaces=NAMESPACES
+            )
+            assert len(ids) == 9
+            assert len(set(ids)) == 9
+
+    def test_static_template(self):
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_logo.odt'
+        )
+        # a content.xml without loops is rendered from static chunks
+        compiled = Template(template_name).compile()
+        out = BytesIO()
+        render_merged(compiled, [{}, {}, {}], out, images={'logo': b''})
+        assert len(get_content(out.getvalue()).xpath(
+            "//text:p[text()='Title']", namespaces=NAMESPACES
+        )) == 3
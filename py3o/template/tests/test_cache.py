@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pkg_resources
+
+from py3o.template import NumberFormatter
+from py3o.template.cache import TemplateCache
+from py3o.template.main import CompiledTemplate
+
+
+class TestTemplateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_example_template.odt'
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_key(self, cache, template_name):
+        with open(template_name, 'rb') as f:
+            return cache.get_key(f.read())
+
+    def test_hit(self):
+        cache = TemplateCache(self.directory)
+        key = self.get_key(cache, self.template_name)
+        assert cache.get(key) is None
+
+        compiled = cache.compile(self.template_name)
+        assert isinstance(compiled, CompiledTemplate)
+
+        cached = cache.get(key)
+        assert isinstance(cached, CompiledTemplate)
+        assert [f for f, t in cached.templates] == [
+            f for f, t in compiled.templates
+        ]
+
+    def test_options_are_part_of_the_key(self):
+        cache = TemplateCache(self.directory)
+        with open(self.template_name, 'rb') as f:
+            data = f.read()
+
+        assert cache.get_key(data) != cache.get_key(
+            data, ignore_undefined_variables=True
+        )
+        keys = set([
+            cache.get_key(data),
+            cache.get_key(data, deterministic_ids=True),
+            cache.get_key(data, huge_tree=True),
+            cache.get_key(data, formatter='en'),
+            cache.get_key(data, data_styles=True),
+        ])
+        assert len(keys) == 5
+        # the default formatter and a locale are keyed by their symbols
+        assert cache.get_key(data) == cache.get_key(
+            data, formatter=NumberFormatter()
+        )
+        assert cache.get_key(data, formatter='de_DE') == cache.get_key(
+            data, formatter='de'
+        )
+
+    def test_options_are_forwarded(self):
+        # a template whose fields have data styles
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_style1_template.odt'
+        )
+        TemplateCache(self.directory).compile(
+            template_name, deterministic_ids=True, formatter='en',
+            data_styles=True,
+        )
+        # loaded from the entry written by the first cache
+        cached = TemplateCache(self.directory).compile(
+            template_name, deterministic_ids=True, formatter='en',
+            data_styles=True,
+        )
+        assert cached.deterministic_ids
+        assert cached.formatter.decimal_point == '.'
+        assert cached.field_formats
+
+        compiled = TemplateCache(self.directory).compile(template_name)
+        assert not compiled.deterministic_ids
+        assert compiled.formatter.decimal_point == ','
+        assert not compiled.field_formats
+
+    def test_corrupt_entry(self):
+        cache = TemplateCache(self.directory)
+        key = self.get_key(cache, self.template_name)
+        with open(cache.get_path(key), 'wb') as f:
+            f.write(b'not a pickle')
+
+        assert cache.get(key) is None
+        assert not os.path.exists(cache.get_path(key))
+
+        compiled = cache.compile(self.template_name)
+        assert isinstance(compiled, CompiledTemplate)
+        assert cache.get(key) is not None
+
+    def test_lru_eviction(self):
+        cache = TemplateCache(self.directory, max_size=None)
+        other_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_list_template.odt'
+        )
+        cache.compile(self.template_name)
+        cache.compile(other_name)
+        key_one = self.get_key(cache, self.template_name)
+        key_two = self.get_key(cache, other_name)
+
+        # make the first entry the least recently used one
+        old = time.time() - 60
+        os.utime(cache.get_path(key_one), (old, old))
+
+        cache.max_size = os.path.getsize(cache.get_path(key_two))
+        cache.evict()
+
+        assert cache.get(key_one) is None
+        assert cache.get(key_two) is not None
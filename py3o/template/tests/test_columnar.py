@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+import unittest
+import zipfile
+
+from io import BytesIO
+
+from py3o.template import Template, ColumnarRows, RenderStats
+from py3o.template.columnar import get_rows
+from py3o.template.tests.generator import SyntheticTemplate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+class TestColumnarRows(unittest.TestCase):
+
+    def setUp(self):
+        self.synthetic = SyntheticTemplate(
+            paragraph_loops=0, table_loops=1, depth=1, fields=2,
+            value_types=['string', 'float', 'percentage'],
+        )
+        self.compiled = Template(self.synthetic.get_bytes()).compile()
+        self.rows = [vars(row) for row in self.synthetic.get_data(5)['loop0']]
+        self.columns = dict(
+            (name, [row[name] for row in self.rows]) for name in self.rows[0]
+        )
+
+    def render(self, rows, stats=None):
+        document = self.compiled.render_to_bytes({'loop0': rows}, stats=stats)
+        return zipfile.ZipFile(BytesIO(document)).read('content.xml')
+
+    def test_mapping(self):
+        expected = self.render(self.synthetic.get_data(5)['loop0'])
+        # batches smaller than the table and not dividing it
+        rows = ColumnarRows(self.columns, batch_size=2)
+        assert len(rows) == 5
+        assert self.render(rows) == expected
+
+        stats = RenderStats()
+        assert self.render(rows, stats=stats) == expected
+        assert stats.loop_iterations['l0_row0 in loop0'] == 5
+
+    def test_single_row(self):
+        rows = ColumnarRows({'name': ['a', 'b'], 'amount': [1.5, 2.5]})
+        values = []
+        for row in rows:
+            assert row.name == row['name']
+            values.append((row.name, row.amount))
+            kept = row
+
+        assert values == [('a', 1.5), ('b', 2.5)]
+        # the same row is given for every iteration
+        assert kept.name == 'b'
+
+    def test_unequal_columns(self):
+        self.assertRaises(
+            ValueError, ColumnarRows, {'name': ['a', 'b'], 'amount': [1.5]}
+        )
+
+    def test_other_iterables(self):
+        rows = [object()]
+        assert get_rows(rows) is rows
+        generator = iter(rows)
+        assert get_rows(generator) is generator
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_structured_array(self):
+        expected = self.render(self.synthetic.get_data(5)['loop0'])
+        names = sorted(self.columns)
+        array = numpy.array(
+            [tuple(row[name] for name in names) for row in self.rows],
+            dtype=[
+                (name, 'U20' if name.startswith('string') else 'f8')
+                for name in names
+            ],
+        )
+        assert isinstance(get_rows(array), ColumnarRows)
+        assert self.render(array) == expected
+
+    @unittest.skipIf(pandas is None, 'pandas is not installed')
+    def test_pandas_frame(self):
+        expected = self.render(self.synthetic.get_data(5)['loop0'])
+        frame = pandas.DataFrame(self.columns)
+        assert self.render(frame) == expected
@@ -0,0 +1,208 @@
+# -*- encoding: utf-8 -*-
+import datetime
+import decimal
+import pickle
+import unittest
+import zipfile
+
+from io import BytesIO
+
+import lxml.etree
+import pkg_resources
+
+from py3o.template import Template, NumberFormatter
+from py3o.template.datastyles import compile_data_style, get_data_styles
+
+STYLES = b"""<office:document-styles
+    xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+    xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0"
+    xmlns:number="urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0">
+  <office:styles>
+    <number:currency-style style:name="EUR" number:language="de"
+        number:country="DE">
+      <number:number number:decimal-places="2" number:min-integer-digits="1"
+          number:grouping="true"/>
+      <number:text> </number:text>
+      <number:currency-symbol>EUR</number:currency-symbol>
+    </number:currency-style>
+    <number:percentage-style style:name="PCT">
+      <number:number number:decimal-places="1" number:min-integer-digits="1"/>
+      <number:text>%</number:text>
+    </number:percentage-style>
+    <number:number-style style:name="THOUSANDS">
+      <number:number number:decimal-places="0" number:min-integer-digits="1"
+          number:display-factor="1000"/>
+      <number:text>k</number:text>
+    </number:number-style>
+    <number:number-style style:name="POSITIVE">
+      <number:number number:decimal-places="2" number:min-integer-digits="1"/>
+    </number:number-style>
+    <number:number-style style:name="ACCOUNTING">
+      <number:text>(</number:text>
+      <number:number number:decimal-places="2" number:min-integer-digits="1"/>
+      <number:text>)</number:text>
+      <style:map style:condition="value()&gt;=0"
+          style:apply-style-name="POSITIVE"/>
+    </number:number-style>
+    <number:number-style style:name="FRACTION">
+      <number:fraction number:min-numerator-digits="1"/>
+    </number:number-style>
+    <number:date-style style:name="DATE">
+      <number:day number:style="long"/>
+      <number:text>/</number:text>
+      <number:month number:style="long"/>
+      <number:text>/</number:text>
+      <number:year number:style="long"/>
+    </number:date-style>
+    <number:time-style style:name="TIME">
+      <number:hours/>
+      <number:text>:</number:text>
+      <number:minutes number:style="long"/>
+      <number:text> </number:text>
+      <number:am-pm/>
+    </number:time-style>
+  </office:styles>
+</office:document-styles>
+"""
+
+
+class TestDataStyles(unittest.TestCase):
+
+    def setUp(self):
+        self.styles = get_data_styles([
+            lxml.etree.ElementTree(lxml.etree.fromstring(STYLES))
+        ])
+
+    def compile(self, name):
+        return compile_data_style(name, self.styles, NumberFormatter())
+
+    def test_currency(self):
+        style = self.compile('EUR')
+        assert style(1234567.891) == u'1.234.567,89 EUR'
+        assert style(decimal.Decimal('-3.5')) == u'-3,50 EUR'
+        assert style(12) == u'12,00 EUR'
+        # values that are not numbers are left untouched
+        assert style('n/a') == 'n/a'
+        assert style(True) is True
+
+    def test_factors(self):
+        # the formatter of the template gives the decimal point of the styles
+        # that have no locale
+        assert self.compile('PCT')(0.1234) == u'12,3%'
+        assert self.compile('PCT')(decimal.Decimal('0.5')) == u'50,0%'
+        assert self.compile('THOUSANDS')(1234567) == u'1235k'
+
+    def test_conditions(self):
+        style = self.compile('ACCOUNTING')
+        assert style(1234.5) == u'1234,50'
+        assert style(-1234.5) == u'(1234,50)'
+
+    def test_dates(self):
+        value = datetime.datetime(2016, 3, 7, 14, 5)
+        assert self.compile('DATE')(value) == u'07/03/2016'
+        assert self.compile('DATE')(value.date()) == u'07/03/2016'
+        assert self.compile('TIME')(value) == u'2:05 PM'
+        assert self.compile('DATE')('2016-03-07') == '2016-03-07'
+
+    def test_unsupported(self):
+        assert self.compile('FRACTION') is None
+        assert self.compile('MISSING') is None
+
+    def test_pickle(self):
+        style = pickle.loads(pickle.dumps(self.compile('ACCOUNTING')))
+        assert style(-2) == u'(2,00)'
+        style = pickle.loads(pickle.dumps(self.compile('DATE')))
+        assert style(datetime.date(2016, 3, 7)) == u'07/03/2016'
+
+    def get_template(self, styles=None):
+        """return the style1 template, with another styles.xml or without
+        styles.xml if styles is False"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_style1_template.odt'
+        )
+        if styles is None:
+            return template_name
+
+        source = zipfile.ZipFile(template_name)
+        template = BytesIO()
+        with zipfile.ZipFile(template, 'w') as archive:
+            for info in source.infolist():
+                if info.filename == 'styles.xml':
+                    if styles is False:
+                        continue
+
+                    archive.writestr(info, styles(source.read(info)))
+                else:
+                    archive.writestr(info, source.read(info))
+
+        return template.getvalue()
+
+    def get_invoice(self, compiled, amount):
+        class Item(object):
+            pass
+
+        item = Item()
+        item.val1 = item.val2 = item.val3 = 'value'
+        item.Currency = 'EUR'
+        item.InvoiceRef = '#1234'
+        item.Amount = amount
+        document = Item()
+        document.total = '9999999999999.999'
+
+        output = compiled.render_to_bytes(
+            dict(items=[item], document=document),
+            images={'logo': b'logo'},
+        )
+        content = lxml.etree.fromstring(
+            zipfile.ZipFile(BytesIO(output)).read('content.xml')
+        )
+        return [
+            text for text in (
+                u''.join(p.itertext()) for p in content.iter(
+                    '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}p'
+                )
+            ) if text.startswith('Invoice')
+        ]
+
+    def test_render(self):
+        # the French style of the field groups the thousands and writes
+        # negative numbers with the minus sign of its text
+        compiled = Template(self.get_template(), data_styles=True).compile()
+        assert self.get_invoice(compiled, 12345.35) == [
+            u'Invoice #1234 for a total of 12\u202f345,35 EUR'
+        ]
+        assert self.get_invoice(compiled, -5) == [
+            u'Invoice #1234 for a total of -5,00 EUR'
+        ]
+
+        compiled = Template(self.get_template()).compile()
+        assert compiled.field_formats == []
+        assert self.get_invoice(compiled, 12345.35) == [
+            u'Invoice #1234 for a total of 12345,35 EUR'
+        ]
+
+    def test_without_styles_file(self):
+        compiled = Template(
+            self.get_template(styles=False), data_styles=True
+        ).compile()
+        assert self.get_invoice(compiled, 12345.35) == [
+            u'Invoice #1234 for a total of 12\u202f345,35 EUR'
+        ]
+
+    def test_automatic_styles_first(self):
+        # a common style named as the automatic style of the field
+        def add_style(styles):
+            return styles.replace(
+                b'</office:styles>',
+                b'<number:number-style style:name="N60106">'
+                b'<number:number number:decimal-places="0"/>'
+                b'</number:number-style></office:styles>'
+            )
+
+        compiled = Template(
+            self.get_template(styles=add_style), data_styles=True
+        ).compile()
+        assert self.get_invoice(compiled, 12345.35) == [
+            u'Invoice #1234 for a total of 12\u202f345,35 EUR'
+        ]
@@ -8,6 +8,7 @@ from py3o.template.decoder import Decoder, ForList
 import pkg_resources
 from py3o.template import Template
 from pyjon.utils import get_secure_filename
+from py3o.template.tests.generator import SyntheticTemplate
 
 
 class TestDecoder(unittest.TestCase):
@@ -171,21 +172,57 @@ class TestDecoder(unittest.TestCase):
         expected = {'global_var': {'my7list': [{'val': 'val1'}, {'val': 'val2'}]}}
         assert res == expected
 
-#    def test_jsonify_access_variable_in_nested_loop(self):
-#        """ Test the jsonify function
-#        """
-#        template_xml = pkg_resources.resource_filename(
-#            'py3o.template',
-#            'tests/templates/py3o_access_variable_in_nested_loop.odt'
-#        )
-#        t = Template(template_xml, get_secure_filename())
-#        for_lists, variables = t.get_user_instructions_mapping()
-#        data = {
-#            'my8list': [['val1', 'val2'], ['val3']]
-#        }
-#        res = ForList.to_dict(for_lists, variables, data)
-#        expected = {'my8list': [['val1', 'val2'], ['val3']]}
-#        assert res == expected
+    def test_jsonify_access_variable_in_nested_loop(self):
+        """ Test the jsonify function
+        """
+        template_xml = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_access_variable_in_nested_loop.odt'
+        )
+        t = Template(template_xml, get_secure_filename())
+        for_lists, variables = t.get_user_instructions_mapping()
+        data = {
+            'my8list': [['val1', 'val2'], ['val3']]
+        }
+        res = ForList.to_dict(for_lists, variables, data)
+        expected = {'my8list': [['val1', 'val2'], ['val3']]}
+        assert res == expected
+
+    def test_extraction_plan_paths(self):
+        """ Test the attributes each loop of an extraction plan reads
+        """
+        synthetic = SyntheticTemplate(paragraph_loops=1, depth=2, fields=2)
+        plan = Template(synthetic.get_bytes()).get_extraction_plan()
+        paths = [(loop.name, paths) for loop, paths in plan.get_paths()]
+        assert paths == [
+            ('loop0', ['children', 'children.string0', 'children.string1']),
+            ('l0_row0.children', ['string0', 'string1']),
+        ]
+
+    def test_extraction_plan_prefetch(self):
+        """ Test the prefetch hook of an extraction plan
+        """
+        synthetic = SyntheticTemplate(paragraph_loops=1, depth=2, fields=1)
+        template = Template(synthetic.get_bytes())
+        plan = template.get_extraction_plan()
+        data = synthetic.get_data(2, fanout=3)
+        prefetched = []
+
+        def prefetch(loop, rows):
+            rows = list(rows)
+            prefetched.append((loop.name, len(rows)))
+            return rows
+
+        res = plan.extract(data, prefetch=prefetch)
+        assert prefetched == [
+            ('loop0', 2),
+            ('l0_row0.children', 3),
+            ('l0_row0.children', 3),
+        ]
+        assert res['loop0'][1]['children'][2] == {'string0': 'value 2'}
+
+        for_lists, variables = template.get_user_instructions_mapping()
+        assert res == ForList.to_dict(for_lists, variables, data)
 
 #    def test_jsonify_access_parent_variable_in_nested_loop(self):
 #        """ Test the jsonify function
@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+import decimal
+import pickle
+import unittest
+import zipfile
+
+from io import BytesIO
+
+import lxml.etree
+
+from py3o.template import Template, NumberFormatter
+from py3o.template.formatting import get_formatter
+from py3o.template.tests.generator import SyntheticTemplate, NAMESPACES
+
+
+class TestNumberFormatter(unittest.TestCase):
+
+    def test_default(self):
+        formatter = NumberFormatter()
+        assert formatter.format_float(12345.35) == '12345,35'
+        assert formatter.format_float(decimal.Decimal('-2.50')) == '-2,50'
+        assert formatter.format_float(1e20) == '1e+20'
+        # other values are left untouched
+        assert formatter.format_float(12) == 12
+        assert formatter.format_float('1.5') == '1.5'
+        assert formatter.format_percentage(0.25) == '0,25 %'
+
+    def test_grouping(self):
+        formatter = NumberFormatter('.', ',', u'%s%%')
+        assert formatter.format_float(1234567.5) == '1,234,567.5'
+        assert formatter.format_float(-1234.5) == '-1,234.5'
+        assert formatter.format_float(123.5) == '123.5'
+        assert formatter.format_float(1.5e+22) == '1.5e+22'
+        assert formatter.format_percentage(1234.5) == '1,234.50%'
+
+    def test_locales(self):
+        assert get_formatter('de_CH').format_float(1234.5) == u'1’234.5'
+        # the formatter of the language
+        formatter = get_formatter('de_AT.UTF-8')
+        assert formatter.format_float(1234.5) == '1.234,5'
+        assert get_formatter('de_AT.UTF-8') is formatter
+        self.assertRaises(ValueError, get_formatter, 'xx_XX')
+
+    def test_localeconv(self):
+        # the C locale of the tests
+        formatter = NumberFormatter.from_localeconv()
+        assert formatter.format_float(1234.5) == '1234.5'
+
+        formatter = NumberFormatter.from_localeconv({
+            'decimal_point': ',', 'thousands_sep': '.', 'grouping': [3, 0],
+        })
+        assert formatter.format_float(1234567.5) == '1.234.567,5'
+        assert formatter.format_percentage(0.25) == '0,25 %'
+
+        formatter = NumberFormatter.from_localeconv({
+            'decimal_point': ',', 'thousands_sep': '.', 'grouping': [],
+        })
+        assert formatter.format_float(1234567.5) == '1234567,5'
+
+    def test_render(self):
+        synthetic = SyntheticTemplate(
+            paragraph_loops=0, table_loops=1, depth=1,
+            value_types=['float', 'percentage'],
+        )
+        compiled = Template(synthetic.get_bytes(), formatter='en').compile()
+
+        def get_cells():
+            document = compiled.render_to_bytes(synthetic.get_data(1))
+            content = lxml.etree.fromstring(
+                zipfile.ZipFile(BytesIO(document)).read('content.xml')
+            )
+            return content.xpath(
+                '//table:table-cell/text:p/text()', namespaces=NAMESPACES
+            )
+
+        assert get_cells() == ['1,234.5', '0.25%']
+
+        compiled.formatter = NumberFormatter()
+        assert get_cells() == ['1234,5', '0,25 %']
+
+    def test_pickle(self):
+        formatter = pickle.loads(pickle.dumps(get_formatter('de')))
+        assert formatter.format_float(1234.5) == '1.234,5'
+        assert formatter.format_percentage(0.25) == u'0,25\u00a0%'
@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+import unittest
+import zipfile
+
+from io import BytesIO
+
+import lxml.etree
+
+from py3o.template import Template
+from py3o.template.tests.generator import SyntheticTemplate, VALUE_TYPES, \
+    NAMESPACES
+
+
+class TestSyntheticTemplate(unittest.TestCase):
+
+    def render(self, synthetic, rows=3, fanout=2):
+        compiled = Template(synthetic.get_bytes()).compile()
+        output = zipfile.ZipFile(BytesIO(compiled.render_to_bytes(
+            synthetic.get_data(rows, fanout), images=synthetic.get_images()
+        )))
+        return output, lxml.etree.fromstring(output.read('content.xml'))
+
+    def test_paragraph_loops(self):
+        synthetic = SyntheticTemplate(paragraph_loops=2, depth=2, fields=3)
+        output, content = self.render(synthetic, rows=4)
+
+        values = content.xpath('//text:p/text()', namespaces=NAMESPACES)
+        # 2 loops of 4 rows of 2 rows of 3 fields
+        assert len(values) == 2 * 4 * 2 * 3
+        assert values[:3] == ['value 0', 'value 1', 'value 2']
+        assert synthetic.get_row_count(4) == 8
+
+    def test_table_loops(self):
+        value_types = [value_type for value_type, attr, func in VALUE_TYPES]
+        synthetic = SyntheticTemplate(
+            paragraph_loops=0, table_loops=1, depth=1,
+            value_types=value_types,
+        )
+        output, content = self.render(synthetic, rows=5)
+
+        rows = content.xpath('//table:table-row', namespaces=NAMESPACES)
+        assert len(rows) == 5
+
+        cells = rows[0].xpath('table:table-cell', namespaces=NAMESPACES)
+        assert len(cells) == len(value_types)
+
+        float_cell = cells[value_types.index('float')]
+        assert float_cell.get('{%s}value' % NAMESPACES['office']) == '1234.5'
+        assert float_cell[0].text == '1234,5'
+
+        # py3o renders percentages as strings
+        percentage_cell = cells[value_types.index('percentage')]
+        assert percentage_cell.get(
+            '{%s}value-type' % NAMESPACES['office']
+        ) == 'string'
+        assert percentage_cell[0].text == '0,25 %'
+
+    def test_images_and_document_fields(self):
+        synthetic = SyntheticTemplate(
+            paragraph_loops=0, depth=0, images=3, document_fields=2,
+        )
+        output, content = self.render(synthetic)
+
+        names = output.namelist()
+        for k in range(3):
+            assert 'Pictures/py3o-image%s' % k in names
+
+        manifest = output.read('META-INF/manifest.xml').decode('utf-8')
+        assert 'Pictures/py3o-image2' in manifest
+
+        values = content.xpath('//text:p/text()', namespaces=NAMESPACES)
+        assert values == ['value 0', 'value 1']
+
+    def test_unknown_value_type(self):
+        self.assertRaises(
+            ValueError, SyntheticTemplate, value_types=['string', 'money']
+        )
@@ -8,10 +8,13 @@ import lxml.etree
 import pkg_resources
 import six
 
+from genshi.input import XMLParser
+
 from pyjon.utils import get_secure_filename
 
 from py3o.template.main import move_siblings, detect_keep_boundary, Template, \
-    get_soft_breaks
+    get_soft_breaks, get_instructions, get_user_fields, scan_instructions, \
+    scan_markers, get_markup_stream
 from py3o.template.decoder import ForList
 
 if six.PY3:
@@ -423,6 +426,53 @@ class TestHelpers(unittest.TestCase):
         soft_breaks = get_soft_breaks(t.content_trees[0], t.namespaces)
         assert len(soft_breaks) == 0
 
+    def test_scan_instructions(self):
+        template_xml = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_soft_page_break.odt'
+        )
+        t = Template(template_xml, get_secure_filename())
+        for content_tree in t.content_trees:
+            soft_breaks, links = scan_instructions(content_tree, t.namespaces)
+            assert soft_breaks == get_soft_breaks(content_tree, t.namespaces)
+            assert links == get_instructions(content_tree, t.namespaces)
+
+        assert len(scan_instructions(t.content_trees[0], t.namespaces)[0]) > 0
+
+    def test_scan_markers(self):
+        t = self.reference_template
+        for content_tree in t.content_trees:
+            markers = scan_markers(content_tree, t.namespaces)
+            assert markers.user_field_decls == get_user_fields(
+                content_tree, t.namespaces
+            )
+            assert markers.user_fields == content_tree.xpath(
+                "//text:user-field-get[starts-with(@text:name, 'py3o.')]",
+                namespaces=t.namespaces
+            )
+            assert markers.image_frames == content_tree.xpath(
+                "//draw:frame[starts-with(@draw:name, 'py3o.')]",
+                namespaces=t.namespaces
+            )
+
+        assert scan_markers(t.content_trees[0], t.namespaces).user_fields
+
+    def test_markup_stream(self):
+        t = self.reference_template
+        t.compile()
+        for content_tree in t.content_trees:
+            # the events the Genshi templates were built from are those of
+            # the serialized trees, the positions aside
+            stream = get_markup_stream(content_tree)
+            parsed = XMLParser(
+                six.BytesIO(lxml.etree.tostring(content_tree.getroot()))
+            )
+            assert [
+                (kind, data) for kind, data, pos in stream
+            ] == [
+                (kind, data) for kind, data, pos in parsed
+            ]
+
     # def test_nested_list(self):
     #    template_xml = pkg_resources.resource_filename(
     #        'py3o.template',
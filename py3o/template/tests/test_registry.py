@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pkg_resources
+
+from py3o.template.registry import TemplateRegistry
+
+
+class TestTemplateRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template_names = []
+        for name in ('py3o_example_template.odt', 'py3o_list_template.odt',
+                     'py3o_logo.odt'):
+            path = os.path.join(self.directory, name)
+            shutil.copy(
+                pkg_resources.resource_filename(
+                    'py3o.template', 'tests/templates/%s' % name
+                ),
+                path
+            )
+            self.template_names.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit_and_miss(self):
+        registry = TemplateRegistry()
+        compiled = registry.get(self.template_names[0])
+        assert registry.get(self.template_names[0]) is compiled
+
+        stats = registry.get_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['entries'] == 1
+        assert stats['bytes'] > 0
+
+    def test_options(self):
+        registry = TemplateRegistry()
+        compiled = registry.get(self.template_names[0])
+        localized = registry.get(
+            self.template_names[0], formatter='en', deterministic_ids=True
+        )
+        assert localized is not compiled
+        assert localized.formatter.decimal_point == '.'
+        assert localized.deterministic_ids
+        assert compiled.formatter.decimal_point == ','
+        assert registry.get(
+            self.template_names[0], formatter='en', deterministic_ids=True
+        ) is localized
+        assert registry.get_stats()['entries'] == 2
+
+    def test_lru_eviction(self):
+        registry = TemplateRegistry(max_entries=2)
+        first = registry.get(self.template_names[0])
+        registry.get(self.template_names[1])
+        # the first template becomes the most recently used one
+        registry.get(self.template_names[0])
+        registry.get(self.template_names[2])
+
+        assert registry.get_stats()['evictions'] == 1
+        assert registry.get(self.template_names[0]) is first
+        assert registry.get_stats()['misses'] == 3
+
+        registry.get(self.template_names[1])
+        assert registry.get_stats()['misses'] == 4
+
+    def test_byte_budget(self):
+        registry = TemplateRegistry(max_entries=None, max_bytes=1)
+        registry.get(self.template_names[0])
+        registry.get(self.template_names[1])
+
+        stats = registry.get_stats()
+        assert stats['entries'] == 1
+        assert stats['evictions'] == 1
+
+    def test_invalidation(self):
+        registry = TemplateRegistry()
+        path = self.template_names[0]
+        compiled = registry.get(path)
+
+        # touching the file does not invalidate the entry
+        future = time.time() + 60
+        os.utime(path, (future, future))
+        assert registry.get(path) is compiled
+
+        # changing its content does
+        shutil.copy(self.template_names[1], path)
+        assert registry.get(path) is not compiled
+        assert registry.get_stats()['invalidations'] == 1
@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+import copy
+import pickle
+import unittest
+import zipfile
+
+from io import BytesIO
+
+import pkg_resources
+from genshi.core import Markup
+
+from py3o.template import Template, RenderStats
+from py3o.template.static import StaticTemplate
+from py3o.template.tests.generator import SyntheticTemplate
+
+
+def get_entries(compiled, data, images=None):
+    document = compiled.render_to_bytes(data, images)
+    archive = zipfile.ZipFile(BytesIO(document))
+    return dict(
+        (name, archive.read(name)) for name, template in compiled.templates
+    )
+
+
+def without_static(compiled):
+    """return a copy of a compiled template rendering all its entries with
+    Genshi"""
+    other = copy.copy(compiled)
+    other.templates = [
+        (name, getattr(template, 'template', template))
+        for name, template in compiled.templates
+    ]
+    return other
+
+
+class TestStaticTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.synthetic = SyntheticTemplate(
+            paragraph_loops=0, table_loops=0, depth=0, document_fields=3,
+            images=1, static_paragraphs=2,
+        )
+        self.compiled = Template(self.synthetic.get_bytes()).compile()
+        self.images = self.synthetic.get_images()
+
+    def assert_same_output(self, data):
+        assert get_entries(self.compiled, data, self.images) == get_entries(
+            without_static(self.compiled), data, self.images
+        )
+
+    def test_compile(self):
+        templates = dict(self.compiled.templates)
+        assert isinstance(templates['content.xml'], StaticTemplate)
+        # the image and the three fields
+        assert len(templates['content.xml'].slots) == 4
+
+        # templates with loops are rendered by Genshi
+        compiled = Template(SyntheticTemplate().get_bytes()).compile()
+        assert not isinstance(
+            dict(compiled.templates)['content.xml'], StaticTemplate
+        )
+
+    def test_values(self):
+        data = self.synthetic.get_data(1)
+        self.assert_same_output(data)
+
+        document = data['document']
+        document.string0 = u'a < b & "c" é\n\n\n  d  \nend'
+        document.string1 = Markup(u'<text:span>markup</text:span>')
+        document.string2 = 12.5
+        self.assert_same_output(data)
+
+        document.string0 = [u'several', u' ', u'parts']
+        document.string1 = 0
+        document.string2 = True
+        self.assert_same_output(data)
+
+    def test_attributes(self):
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_logo.odt'
+        )
+        compiled = Template(template_name).compile()
+        assert isinstance(dict(compiled.templates)['content.xml'],
+                          StaticTemplate)
+        images = {'logo': b'logo'}
+        assert get_entries(compiled, {}, images) == get_entries(
+            without_static(compiled), {}, images
+        )
+
+    def test_pickle(self):
+        compiled = pickle.loads(pickle.dumps(self.compiled))
+        data = self.synthetic.get_data(1)
+        assert get_entries(compiled, data, self.images) == get_entries(
+            self.compiled, data, self.images
+        )
+
+    def test_stats(self):
+        stats = RenderStats()
+        data = self.synthetic.get_data(1)
+        self.compiled.render_to_bytes(data, self.images, stats=stats)
+        content = get_entries(self.compiled, data, self.images)['content.xml']
+        assert stats.entries['content.xml'][0] == len(content)
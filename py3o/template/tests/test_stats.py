@@ -0,0 +1,151 @@
+# -*- encoding: utf-8 -*-
+import pickle
+import time
+import unittest
+import zipfile
+
+from io import BytesIO
+
+from py3o.template import Template, RenderStats
+from py3o.template.tests.generator import SyntheticTemplate
+
+
+class TestRenderStats(unittest.TestCase):
+
+    def setUp(self):
+        self.synthetic = SyntheticTemplate(
+            paragraph_loops=1, table_loops=1, depth=2, fields=2, images=2,
+        )
+        self.data = self.synthetic.get_data(5, fanout=3)
+        self.images = self.synthetic.get_images()
+
+    def test_render_stats(self):
+        template = Template(self.synthetic.get_bytes())
+        template.images = self.images
+        stats = RenderStats()
+        document = template.render_to_bytes(self.data, stats=stats)
+
+        assert list(stats.timings) == [
+            'read', 'instructions', 'links', 'user_fields', 'image_links',
+            'list_ids',
+            'genshi_compile', 'static_entries',
+            'skeleton', 'generate', 'serialize', 'write', 'images',
+        ]
+        assert all(seconds >= 0 for seconds in stats.timings.values())
+        assert stats.renders == 1
+        assert stats.instructions == 4
+
+        assert stats.loop_iterations == {
+            'l0_row0 in loop0': 5,
+            'l0_row1 in l0_row0.children': 15,
+            'l1_row0 in loop1': 5,
+            'l1_row1 in l1_row0.children': 15,
+        }
+
+        output = zipfile.ZipFile(BytesIO(document))
+        for filename in template.templated_files:
+            info = output.getinfo(filename)
+            assert stats.entries[filename] == (
+                info.file_size, info.compress_size
+            )
+
+        assert stats.images == 2
+        assert stats.image_bytes == sum(
+            len(data) for data in self.images.values()
+        )
+
+        metrics = stats.get_metrics()
+        assert metrics['py3o.loop.l0_row0 in loop0'] == 5
+        assert metrics['py3o.image_bytes'] == stats.image_bytes
+        assert metrics['py3o.bytes.content.xml'] == (
+            stats.entries['content.xml'][0]
+        )
+        assert metrics['py3o.time.total'] == stats.total_time
+
+    def test_stats_add_up(self):
+        compiled = Template(self.synthetic.get_bytes()).compile()
+        stats = RenderStats()
+        documents = [
+            compiled.render_to_bytes(self.data, self.images, stats=stats)
+            for i in range(2)
+        ]
+
+        # the compilation happened before
+        assert 'read' not in stats.timings
+        assert stats.instructions == 0
+        assert stats.renders == 2
+        assert stats.loop_iterations['l1_row0 in loop1'] == 10
+        assert stats.images == 4
+
+        # the statistics do not change the output
+        document = compiled.render_to_bytes(self.data, self.images)
+        assert zipfile.ZipFile(BytesIO(document)).read('content.xml') == (
+            zipfile.ZipFile(BytesIO(documents[0])).read('content.xml')
+        )
+
+    def test_undefined_loop(self):
+        template = Template(
+            self.synthetic.get_bytes(), ignore_undefined_variables=True,
+        )
+        stats = RenderStats()
+        template.render_to_bytes({}, stats=stats)
+        assert stats.loop_iterations['l0_row0 in loop0'] == 0
+
+    def test_expression_profile(self):
+        synthetic = SyntheticTemplate(
+            paragraph_loops=1, table_loops=1, depth=1, fields=1,
+            value_types=['string', 'float'],
+        )
+        data = synthetic.get_data(4)
+
+        class SlowRows(list):
+            def __iter__(self):
+                for row in list.__iter__(self):
+                    time.sleep(0.01)
+                    yield row
+
+        data['loop1'] = SlowRows(data['loop1'])
+
+        template = Template(synthetic.get_bytes(), profile=True)
+        stats = RenderStats()
+        document = template.render_to_bytes(data, stats=stats)
+
+        expressions = dict(
+            (source, calls)
+            for (origin, source), (calls, seconds) in stats.expressions.items()
+        )
+        assert expressions['loop0'] == 1
+        assert expressions['l0_row0.string0'] == 4
+        assert expressions['format_float(l0_row0.float0)'] == 4
+        # the value of the float table cell
+        assert expressions['l1_row0.float0'] == 4
+
+        # the time spent getting the rows is reported with their loop
+        report = stats.get_expression_report(top=3).splitlines()
+        assert len(report) == 4
+        assert report[1].endswith('py3o://for="l1_row0 in loop1": loop1')
+
+        # profiling does not change the output
+        data['loop1'] = list(data['loop1'])
+        compiled = Template(synthetic.get_bytes()).compile()
+        assert compiled.expressions == []
+        assert zipfile.ZipFile(BytesIO(document)).read('content.xml') == (
+            zipfile.ZipFile(
+                BytesIO(compiled.render_to_bytes(data))
+            ).read('content.xml')
+        )
+
+    def test_pickle_profiled(self):
+        # render_many sends the compiled template to its workers pickled
+        synthetic = SyntheticTemplate(paragraph_loops=1, table_loops=1)
+        compiled = pickle.loads(pickle.dumps(
+            Template(synthetic.get_bytes(), profile=True).compile()
+        ))
+        stats = RenderStats()
+        compiled.render_to_bytes(synthetic.get_data(3), stats=stats)
+        calls = dict(
+            (source, calls)
+            for (origin, source), (calls, seconds) in stats.expressions.items()
+        )
+        assert calls['loop0'] == 1
+        assert calls['l0_row0.string0'] == 3
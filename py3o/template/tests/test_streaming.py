@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+import os
+import subprocess
+import sys
+import unittest
+
+import pkg_resources
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the number of rows rendered by the regression test, run it with
+# PY3O_STRESS_ROWS=1000000 to check a full size ledger
+STRESS_ROWS = int(os.environ.get('PY3O_STRESS_ROWS', 50000))
+
+# the maximum growth of the peak memory of the process during the rendering
+RSS_CEILING = 32 * 1024 * 1024
+
+# rendered in a separate process so that its peak memory is not the one of
+# the tests that ran before
+STRESS_SCRIPT = """
+import resource
+import sys
+
+from py3o.template import Template
+
+
+class Item(object):
+    def __init__(self, val):
+        self.val = val
+
+
+class Output(object):
+    # an unseekable output discarding what it is given
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def rows(count):
+    for i in range(count):
+        yield Item(i)
+
+
+compiled = Template(sys.argv[1]).compile()
+compiled.render({'items': rows(10)}, Output(), images={'logo': b''})
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+scale = 1 if sys.platform == 'darwin' else 1024
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+compiled.render(
+    {'items': rows(int(sys.argv[2]))}, Output(), images={'logo': b''}
+)
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+print(after - before)
+"""
+
+
+@unittest.skipIf(resource is None, "the resource module is not available")
+class TestStreaming(unittest.TestCase):
+
+    def test_generator_rows_bounded_memory(self):
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_list_template.odt'
+        )
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        output = subprocess.check_output(
+            [sys.executable, '-c', STRESS_SCRIPT, template_name,
+             str(STRESS_ROWS)],
+            env=env,
+        )
+        growth = int(output.decode('ascii').strip())
+        assert growth < RSS_CEILING, (
+            "rendering %s rows grew the memory by %s bytes" % (
+                STRESS_ROWS, growth
+            )
+        )
@@ -15,7 +15,10 @@ from io import BytesIO
 from genshi.template import TemplateError
 from pyjon.utils import get_secure_filename
 
-from py3o.template.main import Template, TemplateException, XML_NS
+from py3o.template.main import Template, TemplateException, XML_NS, \
+    CompressionPolicy, WRITE_BUFFER_SIZE, write_entry
+from py3o.template.tests.generator import SyntheticTemplate, XMLNS, \
+    get_field, get_field_decl
 
 
 class TestTemplate(unittest.TestCase):
@@ -138,6 +141,44 @@ class TestTemplate(unittest.TestCase):
         assert ids, "this list of ids should not be empty"
         assert len(ids) == len(set(ids)), "all ids should have been unique"
 
+    def test_deterministic_list_ids(self):
+        """lists repeated by loops can be numbered reproducibly"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_list_template.odt'
+        )
+
+        class Item(object):
+            def __init__(self, val):
+                self.val = val
+
+        data = {"items": [Item(1), Item(2), Item(3)]}
+        images = {'logo': b'logo'}
+
+        compiled = Template(template_name, deterministic_ids=True).compile()
+        contents = [
+            zipfile.ZipFile(
+                BytesIO(compiled.render_to_bytes(data, images))
+            ).read('content.xml')
+            for i in range(2)
+        ]
+        assert contents[0] == contents[1]
+
+        ids = lxml.etree.fromstring(contents[0]).xpath(
+            '//text:list/@xml:id', namespaces=compiled.namespaces
+        )
+        assert ids == ['list-1', 'list-2', 'list-3']
+
+        # by default each rendering has its own ids
+        compiled = Template(template_name).compile()
+        contents = [
+            zipfile.ZipFile(
+                BytesIO(compiled.render_to_bytes(data, images))
+            ).read('content.xml')
+            for i in range(2)
+        ]
+        assert contents[0] != contents[1]
+
     def test_missing_opening(self):
         """test orphaned /for raises a TemplateException"""
         template_name = pkg_resources.resource_filename(
@@ -392,3 +433,383 @@ class TestTemplate(unittest.TestCase):
             error = True
 
         assert error is True, "This template should have been refused"
+
+    def test_compiled_template_renders_many(self):
+        """a compiled template renders several data sets to separate
+        outputs"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_style1_template.odt'
+        )
+        logo = open(pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/images/new_logo.png'
+        ), 'rb').read()
+
+        compiled = Template(template_name).compile()
+
+        class Item(object):
+            pass
+
+        results = []
+        for ref in ('#1234', '#5678'):
+            item = Item()
+            item.val1 = 'Item1 Value1'
+            item.val2 = 'Item1 Value2'
+            item.val3 = 'Item1 Value3'
+            item.Currency = 'EUR'
+            item.Amount = 12345.35
+            item.InvoiceRef = ref
+
+            document = Item()
+            document.total = '9999999999999.999'
+
+            outname = get_secure_filename()
+            compiled.render(
+                dict(items=[item], document=document),
+                outname,
+                images={'logo': logo},
+            )
+
+            tempout = get_secure_filename()
+            t2 = Template(outname, tempout)
+            os.unlink(outname)
+
+            paragraphs = t2.content_trees[0].xpath(
+                "//text:p[contains(text(), 'Invoice')]",
+                namespaces=t2.namespaces
+            )
+            results.append(paragraphs[0].text)
+
+        assert results == [
+            "Invoice #1234 for a total of 12345,35 EUR",
+            "Invoice #5678 for a total of 12345,35 EUR",
+        ]
+
+    def test_spooled_output(self):
+        """spooling the templated entries does not change the output"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_list_template.odt'
+        )
+        logo = open(pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/images/new_logo.png'
+        ), 'rb').read()
+
+        class Item(object):
+            def __init__(self, val):
+                self.val = val
+
+        compiled = Template(template_name).compile()
+        contents = []
+        for spool_size in (None, 10):
+            outname = get_secure_filename()
+            compiled.render(
+                {"items": [Item(i) for i in range(100)]},
+                outname,
+                images={'logo': logo},
+                spool_size=spool_size,
+            )
+            outodt = zipfile.ZipFile(outname, 'r')
+            info = outodt.getinfo('content.xml')
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+            contents.append(
+                lxml.etree.parse(
+                    BytesIO(outodt.read('content.xml'))
+                ).xpath('count(//text:list)', namespaces=compiled.namespaces)
+            )
+            outodt.close()
+            os.unlink(outname)
+
+        assert contents[0] == contents[1] > 0
+
+    def test_render_to_file_like(self):
+        """documents can be rendered to bytes and unseekable streams"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_list_template.odt'
+        )
+        logo = open(pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/images/new_logo.png'
+        ), 'rb').read()
+
+        class Item(object):
+            def __init__(self, val):
+                self.val = val
+
+        class Pipe(object):
+            """a write only stream that can neither seek nor tell"""
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, data):
+                self.chunks.append(bytes(data))
+                return len(data)
+
+            def flush(self):
+                pass
+
+        data = {"items": [Item(1), Item(2)]}
+
+        template = Template(template_name)
+        template.set_image_data('logo', logo)
+        result = template.render_to_bytes(data)
+
+        compiled = Template(template_name).compile()
+        assert compiled.render_to_bytes(data, images={'logo': logo})
+
+        pipe = Pipe()
+        compiled.render(data, pipe, images={'logo': logo})
+
+        for content in (result, b''.join(pipe.chunks)):
+            outodt = zipfile.ZipFile(BytesIO(content), 'r')
+            assert outodt.namelist()[0] == 'mimetype'
+            assert outodt.testzip() is None
+            lxml.etree.parse(BytesIO(outodt.read('content.xml')))
+
+    def test_template_sources(self):
+        """templates can be read from bytes, memoryviews and file-like
+        objects"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_example_template.odt'
+        )
+        with open(template_name, 'rb') as f:
+            content = f.read()
+
+        for source in (
+            content,
+            bytearray(content),
+            memoryview(content),
+            memoryview(b'junk' + content)[4:],
+            BytesIO(content),
+        ):
+            with Template(source) as template:
+                assert 'document.total' in template.get_user_variables()
+
+            assert template.infile is None
+
+    def test_lazy_parsing(self):
+        """the entries are parsed when they are first needed"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_example_template.odt'
+        )
+        template = Template(template_name)
+        assert template._Template__trees == {}
+
+        # the introspection only reads the content of the document
+        assert 'document.total' in template.get_user_variables()
+        assert list(template._Template__trees) == ['content.xml']
+
+        template.compile()
+        assert sorted(template._Template__trees) == [
+            'content.xml', 'styles.xml'
+        ]
+
+    def test_huge_tree(self):
+        """huge text nodes are parsed with huge_tree"""
+        synthetic_odt = zipfile.ZipFile(BytesIO(
+            SyntheticTemplate().get_bytes()
+        ))
+        source = BytesIO()
+        with zipfile.ZipFile(source, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for info in synthetic_odt.infolist():
+                content = synthetic_odt.read(info.filename)
+                if info.filename == 'content.xml':
+                    # above the 10 MB text nodes libxml2 accepts by default
+                    content = content.replace(
+                        b'</office:text>',
+                        b'<text:p>' + b'x' * (11 * 1000 * 1000) +
+                        b'</text:p></office:text>'
+                    )
+                archive.writestr(info, content)
+
+        template = Template(source.getvalue())
+        self.assertRaises(
+            lxml.etree.XMLSyntaxError, template.get_user_variables
+        )
+
+        template = Template(source.getvalue(), huge_tree=True)
+        assert template.get_user_variables() == ['l0_row0.string0']
+
+    def test_compile_releases_source(self):
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_logo.odt'
+        )
+        template = Template(template_name)
+        template.compile()
+        assert template.infile is None
+
+        template.set_image_data('logo', b'')
+        assert template.render_to_bytes({})
+
+    def test_static_entries_copied_raw(self):
+        """static entries are copied with their compressed data and CRC"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_example_template.odt'
+        )
+        compiled = Template(template_name).compile()
+        result = compiled.render_to_bytes(
+            {'items': [], 'document': {'total': 0}},
+            images={'logo': b''},
+        )
+
+        source = zipfile.ZipFile(template_name, 'r')
+        outodt = zipfile.ZipFile(BytesIO(result), 'r')
+        assert outodt.testzip() is None
+        assert outodt.infolist()[0].filename == 'mimetype'
+        assert outodt.infolist()[0].compress_type == zipfile.ZIP_STORED
+
+        for info in source.infolist():
+            if info.filename in compiled.template_infos:
+                continue
+
+            out_info = outodt.getinfo(info.filename)
+            assert out_info.CRC == info.CRC
+            assert out_info.compress_type == info.compress_type
+            assert out_info.compress_size == info.compress_size
+            assert outodt.read(info.filename) == source.read(info.filename)
+
+    def test_compression_policy(self):
+        """xml entries are deflated at the chosen level, images stored"""
+        template_name = pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/py3o_list_template.odt'
+        )
+        logo = open(pkg_resources.resource_filename(
+            'py3o.template',
+            'tests/templates/images/new_logo.png'
+        ), 'rb').read()
+
+        class Item(object):
+            def __init__(self, val):
+                self.val = val
+
+        data = {"items": [Item(i) for i in range(500)]}
+        compiled = Template(template_name).compile()
+
+        results = [
+            zipfile.ZipFile(BytesIO(compiled.render_to_bytes(
+                data, images={'logo': logo}, compression=compression
+            )), 'r')
+            for compression in (
+                CompressionPolicy(compresslevel=1),
+                CompressionPolicy(compresslevel=9, threaded=True),
+            )
+        ]
+
+        for outodt in results:
+            assert outodt.testzip() is None
+            assert outodt.infolist()[0].filename == 'mimetype'
+            assert outodt.getinfo(
+                'content.xml'
+            ).compress_type == zipfile.ZIP_DEFLATED
+            assert outodt.getinfo(
+                'Pictures/py3o-logo'
+            ).compress_type == zipfile.ZIP_STORED
+
+        fast, small = [outodt.getinfo('content.xml') for outodt in results]
+        assert fast.file_size == small.file_size
+        assert fast.compress_size >= small.compress_size
+
+    def test_write_entry_error(self):
+        """a failing entry is closed and its error is the one raised"""
+        class Broken(object):
+            def write(self, block):
+                raise IOError('disk full')
+
+            def close(self):
+                pass
+
+        def failing_chunks():
+            # a whole block handed to the writer
+            yield b' ' * WRITE_BUFFER_SIZE
+            raise TemplateException('undefined')
+
+        for options in (
+            {}, {'spool_size': 10}, {'threaded': True},
+            {'spool_size': 10, 'threaded': True},
+        ):
+            output = BytesIO()
+            out = zipfile.ZipFile(output, 'w')
+            with self.assertRaises(TemplateException):
+                for status in write_entry(
+                    out, zipfile.ZipInfo('content.xml'), failing_chunks(),
+                    **options
+                ):
+                    pass
+
+            # no writing handle is left open on the archive
+            out.writestr('other.xml', b'<b/>')
+            out.close()
+            assert zipfile.ZipFile(output).read('other.xml') == b'<b/>'
+
+        # the error of the chunks is not hidden by the one of the worker
+        # thread of the writer
+        out = zipfile.ZipFile(BytesIO(), 'w')
+        original_open = out.open
+        out.open = lambda *args: Broken()
+        with self.assertRaises(TemplateException):
+            for status in write_entry(
+                out, zipfile.ZipInfo('content.xml'), failing_chunks(),
+                threaded=True
+            ):
+                pass
+
+        out.open = original_open
+        out.close()
+
+    def test_templated_entries(self):
+        """only the entries holding py3o markers are templated"""
+        synthetic = SyntheticTemplate(images=1)
+        embedded = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-content %s office:version="1.2">'
+            '<office:body><office:text>'
+            '<text:user-field-decls>%%s</text:user-field-decls>'
+            '<text:p>%%s</text:p>'
+            '</office:text></office:body></office:document-content>' % XMLNS
+        )
+        synthetic_odt = zipfile.ZipFile(BytesIO(synthetic.get_bytes()))
+        source = BytesIO()
+        with zipfile.ZipFile(source, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for info in synthetic_odt.infolist():
+                archive.writestr(info, synthetic_odt.read(info.filename))
+
+            archive.writestr('Object 1/content.xml', embedded % (
+                get_field_decl('document.title', 'string'),
+                get_field('document.title'),
+            ))
+            archive.writestr('Object 2/content.xml', embedded % ('', 'static'))
+
+        template = Template(source.getvalue())
+        assert template.templated_files == [
+            'content.xml', 'Object 1/content.xml'
+        ]
+
+        data = synthetic.get_data(2)
+        data['document'] = {'title': 'A chart'}
+        result = zipfile.ZipFile(BytesIO(template.compile().render_to_bytes(
+            data, images=synthetic.get_images()
+        )))
+        assert b'A chart' in result.read('Object 1/content.xml')
+
+        original = zipfile.ZipFile(source)
+        for filename in ['styles.xml', 'Object 2/content.xml']:
+            assert result.getinfo(filename).CRC == (
+                original.getinfo(filename).CRC
+            )
+
+        # the images are declared in the manifest
+        manifest = lxml.etree.fromstring(result.read('META-INF/manifest.xml'))
+        paths = manifest.xpath(
+            '//manifest:file-entry/@manifest:full-path',
+            namespaces=template.namespaces
+        )
+        assert paths[-1] == 'Pictures/py3o-image0'
+        assert len(paths) == len(set(paths))
@@ -21,7 +21,9 @@ setup(
     author_email='florent.aide@gmail.com',
     url='http://bitbucket.org/faide/py3o.template',
     license='MIT License',
-    packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+    packages=find_packages(
+        exclude=['ez_setup', 'examples', 'tests', 'benchmarks']
+    ),
     namespace_packages=['py3o'],
     include_package_data=True,
     zip_safe=True,
@@ -30,11 +32,10 @@ setup(
         'six >= 1.4',
         'lxml',
         'genshi >= 0.7',
-        'pyjon.utils > 0.6',
     ],
     entry_points="""
     # -*- Entry points: -*-
     """,
-    tests_require=['nose', 'nosexcover', 'mock'],
+    tests_require=['nose', 'nosexcover', 'mock', 'pyjon.utils > 0.6'],
     test_suite='nose.collector',
 )